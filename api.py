@@ -0,0 +1,307 @@
+"""HTTP API for the rewriter, as a plain ASGI app.
+
+Usage:
+    uvicorn api:app --port 8000
+    python api.py --port 8000 --workers 4
+
+Any ASGI server works; ``python api.py`` runs it with the optional
+``uvicorn`` package. The server keeps connections alive between requests
+(``--keep-alive`` seconds), so clients can send many requests over one
+connection. Requests and responses are JSON:
+
+- ``POST /rewrite`` with ``{"text": "..."}`` returns ``{"text": "..."}``.
+  With ``{"texts": [...]}`` it returns ``{"results": [...]}``, one
+  ``{"text": ...}`` or ``{"error": ...}`` per input, in order.
+- ``POST /rewrite/stream`` with ``{"text": "..."}`` streams the rewrite as
+  plain text while it is generated
+- ``GET /history?limit=20&before_id=N`` and ``GET /search?q=...&limit=20``
+- ``GET /export?format=csv&start_date=...&end_date=...&fields=id,original``
+  streams the whole history, archive included, as ``jsonl``, ``csv`` or
+  ``parquet``
+- ``GET /stats``, ``GET /metrics`` (Prometheus text) and ``GET /health``
+
+Set ``REWRITE_API_TOKEN`` to require ``Authorization: Bearer <token>``.
+A full engine queue answers 503 with ``Retry-After``, a missed deadline 504.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import os
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from engine import QueueFull
+from export import FORMATS
+from metrics import get_metrics
+from service import RewriteService, describe_error
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or []
+
+
+def _error_status(e):
+    if isinstance(e, HTTPError):
+        return e.status, e.headers
+    if isinstance(e, QueueFull):
+        return 503, [(b"retry-after", b"1")]
+    if isinstance(e, TimeoutError):
+        return 504, []
+    return 502, []
+
+
+class RewriteAPI:
+    """ASGI app serving a ``RewriteService``, created on first use"""
+
+    def __init__(self, service=None, token=None, max_body=None, max_batch=None):
+        self._service = service
+        self.token = token if token is not None else os.getenv("REWRITE_API_TOKEN", "")
+        self.max_body = max_body or int(os.getenv("REWRITE_API_MAX_BODY", str(1024 * 1024)))
+        self.max_batch = max_batch or int(os.getenv("REWRITE_API_MAX_BATCH", "100"))
+        self.routes = {
+            ("POST", "/rewrite"): self.rewrite,
+            ("POST", "/rewrite/stream"): self.rewrite_stream,
+            ("GET", "/history"): self.history,
+            ("GET", "/search"): self.search,
+            ("GET", "/export"): self.export,
+            ("GET", "/stats"): self.stats,
+            ("GET", "/metrics"): self.metrics,
+            ("GET", "/health"): self.health,
+        }
+
+    @property
+    def service(self):
+        if self._service is None:
+            self._service = RewriteService(data_dir=os.getenv("REWRITE_DATA_DIR", "data"))
+        return self._service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        try:
+            handler = self.routes.get((scope["method"], scope["path"]))
+            if handler is None:
+                allowed = any(path == scope["path"] for _, path in self.routes)
+                raise HTTPError(405 if allowed else 404, "Method not allowed" if allowed else "Not found")
+            self._authorize(scope)
+            await handler(scope, receive, send)
+        except Exception as e:
+            status, headers = _error_status(e)
+            if status >= 500:
+                get_metrics().record_error("api", e)
+            await self._send_json(send, {"error": str(e) or type(e).__name__}, status, headers)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    # Open the history before the first request instead of during it
+                    await asyncio.get_running_loop().run_in_executor(None, lambda: self.service)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._service is not None:
+                    self._service.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _authorize(self, scope):
+        if not self.token or scope["path"] == "/health":
+            return
+        headers = dict(scope["headers"])
+        expected = f"Bearer {self.token}".encode()
+        if not hmac.compare_digest(headers.get(b"authorization", b""), expected):
+            raise HTTPError(401, "Missing or wrong bearer token", [(b"www-authenticate", b"Bearer")])
+
+    async def _read_json(self, receive):
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if len(body) > self.max_body:
+                raise HTTPError(413, f"Request body is over {self.max_body} bytes")
+            if not message.get("more_body"):
+                break
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise HTTPError(400, "Request body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return data
+
+    @staticmethod
+    def _text(data, field="text"):
+        text = data.get(field)
+        if not isinstance(text, str) or not text.strip():
+            raise HTTPError(400, f'"{field}" must be a non-empty string')
+        return text
+
+    @staticmethod
+    def _query(scope):
+        return {key: values[-1] for key, values in
+                parse_qs(scope.get("query_string", b"").decode()).items()}
+
+    @staticmethod
+    def _int(query, name, default, minimum=1):
+        try:
+            value = int(query.get(name, default)) if query.get(name, "") != "" else default
+        except ValueError:
+            raise HTTPError(400, f'"{name}" must be an integer')
+        # A negative LIMIT means "no limit" to SQLite and a wrong slice to the others
+        if value is not None and value < minimum:
+            raise HTTPError(400, f'"{name}" must be at least {minimum}')
+        return value
+
+    @staticmethod
+    def _date(query, name):
+        value = query.get(name) or None
+        if value is not None:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPError(400, f'"{name}" must be a YYYY-MM-DD date')
+        return value
+
+    async def _send_json(self, send, data, status=200, headers=()):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        await self._send(send, body, status, b"application/json", headers)
+
+    @staticmethod
+    async def _send(send, body, status, content_type, headers=()):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", content_type),
+                                (b"content-length", str(len(body)).encode())] + list(headers)})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _call(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def rewrite(self, scope, receive, send):
+        data = await self._read_json(receive)
+        if "texts" not in data:
+            text = self._text(data)
+            rewritten = await asyncio.wrap_future(self.service.submit(text))
+            await self._send_json(send, {"text": rewritten})
+            return
+        texts = data["texts"]
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            raise HTTPError(400, '"texts" must be a list of strings')
+        if len(texts) > self.max_batch:
+            raise HTTPError(413, f"At most {self.max_batch} texts per request")
+        results = await asyncio.gather(*(asyncio.wrap_future(self.service.submit(text))
+                                         for text in texts if text.strip()), return_exceptions=True)
+        results = iter(results)
+        output = []
+        for text in texts:
+            result = next(results) if text.strip() else ""
+            output.append({"error": describe_error(result)} if isinstance(result, Exception)
+                          else {"text": result})
+        await self._send_json(send, {"results": output})
+
+    async def _send_stream(self, send, chunks, content_type, headers=(), encode=None):
+        """Send a blocking iterator's chunks as they come, pulling each on the service's threads"""
+        loop = asyncio.get_running_loop()
+
+        def pull():
+            return next(chunks, None)
+
+        # Errors before the first chunk can still get a proper status code
+        chunk = await loop.run_in_executor(self.service.executor, pull)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type)] + list(headers)})
+        try:
+            while chunk is not None:
+                await send({"type": "http.response.body", "body": encode(chunk) if encode else chunk,
+                            "more_body": True})
+                chunk = await loop.run_in_executor(self.service.executor, pull)
+        except Exception as e:
+            # Too late for a status code; end the body so the client sees a short response
+            get_metrics().record_error("api", e)
+        finally:
+            try:
+                chunks.close()
+            except ValueError:
+                # Cancelled while a pull is still running on its thread
+                pass
+        await send({"type": "http.response.body", "body": b""})
+
+    async def rewrite_stream(self, scope, receive, send):
+        text = self._text(await self._read_json(receive))
+        await self._send_stream(send, self.service.stream(text), b"text/plain; charset=utf-8",
+                                encode=lambda chunk: chunk.encode("utf-8"))
+
+    async def history(self, scope, receive, send):
+        query = self._query(scope)
+        limit = min(self._int(query, "limit", 20), 500)
+        before_id = self._int(query, "before_id", None)
+        await self._send_json(send, {"entries": await self._call(self.service.history, limit, before_id)})
+
+    async def search(self, scope, receive, send):
+        query = self._query(scope)
+        if not query.get("q", "").strip():
+            raise HTTPError(400, '"q" is required')
+        limit = min(self._int(query, "limit", 20), 500)
+        entries = await self._call(self.service.search, query["q"], limit,
+                                   self._date(query, "start_date"), self._date(query, "end_date"))
+        await self._send_json(send, {"entries": entries})
+
+    async def export(self, scope, receive, send):
+        query = self._query(scope)
+        fmt = query.get("format", "jsonl")
+        fields = query["fields"].split(",") if query.get("fields") else None
+        try:
+            chunks = self.service.export(fmt, query.get("start_date"), query.get("end_date"), fields)
+        except (ValueError, RuntimeError) as e:
+            raise HTTPError(400, str(e))
+        content_type, extension = FORMATS[fmt]
+        disposition = f'attachment; filename="history{extension}"'.encode()
+        await self._send_stream(send, chunks, content_type.encode(),
+                                [(b"content-disposition", disposition)])
+
+    async def stats(self, scope, receive, send):
+        await self._send_json(send, await self._call(self.service.stats))
+
+    async def metrics(self, scope, receive, send):
+        body = get_metrics().to_prometheus().encode("utf-8")
+        await self._send(send, body, 200, b"text/plain; version=0.0.4")
+
+    async def health(self, scope, receive, send):
+        await self._send_json(send, {"status": "ok"})
+
+
+app = RewriteAPI()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="server processes")
+    parser.add_argument("--keep-alive", type=int, default=30,
+                        help="seconds an idle connection is kept open")
+    args = parser.parse_args()
+    if uvicorn is None:
+        parser.exit(1, "python api.py needs the uvicorn package (pip install uvicorn), "
+                       "or serve api:app with another ASGI server\n")
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers,
+                timeout_keep_alive=args.keep_alive, lifespan="on")
+
+
+if __name__ == "__main__":
+    main()
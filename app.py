@@ -1,21 +1,24 @@
 import os
 import streamlit as st
-import google.generativeai as genai
-from dotenv import load_dotenv
 import streamlit.components.v1 as components
-from auth import check_password
+from auth import check_password, current_user
+from bootstrap import load_env
 from user_data import UserHistory
-import time
+import llm
+import rewriter
+from metrics import get_metrics
 
-# Load environment variables
-load_dotenv()
+# Load environment variables (once per process, not on every rerun)
+load_env()
 
-# Configure Gemini API
-if 'GEMINI_API_KEY' in st.secrets:
-    genai.configure(api_key=st.secrets['GEMINI_API_KEY'])
-else:
-    st.error('Error: GEMINI_API_KEY not found in Streamlit secrets')
-    st.stop()
+# Set the Gemini API key (not needed with LLM_BACKEND=fake); the SDK itself
+# is only imported and configured when the first rewrite needs a model
+if llm.needs_api_key():
+    if 'GEMINI_API_KEY' in st.secrets:
+        llm.configure(st.secrets['GEMINI_API_KEY'])
+    else:
+        st.error('Error: GEMINI_API_KEY not found in Streamlit secrets')
+        st.stop()
 
 # Set page configuration
 st.set_page_config(
@@ -24,15 +27,21 @@ st.set_page_config(
     layout="wide"
 )
 
-def show_loading_message():
-    with st.spinner("🤖 Ruko jara... Sabar ka phal meetha hota hai"):
-        progress_bar = st.progress(0)
-        for i in range(100):
-            time.sleep(0.01)
-            progress_bar.progress(i + 1)
+STAGE_LABELS = {
+    "queued": "Queued",
+    "cache_hit": "Found in cache",
+    "similar_hit": "Reused the rewrite of a near-identical earlier text",
+    "request_sent": "Request sent to Gemini",
+    "first_token": "First words received",
+    "response_received": "Response received",
+    "done": "Done",
+}
 
 # Check authentication before showing anything
-if check_password():
+with get_metrics().timer("auth_check"):
+    authenticated = check_password()
+
+if authenticated:
     # Add custom CSS
     st.markdown("""
         <style>
@@ -86,41 +95,59 @@ if check_password():
         </div>
     """, unsafe_allow_html=True)
 
-    def rewrite_text(input_text):
+    def rewrite_text(input_text, stream=False, long_document=False, allow_similar=True):
+        # Drop the last rewrite's timings (and its similar-reuse marker) so a long
+        # document or a failed run never shows them against the new result
+        st.session_state.pop('timings', None)
         try:
-            # Create the model
-            generation_config = {
-                "temperature": 1,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 8192,
-                "response_mime_type": "text/plain",
-            }
-
-            model = genai.GenerativeModel(
-                model_name="gemini-2.0-flash-exp",
-                generation_config=generation_config,
-            )
-
-            chat_session = model.start_chat(history=[])
-            
-            # Show loading message while processing
-            with st.spinner("🤖 Ruko jara... Sabar ka phal meetha hota hai"):
-                # Construct the prompt
-                prompt = f'''make this in very natural language that normal man speck in active voice in hindi just provide the output text:
-
-                {input_text}'''
-                
-                # Get response from Gemini
-                response = chat_session.send_message(prompt)
-                
-                # Add to history when successful
-                if response.text:
-                    user_history = UserHistory()
-                    user_history.add_entry(input_text, response.text)
-                    
-                return response.text
+            # Each user's rewrites go to their own history shard
+            user_history = UserHistory.shared(user=current_user())
+            if long_document:
+                # One status line per chunk instead of a single spinner
+                progress_bar = st.progress(0.0, text="Splitting document...")
+                status_lines = []
+                finished = set()
+                icons = {"queued": "⏳", "retrying": "🔁", "done": "✅", "cached": "⚡", "failed": "❌"}
+
+                def on_progress(index, total, status):
+                    while len(status_lines) < total:
+                        status_lines.append(st.empty())
+                    status_lines[index].caption(f"{icons[status]} Part {index + 1} of {total}: {status}")
+                    if status in ("done", "cached"):
+                        finished.add(index)
+                    progress_bar.progress(len(finished) / total,
+                                          text=f"Rewritten {len(finished)} of {total} parts")
+
+                return rewriter.rewrite_document(input_text, user_history,
+                                                 on_progress=on_progress)
+
+            # Report each real pipeline stage as it happens, with its measured time
+            output = st.empty()
+            timings = {}
+            with st.status("🤖 Ruko jara... Sabar ka phal meetha hota hai") as status:
+                def on_event(stage, elapsed_ms):
+                    timings[stage] = elapsed_ms
+                    status.write(f"{STAGE_LABELS[stage]} · {elapsed_ms:,.0f} ms")
+                    if stage == "done":
+                        status.update(label=f"Rewritten in {elapsed_ms / 1000:.2f} s", state="complete")
+
+                if stream:
+                    # Render the rewrite into the output area as chunks arrive
+                    text = ""
+                    for chunk in rewriter.stream_rewrite(input_text, user_history,
+                                                         on_event=on_event,
+                                                         allow_similar=allow_similar):
+                        text += chunk
+                        output.markdown(text)
+                else:
+                    text = rewriter.rewrite_text(input_text, user_history, on_event=on_event,
+                                                 allow_similar=allow_similar)
+            st.session_state.timings = timings
+            return text
         except Exception as e:
+            # Count failed requests by type and tell the user what went wrong
+            get_metrics().record_error("request", e)
+            st.session_state.last_error = type(e).__name__
             return None
 
     # Original text input
@@ -130,6 +157,8 @@ if check_password():
         height=150,
         placeholder="Enter the text you want to rewrite..."
     )
+    stream_output = st.toggle("Stream output as it is written", value=True)
+    long_document = st.toggle("Long document mode (rewrite in parallel parts)", value=False)
 
     # Center the rewrite button
     col1, col2, col3 = st.columns([1, 1, 1])
@@ -142,13 +171,17 @@ if check_password():
     if 'button_clicked' in st.session_state and st.session_state.button_clicked:
         if input_text:
             if st.session_state.get('processing', False):
-                rewritten_text = rewrite_text(input_text)
+                rewritten_text = rewrite_text(input_text, stream=stream_output,
+                                              long_document=long_document,
+                                              allow_similar=not st.session_state.pop('skip_similar', False))
                 if rewritten_text:
                     st.session_state.processing = False
                     st.session_state.result = rewritten_text
                     st.rerun()
                 else:
-                    st.error("😕 Something went wrong. Please try again.")
+                    error_type = st.session_state.pop('last_error', None)
+                    st.error(f"😕 Something went wrong{f' ({error_type})' if error_type else ''}. "
+                             "Please try again.")
                     st.session_state.processing = False
             
             if not st.session_state.get('processing', False):
@@ -160,6 +193,16 @@ if check_password():
                         height=150,
                         key="rewritten_text"
                     )
+                    timings = st.session_state.get('timings')
+                    if timings:
+                        st.caption(" · ".join(f"{STAGE_LABELS[stage]} {elapsed_ms:,.0f} ms"
+                                              for stage, elapsed_ms in timings.items()
+                                              if stage != "queued"))
+                        # A near-duplicate was reused; offer a fresh rewrite instead
+                        if "similar_hit" in timings and st.button("🔄 Rewrite from scratch"):
+                            st.session_state.skip_similar = True
+                            st.session_state.processing = True
+                            st.rerun()
                     components.html("""
                         <div class="copy-button-container">
                             <button onclick="copyText()" class="copy-button">
@@ -0,0 +1,170 @@
+"""Compressed monthly archive for history entries past the retention window.
+
+Entries older than ``HISTORY_RETENTION_DAYS`` are moved out of the hot
+history into ``data/archive/history-YYYY-MM.jsonl.zst`` (zstd, when the
+``zstandard`` package is installed) or ``.jsonl.gz``. Each archiving run
+appends a new compressed member to the month's segment, and
+``archive/index.json`` records the id range and count of every segment, so
+paging into the archive only decompresses the months it needs.
+
+Stats and rollups are left alone when entries are archived, so the usage
+dashboard keeps counting them.
+
+Run ``python archive.py --days 90`` (e.g. from cron) to apply retention
+to the shared history and every user's shard without waiting for the app
+to start.
+"""
+import argparse
+import gzip
+import io
+import itertools
+import json
+import os
+from collections import deque
+
+from storage import FileLock, _read_json, _write_json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _open_segment(path, mode):
+    """Open a segment for reading ("r") or appending a new member ("a") as text"""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"Reading {path} needs the zstandard package")
+        raw = open(path, mode + "b")
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            stream = zstandard.ZstdCompressor(level=10).stream_writer(raw)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return gzip.open(path, mode + "t", encoding='utf-8')
+
+
+class HistoryArchive:
+    """Month-partitioned, compressed, append-only store of archived entries"""
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.index_file = os.path.join(archive_dir, "index.json")
+
+    def _index(self):
+        return _read_json(self.index_file, None) or {"last_id": 0, "months": {}}
+
+    @property
+    def last_id(self):
+        """Highest entry id archived so far"""
+        return self._index()["last_id"]
+
+    def months(self):
+        """Return {month: {file, count, first_id, last_id}}, oldest month first"""
+        return dict(sorted(self._index()["months"].items()))
+
+    def count(self):
+        return sum(segment["count"] for segment in self._index()["months"].values())
+
+    def append(self, entries):
+        """Archive entries (in id order); ids already archived are skipped. Returns the count"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with FileLock.open(os.path.join(self.archive_dir, "archive.lock")):
+            index = self._index()
+            last_id = index["last_id"]
+            fresh = (entry for entry in entries if entry['id'] > last_id)
+            archived = 0
+            # Entries arrive in id order, so each month is one contiguous run
+            for month, month_entries in itertools.groupby(fresh, key=lambda entry: entry['timestamp'][:7]):
+                segment = index["months"].get(month)
+                if segment is None:
+                    suffix = ".jsonl.zst" if zstandard is not None else ".jsonl.gz"
+                    segment = index["months"][month] = {
+                        "file": f"history-{month}{suffix}", "count": 0, "first_id": None, "last_id": 0
+                    }
+                with _open_segment(os.path.join(self.archive_dir, segment["file"]), "a") as f:
+                    for entry in month_entries:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                        if segment["first_id"] is None:
+                            segment["first_id"] = entry['id']
+                        segment["last_id"] = entry['id']
+                        segment["count"] += 1
+                        archived += 1
+                index["last_id"] = max(index["last_id"], segment["last_id"])
+            if archived:
+                _write_json(self.index_file, index, indent=2)
+            return archived
+
+    def clear(self):
+        if not os.path.exists(self.archive_dir):
+            return
+        with FileLock.open(os.path.join(self.archive_dir, "archive.lock")):
+            for segment in self._index()["months"].values():
+                path = os.path.join(self.archive_dir, segment["file"])
+                if os.path.exists(path):
+                    os.remove(path)
+            if os.path.exists(self.index_file):
+                os.remove(self.index_file)
+
+    def iter_month(self, month):
+        """Yield one month's archived entries oldest first, decompressing as it goes"""
+        segment = self._index()["months"].get(month)
+        if segment is None:
+            return
+        last_id = 0
+        with _open_segment(os.path.join(self.archive_dir, segment["file"]), "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                # A member re-appended after a crash repeats ids we've already yielded
+                if entry['id'] > last_id:
+                    last_id = entry['id']
+                    yield entry
+
+    def iter_entries(self, start_date=None, end_date=None):
+        """Yield archived entries oldest first, only opening months in the date range"""
+        for month in self.months():
+            if (start_date and month < start_date[:7]) or (end_date and month > end_date[:7]):
+                continue
+            for entry in self.iter_month(month):
+                date = entry['timestamp'][:10]
+                if (start_date and date < start_date) or (end_date and date > end_date):
+                    continue
+                yield entry
+
+    def get_page(self, limit, before_id=None):
+        """Return up to ``limit`` archived entries newest first, all with ids below ``before_id``"""
+        page = []
+        for month, segment in reversed(self.months().items()):
+            if len(page) >= limit:
+                break
+            if before_id is not None and segment["first_id"] >= before_id:
+                continue
+            newest = deque(maxlen=limit - len(page))
+            for entry in self.iter_month(month):
+                if before_id is not None and entry['id'] >= before_id:
+                    break
+                newest.append(entry)
+            page.extend(reversed(newest))
+        return page
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive history entries older than N days")
+    parser.add_argument("--days", type=int, required=True, help="days of history to keep hot")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--storage", default=None, help="json, journal, sqlite or mapped")
+    args = parser.parse_args()
+
+    from user_data import UserHistory, shard_dirs
+    # The shared history and every user's shard
+    for data_dir in shard_dirs(args.data_dir):
+        user_history = UserHistory(data_dir, storage=args.storage)
+        archived = user_history.apply_retention(args.days)
+        print(f"{data_dir}: archived {archived} entries; {user_history.archive.count()} archived in total")
+        user_history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,10 @@ def apply_theme():
         </script>
     """, unsafe_allow_html=True)
 
+def current_user():
+    """Name of the signed-in user, or None for sessions signed in before names were kept"""
+    return st.session_state.get("user")
+
 def check_password():
     """Returns `True` if the user had the correct password."""
     initialize_theme()
@@ -30,8 +34,10 @@ def check_password():
            hashlib.sha256(str.encode(st.session_state["password"])).hexdigest() == "240be518fabd2724ddb6f04eeb1da5967448d7e831c08c8fa822809f74c720a9":
             st.session_state["password_correct"] = True
             st.session_state["authenticated"] = True
+            # Picks the user's own history shard
+            st.session_state["user"] = st.session_state["username"].lower()
             del st.session_state["password"]  # Don't store password
-            del st.session_state["username"]  # Don't store username
+            del st.session_state["username"]  # Don't keep the login widget's value
         else:
             st.session_state["password_correct"] = False
 
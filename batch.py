@@ -0,0 +1,232 @@
+"""Batch rewriting of uploaded CSV / TXT / JSONL files.
+
+Rows are streamed from the input file, rewritten concurrently under a
+token-bucket rate limit and appended to the output file in input order.
+A checkpoint records how many rows (and output bytes) are safely written,
+so a crashed job resumes where it stopped instead of starting over.
+"""
+import csv
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import rewriter
+from user_data import UserHistory
+
+FORMATS = ("csv", "jsonl", "txt")
+
+
+class TokenBucket:
+    """Allow ``rate`` acquisitions per second with bursts of up to ``capacity``"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                self._cond.wait((1 - self._tokens) / self.rate)
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename)[1].lower().lstrip(".")
+    if extension not in FORMATS:
+        raise ValueError(f"Unsupported file type: .{extension}")
+    return extension
+
+
+def iter_rows(path, fmt, text_field="text"):
+    """Yield (row, text) pairs without reading the whole file into memory"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                yield row, row.get(text_field) or ""
+        elif fmt == "jsonl":
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield row, row.get(text_field) or ""
+        else:
+            for line in f:
+                text = line.rstrip("\r\n")
+                yield text, text
+
+
+def count_rows(path, fmt):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if fmt == "csv":
+            return sum(1 for _ in csv.DictReader(f))
+        if fmt == "jsonl":
+            return sum(1 for line in f if line.strip())
+        return sum(1 for _ in f)
+
+
+class BatchJob:
+    """A resumable batch rewrite of one input file, kept under ``<batch dir>/<job id>``
+
+    The Batch Rewrite page uses the signed-in user's ``data/users/<name>/batch``.
+    """
+
+    def __init__(self, job_dir, fmt, text_field="text", workers=4, rate=5.0,
+                 flush_every=50, retries=2, user_history=None):
+        self.job_dir = job_dir
+        self.fmt = fmt
+        self.text_field = text_field
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.flush_every = flush_every
+        self.retries = retries
+        self.user_history = user_history or UserHistory.shared()
+        self.input_path = os.path.join(job_dir, f"input.{fmt}")
+        self.output_path = os.path.join(job_dir, f"output.{fmt}")
+        self.checkpoint_path = os.path.join(job_dir, "checkpoint.json")
+
+    @classmethod
+    def from_upload(cls, data, filename, batch_dir=os.path.join("data", "batch"), **kwargs):
+        """Create the job for an uploaded file; uploading the same bytes again resumes it"""
+        fmt = detect_format(filename)
+        job_id = hashlib.sha256(data).hexdigest()[:16]
+        job_dir = os.path.join(batch_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        job = cls(job_dir, fmt, **kwargs)
+        if not os.path.exists(job.input_path):
+            with open(job.input_path, 'wb') as f:
+                f.write(data)
+        return job
+
+    def load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {"rows_done": 0, "output_bytes": 0, "failed": 0}
+
+    def _save_checkpoint(self, checkpoint):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def total_rows(self):
+        return count_rows(self.input_path, self.fmt)
+
+    def _rewrite_row(self, text):
+        """Rewrite one row, retrying on errors; returns (rewritten, cached, error)"""
+        if not text.strip():
+            return "", False, None
+        error = None
+        for _ in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                rewritten, cached = rewriter.rewrite_one(text, user_history=self.user_history)
+                return rewritten, cached, None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        return "", False, error
+
+    def _open_output(self, checkpoint):
+        """Open the output for appending, dropping anything written after the checkpoint"""
+        output = open(self.output_path, 'a+', encoding='utf-8', newline='')
+        output.truncate(checkpoint["output_bytes"])
+        output.seek(0, os.SEEK_END)
+        return output
+
+    def _write_row(self, writer, output, row, rewritten, error):
+        if self.fmt == "csv":
+            writer.writerow({**row, "rewritten": rewritten, "error": error or ""})
+        elif self.fmt == "jsonl":
+            output.write(json.dumps({**row, "rewritten": rewritten, "error": error},
+                                    ensure_ascii=False) + "\n")
+        else:
+            output.write(rewritten.replace("\n", " ") + "\n")
+
+    def run(self, on_progress=None):
+        """Process the remaining rows; ``on_progress(rows_done, failed)`` runs on the calling thread"""
+        checkpoint = self.load_checkpoint()
+        output = self._open_output(checkpoint)
+        writer = None
+        # Skip rows a previous run already wrote
+        rows = itertools.islice(iter_rows(self.input_path, self.fmt, self.text_field),
+                                checkpoint["rows_done"], None)
+        try:
+            pending = {}
+            finished = {}
+            next_to_write = checkpoint["rows_done"]
+            next_to_read = checkpoint["rows_done"]
+            history_batch = []
+            cache_hits = 0
+            exhausted = False
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                while True:
+                    # Keep a bounded number of rows in flight
+                    while not exhausted and len(pending) + len(finished) < self.workers * 2:
+                        try:
+                            row, text = next(rows)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        if writer is None and self.fmt == "csv":
+                            writer = csv.DictWriter(output, fieldnames=list(row) + ["rewritten", "error"])
+                            if checkpoint["output_bytes"] == 0:
+                                writer.writeheader()
+                        pending[pool.submit(self._rewrite_row, text)] = (next_to_read, row, text)
+                        next_to_read += 1
+                    if not pending:
+                        break
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index, row, text = pending.pop(future)
+                        finished[index] = (row, text) + future.result()
+
+                    # Write completed rows in input order
+                    while next_to_write in finished:
+                        row, text, rewritten, cached, error = finished.pop(next_to_write)
+                        self._write_row(writer, output, row, rewritten, error)
+                        if error:
+                            checkpoint["failed"] += 1
+                        elif cached:
+                            cache_hits += 1
+                        elif rewritten:
+                            history_batch.append((text, rewritten))
+                        next_to_write += 1
+
+                        if (next_to_write - checkpoint["rows_done"]) >= self.flush_every:
+                            self._flush(output, checkpoint, next_to_write, history_batch, cache_hits)
+                            history_batch, cache_hits = [], 0
+                    if on_progress:
+                        on_progress(next_to_write, checkpoint["failed"])
+
+            self._flush(output, checkpoint, next_to_write, history_batch, cache_hits)
+            return checkpoint
+        finally:
+            output.close()
+
+    def _flush(self, output, checkpoint, rows_done, history_batch, cache_hits):
+        """Make written rows durable, checkpoint them, then record their history in bulk
+
+        Checkpointing first means a crash in between leaves these rows out of
+        the history rather than adding them a second time on resume.
+        """
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint["rows_done"] = rows_done
+        checkpoint["output_bytes"] = os.fstat(output.fileno()).st_size
+        self._save_checkpoint(checkpoint)
+        self.user_history.add_entries(history_batch)
+        if cache_hits:
+            self.user_history.increment("cache_hits", cache_hits)
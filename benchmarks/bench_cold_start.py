@@ -0,0 +1,127 @@
+"""Measure each page's cold start: what it imports and how long the first run takes.
+
+Usage:
+    python benchmarks/bench_cold_start.py
+    python benchmarks/bench_cold_start.py --pages app.py,pages/history.py --repeat 5
+
+Every page runs in a fresh ``python -X importtime`` process, signed out
+(the login screen) and signed in, through Streamlit's ``AppTest``. Each run
+uses a placeholder Gemini key and an empty data directory. Streamlit and
+the test harness are imported first and not counted. Reported per run:
+
+- first run: milliseconds for the page's first script run, imports included
+- imports: milliseconds spent importing modules the page pulled in, from
+  ``-X importtime``, plus the slowest few top-level imports
+- whether the Gemini SDK (``google.generativeai``), ``google.api_core``
+  (which brings in grpc) or plotly got loaded
+
+Numbers are medians over ``--repeat`` processes.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ("app.py", "pages/history.py", "pages/usage_stats.py", "pages/batch_rewrite.py")
+HEAVY = ("google.generativeai", "google.api_core", "plotly")
+MARKER = "cold-start: page run begins"
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def child(page, signed_in):
+    sys.path.insert(0, ROOT)
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, page), default_timeout=60)
+    at.secrets['GEMINI_API_KEY'] = "benchmark-key"
+    if signed_in:
+        at.session_state['authenticated'] = True
+        at.session_state['theme'] = "light"
+    before = set(sys.modules)
+    print(MARKER, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    at.run()
+    first_run_ms = (time.perf_counter() - start) * 1000
+    loaded = set(sys.modules) - before
+    print(json.dumps({
+        "first_run_ms": first_run_ms,
+        "modules": len(loaded),
+        # Streamlit may already hold the top-level package, so match submodules too
+        "heavy": [name for name in HEAVY
+                  if any(module == name or module.startswith(name + ".") for module in loaded)],
+        "exceptions": [str(e.value) for e in at.exception],
+    }))
+
+
+def parse_imports(stderr):
+    """(total ms, [(ms, module)] per top-level import) from ``-X importtime`` output after the marker"""
+    top_level = []
+    counting = False
+    for line in stderr.splitlines():
+        if line.startswith(MARKER):
+            counting = True
+            continue
+        match = IMPORT_LINE.match(line)
+        if counting and match and not match.group(3):
+            top_level.append((int(match.group(2)) / 1000, match.group(4)))
+    return sum(ms for ms, _ in top_level), sorted(top_level, reverse=True)
+
+
+def measure(page, signed_in):
+    with tempfile.TemporaryDirectory() as tmp:
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", __file__, "--child", page,
+             "signed-in" if signed_in else "signed-out"],
+            cwd=tmp, capture_output=True, text=True, check=True,
+            env={**os.environ, "LLM_BACKEND": "gemini", "REWRITE_CACHE_DISK": "0"})
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["import_ms"], result["top_imports"] = parse_imports(process.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default=",".join(PAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=3, help="slowest top-level imports to list")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], args.child[1] == "signed-in")
+        return
+
+    results = {}
+    print(f"{'page':<24} {'state':<11} {'first run ms':>12} {'imports ms':>11} {'modules':>8}  heavy")
+    for page in args.pages.split(","):
+        for signed_in in (False, True):
+            runs = [measure(page, signed_in) for _ in range(args.repeat)]
+            state = "signed in" if signed_in else "login"
+            summary = {
+                "first_run_ms": round(statistics.median(run["first_run_ms"] for run in runs), 1),
+                "import_ms": round(statistics.median(run["import_ms"] for run in runs), 1),
+                "modules": runs[-1]["modules"],
+                "heavy": runs[-1]["heavy"],
+            }
+            results.setdefault(page, {})[state] = summary
+            print(f"{page:<24} {state:<11} {summary['first_run_ms']:>12.1f} {summary['import_ms']:>11.1f} "
+                  f"{summary['modules']:>8}  {', '.join(summary['heavy']) or '-'}")
+            slowest = runs[-1]["top_imports"][:args.top]
+            if slowest:
+                print(f"{'':<37}" + "  ".join(f"{name} {ms:.0f}" for ms, name in slowest))
+            if runs[-1]["exceptions"]:
+                print(f"{'':<37}exceptions: {runs[-1]['exceptions']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
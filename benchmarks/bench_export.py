@@ -0,0 +1,86 @@
+"""Measure history export speed and memory as the history grows.
+
+Usage:
+    python benchmarks/bench_export.py --sizes 10000,100000
+    python benchmarks/bench_export.py --sizes 100000 --storage sqlite --formats parquet --archived 0.5
+
+Seeds a history of each size in each storage mode and moves the oldest
+``--archived`` share of it into the compressed archive. Each format is
+then exported twice, with the output discarded as it is produced: once
+timed (rows per second, MB written), and once under ``tracemalloc`` for
+the peak memory the export allocates on top of the already-open history
+(Python objects only, not pyarrow's buffers). The peak should stay flat
+from one size to the next.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_load import prepare, seed  # noqa: E402
+from export import FORMATS, _pyarrow, iter_export  # noqa: E402
+from user_data import UserHistory  # noqa: E402
+
+
+def run(user_history, fmt):
+    written = 0
+    for data in iter_export(user_history, fmt):
+        written += len(data)
+    return written
+
+
+def archive_share(user_history, size, share):
+    """Archive about the oldest ``share`` of a seeded history, cut at a day boundary as retention does"""
+    if share <= 0:
+        return 0
+    # Seeded entries are 30 s apart from 2024-01-01
+    cutoff = (datetime(2024, 1, 1) + timedelta(seconds=30 * size * share)).strftime("%Y-%m-%d")
+    return user_history.backend.archive_before(cutoff, user_history.archive)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--storage", default="journal,sqlite,mapped")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--archived", type=float, default=0.0, help="share of the history to archive first")
+    args = parser.parse_args()
+
+    formats = args.formats.split(",")
+    if "parquet" in formats and _pyarrow() is None:
+        print("pyarrow is not installed; skipping parquet")
+        formats.remove("parquet")
+    print(f"{'entries':>9} {'storage':<8} {'format':<8} {'archived':>9} {'rows/s':>10} {'MB':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            seed_dir = os.path.join(tmp, f"seed-{size}")
+            seed(seed_dir, size)
+            for storage in args.storage.split(","):
+                data_dir = os.path.join(tmp, f"{storage}-{size}")
+                prepare(seed_dir, data_dir, storage)
+                user_history = UserHistory(data_dir, storage=storage)
+                archived = archive_share(user_history, size, args.archived)
+                for fmt in formats:
+                    start = time.perf_counter()
+                    written = run(user_history, fmt)
+                    elapsed = time.perf_counter() - start
+
+                    tracemalloc.start()
+                    run(user_history, fmt)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    print(f"{size:>9,} {storage:<8} {fmt:<8} {archived:>9,} {size / elapsed:>10,.0f} "
+                          f"{written / 2**20:>8.1f} {peak / 2**20:>8.2f}")
+                user_history.close()
+                shutil.rmtree(data_dir)
+            shutil.rmtree(seed_dir)
+
+
+if __name__ == "__main__":
+    main()
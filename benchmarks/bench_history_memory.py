@@ -0,0 +1,91 @@
+"""Compare the memory held by history as a list of dicts and as a CompactHistory.
+
+Usage:
+    python benchmarks/bench_history_memory.py --entries 100000,1000000
+    python benchmarks/bench_history_memory.py --entries 100000 --text hindi
+
+Builds the same synthetic entries (shaped like ``UserHistory._new_entry``
+output) both ways and reports the bytes each keeps alive according to
+tracemalloc, plus how long it takes to build the history, read the newest
+page and walk every entry. Entries are generated one at a time so the
+source data isn't counted.
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact_history import CompactHistory  # noqa: E402
+
+WORDS = {
+    "english": ("the report market weather school health budget election travel cricket "
+                "music policy farmer river city train village festival science movie").split(),
+    "hindi": ("नमस्ते दुनिया हिंदी भाषा लिखें समाचार सरकार विकास शिक्षा स्वास्थ्य किसान "
+              "बाज़ार मौसम चुनाव यात्रा संगीत नदी शहर गाँव त्योहार").split(),
+}
+
+
+def generate(entries, text):
+    rng = random.Random(42)
+    words = WORDS[text]
+    start = datetime(2024, 1, 1)
+    for i in range(entries):
+        original = " ".join(rng.choices(words, k=rng.randint(8, 30)))
+        rewritten = " ".join(rng.choices(words, k=rng.randint(8, 30)))
+        latency_ms = round(rng.uniform(300, 6000), 1)
+        yield {
+            'id': i + 1,
+            'timestamp': (start + timedelta(seconds=30 * i)).strftime("%Y-%m-%d %H:%M:%S"),
+            'original': original,
+            'rewritten': rewritten,
+            'char_count': len(original),
+            'ttft_ms': round(latency_ms / 4, 1),
+            'latency_ms': latency_ms
+        }
+
+
+def measure(build, entries, text):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    history = build(generate(entries, text))
+    build_s = time.perf_counter() - start
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    page = history[-20:]
+    page_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    characters = sum(len(entry['original']) for entry in history)
+    scan_s = time.perf_counter() - start
+    assert len(page) == 20 and characters
+    return history, held, build_s, page_ms, scan_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", default="100000,1000000")
+    parser.add_argument("--text", default="english,hindi")
+    args = parser.parse_args()
+
+    print(f"{'entries':>9} {'text':<8} {'layout':<15} {'held':>10} {'per entry':>10} "
+          f"{'build':>8} {'last page':>10} {'full scan':>10}")
+    for entries in (int(n) for n in args.entries.split(",")):
+        for text in args.text.split(","):
+            for layout, build in (("list of dicts", list), ("CompactHistory", CompactHistory)):
+                history, held, build_s, page_ms, scan_s = measure(build, entries, text)
+                del history
+                print(f"{entries:>9,} {text:<8} {layout:<15} {held / 2**20:>7.1f} MB "
+                      f"{held / entries:>8.0f} B {build_s:>7.2f}s {page_ms:>8.3f}ms {scan_s:>9.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measure UserHistory.add_entry latency as the stored history grows.
+
+Usage:
+    python benchmarks/bench_history_writes.py --sizes 1000,100000,1000000
+
+Each size gets a fresh temporary data directory pre-seeded with that many
+entries, then ``--writes`` entries are added one at a time. With the
+journal store the per-write latency stays flat; the json store rewrites
+both files on every write so it grows with the history size.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import new_stats, apply_entry  # noqa: E402
+from user_data import UserHistory  # noqa: E402
+
+
+def seed(data_dir, size):
+    """Write a snapshot with ``size`` entries straight to disk"""
+    os.makedirs(data_dir, exist_ok=True)
+    stats = new_stats()
+    history = []
+    for i in range(size):
+        entry = {
+            'id': i + 1,
+            'timestamp': "2024-01-01 12:00:00",
+            'original': f"original text number {i}",
+            'rewritten': f"rewritten text number {i}",
+            'char_count': 24
+        }
+        history.append(entry)
+        apply_entry(stats, entry)
+    with open(os.path.join(data_dir, "user_history.json"), 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False)
+    with open(os.path.join(data_dir, "usage_stats.json"), 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(storage, size, writes):
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, "data")
+        seed(data_dir, size)
+        user_history = UserHistory(data_dir=data_dir, storage=storage)
+        samples = []
+        for i in range(writes):
+            start = time.perf_counter()
+            user_history.add_entry(f"benchmark input {i}", f"benchmark output {i}")
+            samples.append((time.perf_counter() - start) * 1000)
+        user_history.close()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--storage", default="journal,sqlite,json")
+    parser.add_argument("--json-max-size", type=int, default=100000,
+                        help="skip the json store above this size (it is very slow)")
+    args = parser.parse_args()
+
+    print(f"{'storage':<8} {'entries':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for storage in args.storage.split(","):
+            if storage == "json" and size > args.json_max_size:
+                continue
+            samples = run(storage, size, args.writes)
+            print(f"{storage:<8} {size:>10,} {percentile(samples, 50):>9.3f} "
+                  f"{percentile(samples, 99):>9.3f} {max(samples):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
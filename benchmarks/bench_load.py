@@ -0,0 +1,306 @@
+"""End-to-end load benchmark against the offline fake model.
+
+Usage:
+    python benchmarks/bench_load.py
+    python benchmarks/bench_load.py --sizes 10000,1000000 --clients 32 --writers 8
+    python benchmarks/bench_load.py --json results.json
+    python benchmarks/bench_load.py --baseline results.json --tolerance 0.2
+
+No Gemini key is needed: the model is ``fake_llm.FakeModel``, with its
+latency, output speed and error rate set by the ``--latency-ms``,
+``--latency-sigma``, ``--tokens-per-sec`` and ``--error-rate`` options.
+Four phases run:
+
+- rewrite: ``--clients`` threads send ``--requests`` rewrites through
+  ``rewriter`` (engine, retries, fallbacks and history writes included)
+- writes: ``--writers`` threads each call ``UserHistory.add_entry``
+  ``--writes`` times against a history already holding each size
+- load: a fresh process per size and storage opens the history and reads
+  the newest page, reporting time and the resident memory it adds
+- stats: the same process times the usage-stats aggregations
+
+Throughput, p50/p95/p99 latency and memory are printed. ``--json`` saves
+them. ``--baseline`` compares against a saved run and exits with status 1
+if a metric got worse by more than ``--tolerance``.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_history_memory import generate  # noqa: E402
+from metrics import percentile  # noqa: E402
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def summarize(samples, elapsed_s):
+    """Throughput and latency percentiles for per-operation durations in ms"""
+    return {
+        "ops": len(samples),
+        "ops_per_s": round(len(samples) / elapsed_s, 1) if elapsed_s else None,
+        **{f"p{int(q * 100)}_ms": round(percentile(samples, q), 3) if samples else None
+           for q in (0.5, 0.95, 0.99)},
+    }
+
+
+def seed(data_dir, size):
+    """Write a JSON snapshot with ``size`` synthetic entries and their stats"""
+    from storage import _write_json, apply_entry, new_stats
+
+    os.makedirs(data_dir, exist_ok=True)
+    stats = new_stats()
+
+    def entries():
+        for entry in generate(size, "english"):
+            apply_entry(stats, entry)
+            yield entry
+    _write_json(os.path.join(data_dir, "user_history.json"), entries())
+    _write_json(os.path.join(data_dir, "usage_stats.json"), stats)
+
+
+def prepare(seed_dir, data_dir, storage):
+    """Copy the seeded snapshot into ``data_dir`` in ``storage``'s own format"""
+    shutil.copytree(seed_dir, data_dir)
+    if storage == "sqlite":
+        from sqlite_storage import migrate_json_to_sqlite
+        migrate_json_to_sqlite(data_dir)
+    elif storage == "mapped":
+        from mapped_storage import migrate_json_to_mapped
+        migrate_json_to_mapped(data_dir)
+
+
+def run_rewrites(args, data_dir):
+    import rewriter
+    from engine import get_engine
+    from user_data import UserHistory
+
+    user_history = UserHistory(data_dir=data_dir, storage=args.storage.split(",")[0])
+    words = " ".join(f"word{i}" for i in range(args.words))
+    inputs = [f"request {i % args.distinct}: {words}" for i in range(args.requests)]
+    samples = []
+    failures = {}
+    lock = threading.Lock()
+
+    def one(text):
+        start = time.perf_counter()
+        try:
+            if args.stream:
+                "".join(rewriter.stream_rewrite(text, user_history=user_history))
+            else:
+                rewriter.rewrite_text(text, user_history=user_history)
+        except Exception as e:
+            with lock:
+                failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+            return
+        with lock:
+            samples.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        list(pool.map(one, inputs))
+    elapsed = time.perf_counter() - start
+    stats = user_history.get_usage_stats()
+    user_history.close()
+    return {
+        **summarize(samples, elapsed),
+        "failures": failures,
+        "engine": get_engine().stats(),
+        "model": {name: stats.get(name, 0) for name in
+                  ("cache_hits", "model_retries", "model_fallbacks", "model_hedges",
+                   "model_circuit_skips")},
+    }
+
+
+def run_writes(user_history, writers, writes):
+    samples = []
+    lock = threading.Lock()
+
+    def writer(n):
+        own = []
+        for i in range(writes):
+            start = time.perf_counter()
+            user_history.add_entry(f"load writer {n} input {i}", f"load writer {n} output {i}",
+                                   latency_ms=500.0)
+            own.append((time.perf_counter() - start) * 1000)
+        with lock:
+            samples.extend(own)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - start)
+
+
+def child(storage, data_dir, writers, writes):
+    """Load, aggregate and write in a fresh process; prints one JSON line"""
+    from user_data import UserHistory
+
+    before = rss_mb()
+    start = time.perf_counter()
+    user_history = UserHistory(data_dir=data_dir, storage=storage)
+    result = {"open_ms": round((time.perf_counter() - start) * 1000, 3)}
+    start = time.perf_counter()
+    user_history.get_page(20)
+    result["first_page_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    result["rss_mb"] = round(rss_mb() - before, 1)
+
+    aggregations = {}
+    for name, call in (("summary", user_history.get_stats_summary),
+                       ("daily", lambda: user_history.get_daily_usage(30)),
+                       ("hourly", user_history.get_hourly_usage),
+                       ("monthly", user_history.get_monthly_usage),
+                       ("latency_histogram", user_history.get_latency_histogram)):
+        samples = []
+        for _ in range(20):
+            start = time.perf_counter()
+            call()
+            samples.append((time.perf_counter() - start) * 1000)
+        aggregations[f"{name}_ms"] = round(percentile(samples, 0.5), 3)
+    result["stats"] = aggregations
+
+    if writers and writes:
+        result["writes"] = run_writes(user_history, writers, writes)
+    user_history.close()
+    print(json.dumps(result))
+
+
+def flatten(results, prefix=""):
+    """``{"a": {"b": 1}}`` -> ``{"a.b": 1}``, numbers only"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """Return a line for every timing, memory or throughput metric that regressed"""
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for name, old in sorted(previous.items()):
+        new = current.get(name)
+        if new is None or not old:
+            continue
+        if name.endswith("_per_s"):
+            worse = new < old * (1 - tolerance)
+        elif name.endswith(("_ms", "_mb")):
+            # Ignore sub-millisecond noise
+            worse = new > old * (1 + tolerance) and new - old > 1
+        else:
+            continue
+        if worse:
+            regressions.append(f"{name}: {old} -> {new}")
+    return regressions
+
+
+def print_summary(name, values):
+    print(f"{name:<28} {values['ops']:>7,} ops {values['ops_per_s'] or 0:>10,.1f}/s  "
+          f"p50 {values['p50_ms'] or 0:9.3f}  p95 {values['p95_ms'] or 0:9.3f}  "
+          f"p99 {values['p99_ms'] or 0:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--storage", default="journal,sqlite,mapped")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent rewrite callers")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=None,
+                        help="distinct inputs among the requests (default: all distinct)")
+    parser.add_argument("--words", type=int, default=60, help="words per rewrite input")
+    parser.add_argument("--stream", action="store_true", help="use the streaming rewrite path")
+    parser.add_argument("--writers", type=int, default=8, help="concurrent add_entry threads")
+    parser.add_argument("--writes", type=int, default=200, help="entries per writer")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-sec", type=float, default=2000)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--skip", default="", help="comma-separated phases to skip")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="fail if worse than the results in this file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], args.child[1], args.writers, args.writes)
+        return
+
+    args.distinct = args.distinct or args.requests
+    # Everything below must stay offline and start cold
+    os.environ.update({
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY_MS": str(args.latency_ms),
+        "FAKE_LLM_LATENCY_SIGMA": str(args.latency_sigma),
+        "FAKE_LLM_TOKENS_PER_SEC": str(args.tokens_per_sec),
+        "FAKE_LLM_ERROR_RATE": str(args.error_rate),
+        "REWRITE_CACHE_DISK": "0",
+    })
+    os.environ.setdefault("GEMINI_BACKOFF_BASE", "0.05")
+    skip = set(args.skip.split(","))
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if "rewrite" not in skip:
+            rewrite = results["rewrite"] = run_rewrites(args, os.path.join(tmp, "rewrite"))
+            print_summary("rewrite" + (" (stream)" if args.stream else ""), rewrite)
+            print(f"{'':<28} failures {rewrite['failures'] or 'none'}; engine {rewrite['engine']}; "
+                  f"model {rewrite['model']}")
+
+        for size in [int(s) for s in args.sizes.split(",")] if "load" not in skip else []:
+            seed_dir = os.path.join(tmp, f"seed-{size}")
+            start = time.perf_counter()
+            seed(seed_dir, size)
+            print(f"\nseeded {size:,} entries in {time.perf_counter() - start:.1f} s")
+            for storage in args.storage.split(","):
+                data_dir = os.path.join(tmp, f"{storage}-{size}")
+                prepare(seed_dir, data_dir, storage)
+                writers = 0 if "writes" in skip else args.writers
+                output = subprocess.run(
+                    [sys.executable, __file__, "--writers", str(writers), "--writes", str(args.writes),
+                     "--child", storage, data_dir],
+                    check=True, capture_output=True, text=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                results.setdefault("load", {}).setdefault(storage, {})[str(size)] = result
+                stats = "  ".join(f"{name[:-3]} {ms:.3f}" for name, ms in result["stats"].items())
+                print(f"{storage:<8} {size:>10,}  open {result['open_ms']:10.1f} ms  "
+                      f"page {result['first_page_ms']:8.3f} ms  +{result['rss_mb']:7.1f} MB RSS")
+                print(f"{'':<20} stats ms: {stats}")
+                if "writes" in result:
+                    print_summary(f"  {writers} writers", result["writes"])
+                shutil.rmtree(data_dir)
+            shutil.rmtree(seed_dir)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nno regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
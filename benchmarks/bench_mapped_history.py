@@ -0,0 +1,86 @@
+"""Compare opening and paging a large history with the journal and mapped backends.
+
+Usage:
+    python benchmarks/bench_mapped_history.py --entries 1000000
+
+Seeds the same synthetic entries into a ``mapped`` data directory and into
+a ``journal`` snapshot, then, in a fresh process per backend, measures how
+long opening takes, how much resident memory that adds, and how long it
+takes to count the entries and read the newest page and a page from deep
+in the history.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_history_memory import generate  # noqa: E402
+from storage import _write_json  # noqa: E402
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def child(kind, data_dir, entries):
+    from storage import open_backend
+
+    before = rss_mb()
+    start = time.perf_counter()
+    backend = open_backend(kind, data_dir)
+    open_ms = (time.perf_counter() - start) * 1000
+    opened = rss_mb()
+    timings = {}
+    for name, read in (("count", lambda: len(backend.get_history())),
+                       ("newest page", lambda: backend.get_page(20)),
+                       ("deep page", lambda: backend.get_page(20, before_id=entries // 2))):
+        start = time.perf_counter()
+        read()
+        timings[name] = (time.perf_counter() - start) * 1000
+    print(f"{kind:<8} open {open_ms:10.1f} ms  +{opened - before:8.1f} MB RSS  " +
+          "  ".join(f"{name} {ms:7.3f} ms" for name, ms in timings.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], args.child[1], args.entries)
+        return
+
+    from mapped_storage import MappedBackend
+
+    with tempfile.TemporaryDirectory() as mapped_dir, tempfile.TemporaryDirectory() as journal_dir:
+        start = time.perf_counter()
+        backend = MappedBackend(mapped_dir)
+        batch = []
+        for entry in generate(args.entries, "english"):
+            del entry['id']
+            batch.append(entry)
+            if len(batch) == 10000:
+                backend.add_entries(batch)
+                batch = []
+        if batch:
+            backend.add_entries(batch)
+        log_size = os.path.getsize(backend.log_file)
+        # The journal backend loads from its JSON snapshot; give it the same entries
+        _write_json(os.path.join(journal_dir, "user_history.json"), list(backend.get_history()))
+        _write_json(os.path.join(journal_dir, "usage_stats.json"), backend.get_stats())
+        backend.close()
+        print(f"seeded {args.entries:,} entries ({log_size / 2**20:.0f} MB log) "
+              f"in {time.perf_counter() - start:.1f} s")
+
+        for kind, data_dir in (("journal", journal_dir), ("mapped", mapped_dir)):
+            subprocess.run([sys.executable, __file__, "--entries", str(args.entries),
+                            "--child", kind, data_dir], check=True)
+
+
+if __name__ == "__main__":
+    main()
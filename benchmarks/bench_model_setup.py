@@ -0,0 +1,101 @@
+"""Compare per-request Gemini model setup with the cached llm registry.
+
+Usage:
+    python benchmarks/bench_model_setup.py --iterations 2000
+    GEMINI_API_KEY=... python benchmarks/bench_model_setup.py --live 5
+
+The offline part times what used to happen on every rerun and button press
+(``genai.configure``, build the config dict, construct a GenerativeModel,
+start a chat session, fetch an API client) against the registry path, which
+reuses both the model and its client. ``--live N`` also sends N real prompts each way, re-running
+``genai.configure`` per request like the old app did on every rerun, so
+connection setup shows up in the numbers.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google.generativeai as genai  # noqa: E402
+from google.generativeai import client  # noqa: E402
+import llm  # noqa: E402
+
+
+def per_request_model():
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY", "benchmark-key"))
+    generation_config = {
+        "temperature": 1,
+        "top_p": 0.95,
+        "top_k": 40,
+        "max_output_tokens": 8192,
+        "response_mime_type": "text/plain",
+    }
+    model = genai.GenerativeModel(
+        model_name=llm.MODEL_NAME,
+        generation_config=generation_config,
+    )
+    chat_session = model.start_chat(history=[])
+    # The first send_message on a fresh model fetches a client; configure() above
+    # dropped the cached one, so this builds a new client and channel
+    model._client = client.get_default_generative_client()
+    return chat_session
+
+
+def registry_model():
+    model = llm.get_model()
+    if model._client is None:
+        model._client = client.get_default_generative_client()
+    return model
+
+
+def time_calls(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def live(iterations, api_key):
+    prompt = "Reply with the single word: ok"
+
+    def old_path():
+        per_request_model().send_message(prompt)
+
+    llm.configure(api_key)
+    llm.generate(prompt)  # warm the connection once
+
+    for name, fn in (("per-request setup", old_path),
+                     ("cached registry", lambda: llm.generate(prompt))):
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"{name:<20} mean {sum(samples) / len(samples):8.1f} ms   min {min(samples):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--live", type=int, default=0, metavar="N",
+                        help="also time N real requests (needs GEMINI_API_KEY)")
+    args = parser.parse_args()
+
+    llm.configure(os.getenv("GEMINI_API_KEY", "benchmark-key"))
+    registry_model()
+    print(f"per-request setup  {time_calls(per_request_model, args.iterations):10.1f} us/call")
+    llm.configure(os.getenv("GEMINI_API_KEY", "benchmark-key"))
+    registry_model()
+    print(f"cached registry    {time_calls(registry_model, args.iterations):10.1f} us/call")
+
+    if args.live:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            sys.exit("--live needs GEMINI_API_KEY in the environment")
+        live(args.live, api_key)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Measure full-text search latency over a large rewrite history.
+
+Usage:
+    python benchmarks/bench_search.py --entries 1000000
+    python benchmarks/bench_search.py --entries 100000 --storage sqlite
+
+Seeds a backend with synthetic Hindi/English entries whose words follow a
+Zipf distribution (a few very common words, a long tail of rare ones),
+reports how long the in-memory index takes to build (once, on the first
+search) and then the latency of ranked queries with and without a date
+filter. Queries on the most common words touch the most postings and are
+the slowest.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_data import UserHistory  # noqa: E402
+
+ROOTS = ("नमस्ते दुनिया हिंदी भाषा लिखें समाचार सरकार विकास शिक्षा स्वास्थ्य किसान बाज़ार "
+         "report market weather school health budget election travel cricket music "
+         "policy farmer river city train village festival science movie").split()
+# The bare roots are the most common words; numbered variants make up the tail
+WORDS = ROOTS + [f"{root}{n}" for n in range(1, 200) for root in ROOTS]
+WEIGHTS = [1 / rank for rank in range(1, len(WORDS) + 1)]
+QUERIES = ("दुनिया", "cricket", "किसान बाज़ार", "health budget", "शिक्षा7 river12",
+           "स्वास्थ्य150", "rare-term-that-matches-nothing")
+
+
+def seed(user_history, entries, batch=10000):
+    rng = random.Random(42)
+    for start in range(0, entries, batch):
+        pairs = []
+        for _ in range(min(batch, entries - start)):
+            original = " ".join(rng.choices(WORDS, WEIGHTS, k=rng.randint(6, 20)))
+            rewritten = " ".join(rng.choices(WORDS, WEIGHTS, k=rng.randint(6, 20)))
+            pairs.append((original, rewritten))
+        user_history.add_entries(pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--storage", default="journal", choices=("journal", "sqlite"))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        user_history = UserHistory(data_dir, storage=args.storage)
+        start = time.perf_counter()
+        seed(user_history, args.entries)
+        print(f"seeded {args.entries:,} entries in {time.perf_counter() - start:.1f} s")
+
+        start = time.perf_counter()
+        user_history.search("warmup")
+        print(f"first search (builds the index)  {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+        today = time.strftime("%Y-%m-%d")
+        for query in QUERIES:
+            for label, dates in (("", {}), (" [today]", {'start_date': today, 'end_date': today})):
+                samples = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    results = user_history.search(query, limit=20, **dates)
+                    samples.append((time.perf_counter() - start) * 1000)
+                samples.sort()
+                print(f"{query + label:<40} p50 {samples[len(samples) // 2]:8.2f} ms   "
+                      f"max {samples[-1]:8.2f} ms   {len(results)} results")
+        user_history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Measure the near-duplicate cache's hit rate, lookup latency and memory.
+
+Usage:
+    python benchmarks/bench_similar_cache.py --entries 10000,50000
+    python benchmarks/bench_similar_cache.py --entries 50000 --text hindi --threshold 0.85
+
+Indexes the ``original`` text of synthetic history entries in a
+``MinHashIndex``. It then queries edited copies of indexed texts: spacing
+and punctuation changes, and one, two or five words replaced. It also
+queries texts that were never indexed, so any hit on those is a false
+match. It reports the share of each kind of query that hits, the lookup
+p50/p99, the time to index each entry and the memory the index holds.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_history_memory import WORDS, generate  # noqa: E402
+from metrics import percentile  # noqa: E402
+from similar_cache import MinHashIndex  # noqa: E402
+
+
+def respace(text, rng):
+    words = text.split(" ")
+    return "  ".join(word + rng.choice(("", ",", ".", "!")) for word in words) + " \n"
+
+
+def replace_words(text, count, words, rng):
+    split = text.split(" ")
+    for position in rng.sample(range(len(split)), min(count, len(split))):
+        split[position] = rng.choice([word for word in words if word != split[position]])
+    return " ".join(split)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", default="10000,50000")
+    parser.add_argument("--text", choices=sorted(WORDS), default="english")
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--queries", type=int, default=500, help="queries of each kind")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    words = WORDS[args.text]
+    print(f"{'entries':>9} {'kind':<14} {'hit rate':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for size in [int(s) for s in args.entries.split(",")]:
+        entries = [entry['original'] for entry in generate(size, args.text)]
+        start = time.perf_counter()
+        index = MinHashIndex(max_entries=size)
+        index.add_many(range(1, size + 1), entries)
+        build_s = time.perf_counter() - start
+        # Build again under tracemalloc, which would skew the timing above
+        index = None
+        tracemalloc.start()
+        index = MinHashIndex(max_entries=size)
+        index.add_many(range(1, size + 1), entries)
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        sample = rng.sample(entries, min(args.queries, size))
+        kinds = {
+            "respaced": [respace(text, rng) for text in sample],
+            "1 word": [replace_words(text, 1, words, rng) for text in sample],
+            "2 words": [replace_words(text, 2, words, rng) for text in sample],
+            "5 words": [replace_words(text, 5, words, rng) for text in sample],
+            # Same vocabulary, never indexed: every hit here is wrong
+            "unrelated": [" ".join(rng.choices(words, k=rng.randint(8, 30))) for _ in sample],
+        }
+        for kind, queries in kinds.items():
+            samples = []
+            hits = 0
+            for query in queries:
+                start = time.perf_counter()
+                hits += index.query(query, args.threshold) is not None
+                samples.append((time.perf_counter() - start) * 1000)
+            print(f"{size:>9,} {kind:<14} {hits / len(queries):>9.1%} "
+                  f"{percentile(samples, 0.5):>8.3f} {percentile(samples, 0.99):>8.3f}")
+        print(f"{'':>9} indexed in {build_s * 1e6 / size:.0f} µs per entry, "
+              f"{held / 2**20:.1f} MB held ({held / size:.0f} bytes per entry)")
+
+
+if __name__ == "__main__":
+    main()
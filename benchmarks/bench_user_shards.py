@@ -0,0 +1,131 @@
+"""Measure how one user's large history affects another user, with and without shards.
+
+Usage:
+    python benchmarks/bench_user_shards.py --heavy 100000
+    python benchmarks/bench_user_shards.py --heavy 1000000 --storage journal,sqlite --users 200
+
+A "heavy" user has ``--heavy`` rewrites and a "light" user has 100. In the
+``single`` layout both live in one history, as they did before per-user
+shards. In the ``sharded`` layout each has a shard under ``data/users/``.
+For each layout and storage mode a fresh process opens the light user's
+history and reads its first page. Then the heavy user's ``--writers``
+threads write nonstop while the light user makes ``--writes`` writes.
+Reported: open and first-page time, the light user's write p50/p99, and
+the memory the open added. For the sharded layout, the time to build the
+all-users rollup over ``--users`` shards is also reported, on first read
+and again with nothing changed.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_load import prepare, rss_mb, seed  # noqa: E402
+from metrics import percentile  # noqa: E402
+
+
+def child(layout, storage, data_dir, writers, writes):
+    """Open, page and write as the light user in a fresh process; prints one JSON line"""
+    from user_data import HistoryRollup, UserHistory
+
+    user = "light" if layout == "sharded" else None
+    before = rss_mb()
+    start = time.perf_counter()
+    light = UserHistory.shared(data_dir, storage, user=user)
+    result = {"open_ms": (time.perf_counter() - start) * 1000}
+    start = time.perf_counter()
+    light.get_page(20)
+    result["first_page_ms"] = (time.perf_counter() - start) * 1000
+    result["rss_mb"] = rss_mb() - before
+
+    heavy = UserHistory.shared(data_dir, storage, user="heavy" if user else None)
+    stop = threading.Event()
+
+    def heavy_writer():
+        while not stop.is_set():
+            heavy.add_entry("heavy user text " * 4, "rewritten " * 4)
+
+    threads = [threading.Thread(target=heavy_writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    samples = []
+    for n in range(writes):
+        start = time.perf_counter()
+        light.add_entry(f"light user text {n}", "rewritten")
+        samples.append((time.perf_counter() - start) * 1000)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    result["write_p50_ms"] = percentile(samples, 0.5)
+    result["write_p99_ms"] = percentile(samples, 0.99)
+
+    if layout == "sharded":
+        rollup = HistoryRollup(data_dir, storage)
+        for name in ("rollup_first_ms", "rollup_again_ms"):
+            start = time.perf_counter()
+            rollup.get_stats_summary()
+            result[name] = (time.perf_counter() - start) * 1000
+    for user_history in (light, heavy):
+        user_history.close()
+    print(json.dumps(result))
+
+
+def build(layout, storage, data_dir, heavy_seed, light_seed, users):
+    """Lay out the heavy and light users' histories (plus idle users) in ``data_dir``"""
+    from user_data import user_dir
+
+    if layout == "single":
+        prepare(heavy_seed, data_dir, storage)
+        return
+    os.makedirs(os.path.join(data_dir, "users"))
+    prepare(heavy_seed, user_dir(data_dir, "heavy"), storage)
+    for n in range(max(users - 1, 1)):
+        prepare(light_seed, user_dir(data_dir, "light" if n == 0 else f"user{n}"), storage)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--heavy", type=int, default=100000, help="rewrites in the heavy user's history")
+    parser.add_argument("--storage", default="journal,sqlite,mapped")
+    parser.add_argument("--users", type=int, default=50, help="user shards in the sharded layout")
+    parser.add_argument("--writers", type=int, default=2, help="heavy user's writer threads")
+    parser.add_argument("--writes", type=int, default=200, help="writes the light user makes")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child, args.writers, args.writes)
+        return
+
+    print(f"{'storage':<8} {'layout':<8} {'open ms':>9} {'page ms':>8} {'write p50':>10} "
+          f"{'write p99':>10} {'MB':>7}  rollup ms (first / again)")
+    with tempfile.TemporaryDirectory() as tmp:
+        heavy_seed, light_seed = os.path.join(tmp, "heavy-seed"), os.path.join(tmp, "light-seed")
+        seed(heavy_seed, args.heavy)
+        seed(light_seed, 100)
+        for storage in args.storage.split(","):
+            for layout in ("single", "sharded"):
+                data_dir = os.path.join(tmp, f"{storage}-{layout}")
+                build(layout, storage, data_dir, heavy_seed, light_seed, args.users)
+                output = subprocess.run(
+                    [sys.executable, __file__, "--child", layout, storage, data_dir,
+                     "--writers", str(args.writers), "--writes", str(args.writes)],
+                    capture_output=True, text=True, check=True,
+                    env={**os.environ, "HISTORY_RETENTION_DAYS": ""}).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                rollup = (f"{result['rollup_first_ms']:.1f} / {result['rollup_again_ms']:.1f}"
+                          if "rollup_first_ms" in result else "-")
+                print(f"{storage:<8} {layout:<8} {result['open_ms']:>9.1f} {result['first_page_ms']:>8.2f} "
+                      f"{result['write_p50_ms']:>10.2f} {result['write_p99_ms']:>10.2f} "
+                      f"{result['rss_mb']:>7.1f}  {rollup}")
+                shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    main()
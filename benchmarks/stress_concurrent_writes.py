@@ -0,0 +1,114 @@
+"""Hammer one data directory from several processes and check nothing is lost.
+
+Usage:
+    python benchmarks/stress_concurrent_writes.py --processes 8 --writes 500
+    python benchmarks/stress_concurrent_writes.py --storage json --writes 100
+
+Each worker process adds ``--writes`` entries (a mix of single and batched
+adds) and bumps a counter after every write, as several Streamlit workers
+sharing ``data/`` would. The journal store compacts every
+``--compact-threshold`` entries so rotations race with appends. Afterwards
+a fresh process reloads the directory and checks that every entry is
+present exactly once, ids are unique and increasing, and the stats agree.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import JournalStore  # noqa: E402
+from user_data import UserHistory  # noqa: E402
+
+
+def worker(data_dir, storage, worker_id, writes, compact_threshold, start_event):
+    if storage == "journal":
+        # Pre-open the process-wide store so UserHistory picks up the small threshold
+        JournalStore.open(os.path.join(data_dir, "user_history.json"),
+                          os.path.join(data_dir, "usage_stats.json"),
+                          compact_threshold=compact_threshold)
+    user_history = UserHistory(data_dir, storage=storage)
+    start_event.wait()
+    written = 0
+    while written < writes:
+        if written % 5 == 4 and written + 3 <= writes:
+            user_history.add_entries([(f"{worker_id}-{written + i}", "rewritten") for i in range(3)])
+            written += 3
+        else:
+            user_history.add_entry(f"{worker_id}-{written}", "rewritten")
+            written += 1
+        user_history.increment("stress_counter")
+    user_history.close()
+
+
+def verify(data_dir, storage, processes, writes, increments):
+    user_history = UserHistory(data_dir, storage=storage)
+    history = user_history.get_history()
+    ids = [entry['id'] for entry in history]
+    originals = [entry['original'] for entry in history]
+    expected = {f"{worker_id}-{i}" for worker_id in range(processes) for i in range(writes)}
+    problems = []
+    if len(history) != len(expected):
+        problems.append(f"expected {len(expected)} entries, found {len(history)}")
+    if len(set(originals)) != len(originals):
+        problems.append(f"{len(originals) - len(set(originals))} duplicated entries")
+    if set(originals) != expected:
+        problems.append(f"{len(expected - set(originals))} entries lost")
+    if len(set(ids)) != len(ids) or ids != sorted(ids):
+        problems.append("ids are not unique and increasing")
+    stats = user_history.stats
+    if stats["total_rewrites"] != len(expected):
+        problems.append(f"total_rewrites is {stats['total_rewrites']}, expected {len(expected)}")
+    if stats.get("stress_counter", 0) != increments:
+        problems.append(f"stress_counter is {stats.get('stress_counter', 0)}, expected {increments}")
+    user_history.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=500, help="entries per process")
+    parser.add_argument("--storage", default="journal,json,sqlite")
+    parser.add_argument("--compact-threshold", type=int, default=300)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    failed = False
+    for storage in args.storage.split(","):
+        with tempfile.TemporaryDirectory() as data_dir:
+            start_event = context.Event()
+            workers = [context.Process(target=worker,
+                                       args=(data_dir, storage, worker_id, args.writes,
+                                             args.compact_threshold, start_event))
+                       for worker_id in range(args.processes)]
+            for process in workers:
+                process.start()
+            time.sleep(1)  # let every worker import and open the store
+            start = time.perf_counter()
+            start_event.set()
+            for process in workers:
+                process.join()
+            elapsed = time.perf_counter() - start
+
+            # Each worker bumps the counter once per add_entry/add_entries call
+            calls = 0
+            written = 0
+            while written < args.writes:
+                written += 3 if written % 5 == 4 and written + 3 <= args.writes else 1
+                calls += 1
+            total = args.processes * args.writes
+            problems = verify(data_dir, storage, args.processes, args.writes,
+                              args.processes * calls)
+            status = "OK" if not problems else "FAILED: " + "; ".join(problems)
+            print(f"{storage:<8} {args.processes} processes x {args.writes} entries "
+                  f"{total / elapsed:9.0f} entries/s   {status}")
+            failed = failed or bool(problems) or any(p.exitcode for p in workers)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
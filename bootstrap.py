@@ -0,0 +1,57 @@
+"""One-time, process-level setup for the app, its pages, the API and the CLI.
+
+Streamlit re-executes a page's script on every interaction, but imported
+modules stay loaded, so flags kept here survive reruns. ``load_env`` reads
+``.env`` once per process instead of on every run. ``configure`` also
+hands the API key to ``llm``, which waits to import and set up the Gemini
+SDK until a model is actually needed.
+"""
+import os
+import threading
+
+from dotenv import load_dotenv
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+SECRETS_FILE = os.path.join(".streamlit", "secrets.toml")
+
+_env_loaded = False
+_lock = threading.Lock()
+
+
+def load_env():
+    """Load ``.env`` into the environment, once per process"""
+    global _env_loaded
+    with _lock:
+        if not _env_loaded:
+            load_dotenv()
+            _env_loaded = True
+
+
+def _secrets_file_key():
+    if tomllib is None or not os.path.exists(SECRETS_FILE):
+        return None
+    with open(SECRETS_FILE, 'rb') as f:
+        return tomllib.load(f).get("GEMINI_API_KEY")
+
+
+def configure(api_key=None):
+    """Load ``.env`` and give the model backend its API key, outside Streamlit
+
+    The key is ``api_key``, else ``GEMINI_API_KEY`` from the environment,
+    else the one in ``.streamlit/secrets.toml``. Raises RuntimeError if the
+    backend needs a key and there is none.
+    """
+    import llm
+
+    load_env()
+    if not llm.needs_api_key():
+        return
+    api_key = api_key or os.getenv("GEMINI_API_KEY") or _secrets_file_key()
+    if not api_key:
+        raise RuntimeError("GEMINI_API_KEY is not set (environment, .env or "
+                           f"{SECRETS_FILE}); set LLM_BACKEND=fake to run offline")
+    llm.configure(api_key)
@@ -0,0 +1,58 @@
+import re
+
+# Coarsest boundary first: paragraphs, then sentences (including the Hindi
+# danda), then words. Each pattern captures the whitespace it splits on.
+BOUNDARIES = [
+    r"(\n\s*\n)",
+    r"(?<=[.!?।॥])(\s+)",
+    r"(\s+)",
+]
+
+
+def _units(text, max_chars, boundaries):
+    """Split text into (piece, following whitespace) pairs no longer than max_chars"""
+    if len(text) <= max_chars:
+        return [(text, "")]
+    if not boundaries:
+        # A single word longer than a chunk: cut it
+        return [(text[i:i + max_chars], "") for i in range(0, len(text), max_chars)]
+
+    parts = re.split(boundaries[0], text)
+    units = []
+    for i in range(0, len(parts), 2):
+        separator = parts[i + 1] if i + 1 < len(parts) else ""
+        if not parts[i]:
+            continue
+        pieces = _units(parts[i], max_chars, boundaries[1:])
+        pieces[-1] = (pieces[-1][0], pieces[-1][1] + separator)
+        units.extend(pieces)
+    return units
+
+
+def split_text(text, max_chars=3000):
+    """Split text into chunks of at most max_chars at the coarsest boundary that fits.
+
+    Returns a list of (chunk, separator) pairs; joining each chunk with the
+    separator that followed it reproduces the original text.
+    """
+    text = text.strip()
+    if not text:
+        return []
+
+    chunks = []
+    current, current_sep = "", ""
+    for piece, separator in _units(text, max_chars, BOUNDARIES):
+        if current and len(current) + len(current_sep) + len(piece) > max_chars:
+            chunks.append((current, current_sep))
+            current = piece
+        else:
+            current = current + current_sep + piece if current else piece
+        current_sep = separator
+    chunks.append((current, ""))
+    return chunks
+
+
+def join_chunks(chunks, rewritten):
+    """Reassemble rewritten chunks in order using the original separators"""
+    return "".join(text.strip() + separator
+                   for text, (_, separator) in zip(rewritten, chunks))
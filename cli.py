@@ -0,0 +1,58 @@
+"""Rewrite text from the command line, one line in, one line out.
+
+Usage:
+    python cli.py < input.txt > output.txt
+    tail -f requests.txt | python cli.py --concurrency 16 --jsonl
+
+Each stdin line is rewritten and written to stdout in the same order, as
+soon as it and every line before it are done. Up to ``--concurrency``
+lines are in flight at once. Blank lines stay blank. With ``--jsonl`` each
+output line is ``{"input": ..., "output": ...}``, or has an ``"error"``
+instead of ``"output"``. Without it a failed line is printed empty and
+the error goes to stderr. The exit status is 1 if any line failed.
+"""
+import argparse
+import json
+import sys
+
+from service import RewriteService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=8, help="lines rewritten at once")
+    parser.add_argument("--jsonl", action="store_true", help="write JSON Lines with input and output")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--storage", help="history storage mode (default: HISTORY_STORAGE)")
+    parser.add_argument("--user", help="record the rewrites in this user's history instead of the shared one")
+    args = parser.parse_args()
+
+    sys.stdin.reconfigure(encoding='utf-8')
+    sys.stdout.reconfigure(encoding='utf-8')
+    try:
+        service = RewriteService(data_dir=args.data_dir, storage=args.storage,
+                                 workers=args.concurrency, user=args.user)
+    except RuntimeError as e:
+        parser.exit(1, f"Error: {e}\n")
+
+    failed = 0
+    lines = (line.rstrip("\r\n") for line in sys.stdin)
+    try:
+        for number, (text, rewritten, error) in enumerate(service.rewrite_many(lines), 1):
+            if error:
+                failed += 1
+                print(f"Error rewriting line {number}: {error}", file=sys.stderr)
+            if args.jsonl:
+                result = {"error": error} if error else {"output": rewritten}
+                print(json.dumps({"input": text, **result}, ensure_ascii=False), flush=True)
+            else:
+                print(rewritten.replace("\n", " "), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
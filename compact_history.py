@@ -0,0 +1,177 @@
+"""Columnar in-memory history.
+
+A list of entry dicts costs roughly a kilobyte per entry before counting the
+text itself: a dict, a timestamp string, two text objects and boxed numbers.
+``CompactHistory`` keeps each field in a typed array instead, timestamps as
+integer seconds and all text in one shared buffer addressed by offsets.
+ASCII text is stored one byte per character and anything else as UTF-16, so
+Hindi text costs no more than in a ``str``. Text is only decoded when an
+entry is read, e.g. for the page being displayed.
+
+Indexing, slicing and iterating still produce plain entry dicts, so callers
+don't need to know about the layout.
+"""
+import bisect
+import calendar
+import math
+import time
+from array import array
+from datetime import datetime
+
+# Fields stored in columns; anything else on an entry is kept in ``extra``
+COLUMNS = ("id", "timestamp", "original", "rewritten", "char_count", "ttft_ms", "latency_ms")
+# Preformatted "HH:MM" and ":SS" pieces; formatting them per entry dominated decoding
+CLOCK_MINUTES = tuple(f"{minute // 60:02d}:{minute % 60:02d}" for minute in range(1440))
+CLOCK_SECONDS = tuple(f":{second:02d}" for second in range(60))
+
+
+def _encode(text):
+    if text.isascii():
+        return text.encode("ascii"), 0
+    return text.encode("utf-16-le", "surrogatepass"), 1
+
+
+def _parse_timestamp(timestamp):
+    """Wall-clock timestamp -> integer seconds, or None if it isn't in the usual format"""
+    if len(timestamp) != 19:
+        return None
+    try:
+        # Treated as UTC so the wall-clock time round-trips exactly, DST or not
+        return calendar.timegm(datetime.fromisoformat(timestamp).timetuple())
+    except ValueError:
+        return None
+
+
+class CompactHistory:
+    """Append-only, id-ordered entry store with columnar storage"""
+
+    def __init__(self, entries=()):
+        self.ids = array("q")
+        self.timestamps = array("q")
+        self.char_counts = array("q")
+        self.ttft_ms = array("d")
+        self.latency_ms = array("d")
+        # Text of entry i spans offsets[2i]:offsets[2i+1] (original) and
+        # offsets[2i+1]:offsets[2i+2] (rewritten); encodings holds 0 (ascii) or 1 (utf-16)
+        self.text = bytearray()
+        self.offsets = array("Q", [0])
+        self.encodings = bytearray()
+        # position -> fields that don't fit the columns (odd timestamps, extra keys)
+        self.extra = {}
+        self.extend(entries)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __bool__(self):
+        return len(self.ids) > 0
+
+    def append(self, entry):
+        position = len(self.ids)
+        extra = {key: value for key, value in entry.items() if key not in COLUMNS}
+        seconds = _parse_timestamp(entry['timestamp'])
+        if seconds is None:
+            extra['timestamp'] = entry['timestamp']
+            # Borrow the previous entry's time so the column stays sorted for bisect
+            seconds = self.timestamps[-1] if self.timestamps else 0
+        if extra:
+            self.extra[position] = extra
+
+        for field in ('original', 'rewritten'):
+            data, encoding = _encode(entry[field])
+            self.text += data
+            self.offsets.append(len(self.text))
+            self.encodings.append(encoding)
+        self.timestamps.append(seconds)
+        # -1 and NaN stand for fields the entry doesn't have
+        self.char_counts.append(entry.get('char_count', -1))
+        ttft_ms = entry.get('ttft_ms')
+        latency_ms = entry.get('latency_ms')
+        self.ttft_ms.append(math.nan if ttft_ms is None else ttft_ms)
+        self.latency_ms.append(math.nan if latency_ms is None else latency_ms)
+        # Last: readers take len(ids) as the length without the lock, so every
+        # other column must already hold the entry when it becomes visible
+        self.ids.append(entry['id'])
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def iter_range(self, start, stop):
+        """Decode entries ``start`` to ``stop`` into dicts, one at a time"""
+        # Bound up front so a concurrent drop_before can't shift positions under us
+        ids, timestamps, char_counts = self.ids, self.timestamps, self.char_counts
+        ttft, latency, extra = self.ttft_ms, self.latency_ms, self.extra
+        text, offsets, encodings = self.text, self.offsets, self.encodings
+        dates = {}
+        for position in range(start, stop):
+            day, seconds = divmod(timestamps[position], 86400)
+            date = dates.get(day)
+            if date is None:
+                date = dates[day] = time.strftime("%Y-%m-%d ", time.gmtime(day * 86400))
+            minutes, second = divmod(seconds, 60)
+            slot = 2 * position
+            middle = offsets[slot + 1]
+            original = text[offsets[slot]:middle]
+            rewritten = text[middle:offsets[slot + 2]]
+            entry = {
+                'id': ids[position],
+                'timestamp': date + CLOCK_MINUTES[minutes] + CLOCK_SECONDS[second],
+                'original': original.decode("utf-16-le", "surrogatepass") if encodings[slot]
+                else original.decode("ascii"),
+                'rewritten': rewritten.decode("utf-16-le", "surrogatepass") if encodings[slot + 1]
+                else rewritten.decode("ascii")
+            }
+            if char_counts[position] >= 0:
+                entry['char_count'] = char_counts[position]
+            # NaN is the only value not equal to itself
+            if ttft[position] == ttft[position]:
+                entry['ttft_ms'] = ttft[position]
+            if latency[position] == latency[position]:
+                entry['latency_ms'] = latency[position]
+            if position in extra:
+                entry.update(extra[position])
+            yield entry
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self.ids))
+            if step == 1:
+                return list(self.iter_range(start, max(start, stop)))
+            return [self[position] for position in range(start, stop, step)]
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError("history index out of range")
+        return next(self.iter_range(index, index + 1))
+
+    def __iter__(self):
+        return self.iter_range(0, len(self.ids))
+
+    @property
+    def last_id(self):
+        return self.ids[-1] if self.ids else 0
+
+    def position_of_id(self, entry_id):
+        """Index of the first entry whose id is >= ``entry_id``"""
+        return bisect.bisect_left(self.ids, entry_id)
+
+    def position_of_date(self, date):
+        """Index of the first entry on or after ``date`` (YYYY-MM-DD)"""
+        seconds = calendar.timegm(datetime.fromisoformat(date).timetuple())
+        return bisect.bisect_left(self.timestamps, seconds)
+
+    def drop_before(self, position):
+        """Forget the first ``position`` entries, e.g. once they are archived"""
+        if position <= 0:
+            return
+        start = self.offsets[2 * position]
+        self.ids = self.ids[position:]
+        self.timestamps = self.timestamps[position:]
+        self.char_counts = self.char_counts[position:]
+        self.ttft_ms = self.ttft_ms[position:]
+        self.latency_ms = self.latency_ms[position:]
+        self.text = self.text[start:]
+        self.offsets = array("Q", (offset - start for offset in self.offsets[2 * position:]))
+        self.encodings = self.encodings[2 * position:]
+        self.extra = {key - position: value for key, value in self.extra.items() if key >= position}
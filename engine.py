@@ -0,0 +1,254 @@
+"""Shared rewrite engine: one asyncio loop that schedules every upstream call.
+
+Streamlit runs each session's script in its own thread, so without a
+shared scheduler every click goes straight to Gemini at once. All calls go
+through ``get_engine()`` instead. It runs an asyncio loop in a background
+thread, and that loop gives you:
+
+- a bounded queue: once ``max_queue`` requests are waiting behind the ones
+  in flight, ``submit`` raises ``QueueFull`` rather than letting them pile up
+- at most ``max_in_flight`` upstream calls at a time, served in arrival order
+- per-request deadlines: a request still queued when its deadline passes
+  is dropped without calling upstream, and callers stop waiting at the deadline
+- single-flight coalescing: concurrent requests with the same key share
+  one upstream call (and, for streams, the same chunks as they arrive)
+
+The Gemini SDK calls themselves are blocking, so the loop hands each one to
+a pool of ``max_in_flight`` worker threads.
+
+Configured with ``REWRITE_MAX_QUEUE`` (default 64), ``REWRITE_MAX_IN_FLIGHT``
+(default 8) and ``REWRITE_TIMEOUT`` (seconds, default 120).
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import get_metrics
+
+
+class QueueFull(RuntimeError):
+    """Raised by ``submit`` when the engine's queue is at capacity"""
+
+
+class _Broadcast:
+    """Chunks of one streamed response, replayable to every caller that joins"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self._cond = threading.Condition()
+
+    def append(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    def follow(self, future, deadline):
+        """Yield every chunk from the start, then raise the call's error if it failed"""
+        position = 0
+        while True:
+            with self._cond:
+                while position == len(self.chunks) and not self.done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("Rewrite deadline passed while streaming")
+                    self._cond.wait(remaining)
+                chunks = self.chunks[position:]
+                done = self.done
+            for chunk in chunks:
+                yield chunk
+            position += len(chunks)
+            if done and position == len(self.chunks):
+                future.result()
+                return
+
+
+class _Job:
+    def __init__(self, key, call, deadline, broadcast=None):
+        self.key = key
+        self.call = call
+        self.deadline = deadline
+        self.broadcast = broadcast
+        self.future = Future()
+        self.queued_at = time.monotonic()
+        # Set once nobody is waiting any more, so a stream can stop early
+        self.expired = False
+
+
+class RewriteEngine:
+    """Bounded, deadline-aware, coalescing scheduler for upstream model calls"""
+
+    def __init__(self, max_queue=64, max_in_flight=8, timeout=120.0):
+        self.max_queue = max_queue
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._jobs = {}
+        # Jobs submitted but not finished, and how many of those are running
+        self._outstanding = 0
+        self._running = 0
+        self._counts = {"submitted": 0, "coalesced": 0, "rejected": 0, "expired": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight,
+                                            thread_name_prefix="rewrite-call")
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="rewrite-engine", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._workers = [self._loop.create_task(self._worker()) for _ in range(self.max_in_flight)]
+        self._started.set()
+        self._loop.run_forever()
+
+    def submit(self, key, call, timeout=None):
+        """Schedule ``call()`` and return a Future for its result.
+
+        A call already queued or running under the same ``key`` is shared
+        instead of scheduling another; pass ``key=None`` to never share.
+        """
+        return self._submit(key, call, timeout)[0].future
+
+    def run(self, key, call, timeout=None):
+        """Submit ``call`` and wait for its result, up to the deadline"""
+        job, deadline = self._submit(key, call, timeout)
+        return job.future.result(max(0, deadline - time.monotonic()))
+
+    def stream(self, key, make_chunks, timeout=None):
+        """Yield the chunks of ``make_chunks()``, sharing one upstream stream per ``key``"""
+        job, deadline = self._submit(key, make_chunks, timeout, stream=True)
+        yield from job.broadcast.follow(job.future, deadline)
+
+    def _submit(self, key, call, timeout, stream=False):
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        with self._lock:
+            job = self._jobs.get(key) if key is not None else None
+            # A plain call can share a stream (its result is the joined text), not the reverse
+            if job is not None and not (stream and job.broadcast is None):
+                # Keep the shared call alive for the most patient caller
+                job.deadline = max(job.deadline, deadline)
+                self._counts["coalesced"] += 1
+                return job, deadline
+            if self._outstanding >= self.max_queue + self.max_in_flight:
+                self._counts["rejected"] += 1
+                raise QueueFull(f"Rewrite queue is full ({self._outstanding} requests outstanding); "
+                                "try again shortly")
+            job = _Job(key, call, deadline, _Broadcast() if stream else None)
+            if key is not None:
+                self._jobs[key] = job
+            self._outstanding += 1
+            self._counts["submitted"] += 1
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return job, deadline
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                self._running += 1
+            get_metrics().observe("queue_wait", (time.monotonic() - job.queued_at) * 1000)
+            try:
+                await self._execute(job)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._outstanding -= 1
+
+    async def _execute(self, job):
+        if time.monotonic() >= job.deadline:
+            self._finish(job, error=TimeoutError("Rewrite deadline passed while queued"))
+            return
+        call = self._stream_call(job) if job.broadcast is not None else job.call
+        pending = self._loop.run_in_executor(self._executor, call)
+        # The deadline can move while we wait, when a later caller joins
+        while not pending.done():
+            remaining = job.deadline - time.monotonic()
+            if remaining <= 0:
+                job.expired = True
+                self._finish(job, error=TimeoutError("Rewrite deadline passed"))
+                break
+            await asyncio.wait({pending}, timeout=remaining)
+        # A blocking call can't be interrupted; it keeps its slot until it returns
+        try:
+            result = await pending
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+
+    @staticmethod
+    def _stream_call(job):
+        def consume():
+            parts = []
+            try:
+                for chunk in job.call():
+                    if job.expired:
+                        break
+                    parts.append(chunk)
+                    job.broadcast.append(chunk)
+            finally:
+                job.broadcast.finish()
+            return "".join(parts)
+        return consume
+
+    def _finish(self, job, result=None, error=None):
+        with self._lock:
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+            if job.future.done():
+                return
+            if isinstance(error, TimeoutError):
+                self._counts["expired"] += 1
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+        if job.broadcast is not None:
+            job.broadcast.finish()
+
+    def stats(self):
+        """Queue depth, calls in flight and lifetime counters"""
+        with self._lock:
+            return {"queued": self._outstanding - self._running, "in_flight": self._running,
+                    "max_queue": self.max_queue, "max_in_flight": self.max_in_flight,
+                    **self._counts}
+
+    def close(self):
+        """Stop accepting work once queued jobs drain, then stop the loop"""
+        if not self._loop.is_running():
+            return
+        for _ in self._workers:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+        future = asyncio.run_coroutine_threadsafe(asyncio.wait(self._workers), self._loop)
+        future.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=False)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the process-wide rewrite engine, configured from the environment"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RewriteEngine(
+                max_queue=int(os.getenv("REWRITE_MAX_QUEUE", "64")),
+                max_in_flight=int(os.getenv("REWRITE_MAX_IN_FLIGHT", "8")),
+                timeout=float(os.getenv("REWRITE_TIMEOUT", "120"))
+            )
+        return _engine
@@ -0,0 +1,189 @@
+"""Stream the rewrite history out as JSON Lines, CSV or Parquet.
+
+Entries come from ``UserHistory.iter_entries``, which reads the archive a
+month at a time and the hot history a chunk at a time. Each chunk is
+encoded and handed on before the next one is read, so memory use stays
+flat however large the history is. Parquet needs the optional ``pyarrow``
+package, imported on first use, and gets one row group per chunk.
+
+Usage:
+    python export.py --output history.csv
+    python export.py --output history.parquet --start-date 2024-01-01 --fields timestamp,original,rewritten
+    python export.py --format jsonl > history.jsonl
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+from datetime import datetime
+
+FIELDS = ("id", "timestamp", "original", "rewritten", "char_count", "ttft_ms", "latency_ms")
+# Format name: (content type, file extension)
+FORMATS = {
+    "jsonl": ("application/x-ndjson", ".jsonl"),
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+CHUNK_SIZE = 1000
+
+
+def _pyarrow():
+    """Import pyarrow on first use, so pages importing this module don't pay for it"""
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def _check(fmt, start_date, end_date, fields):
+    """Validate the options up front, before any output is produced"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; use one of {', '.join(FORMATS)}")
+    if fmt == "parquet" and _pyarrow() is None:
+        raise RuntimeError("Parquet export needs the pyarrow package")
+    for date in (start_date, end_date):
+        try:
+            if date:
+                datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError(f"Dates must be YYYY-MM-DD, not {date!r}")
+    fields = list(fields or FIELDS)
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields {', '.join(unknown)}; pick from {', '.join(FIELDS)}")
+    return fields
+
+
+def _chunks(entries, chunk_size):
+    while True:
+        chunk = list(itertools.islice(entries, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _jsonl(chunks, fields):
+    for chunk in chunks:
+        yield "".join(json.dumps({field: entry.get(field) for field in fields}, ensure_ascii=False) + "\n"
+                      for entry in chunk).encode("utf-8")
+
+
+def _csv(chunks, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for chunk in chunks:
+        writer.writerows([entry.get(field, "") for field in fields] for entry in chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+class _Sink:
+    """Write-only file for pyarrow that hands back what was written since the last ``drain``"""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def _parquet(chunks, fields):
+    pyarrow = _pyarrow()
+    types = {"id": pyarrow.int64(), "char_count": pyarrow.int64(), "ttft_ms": pyarrow.float64(),
+             "latency_ms": pyarrow.float64()}
+    schema = pyarrow.schema([(field, types.get(field, pyarrow.string())) for field in fields])
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for chunk in chunks:
+            columns = {field: [entry.get(field) for entry in chunk] for field in fields}
+            writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(user_history, fmt="jsonl", start_date=None, end_date=None, fields=None,
+                chunk_size=CHUNK_SIZE):
+    """Return an iterator of byte chunks making up the export, oldest entry first
+
+    ``start_date`` and ``end_date`` are inclusive ``YYYY-MM-DD`` strings and
+    ``fields`` a subset of ``FIELDS``. Bad options raise ValueError (or
+    RuntimeError if Parquet is asked for without pyarrow) straight away.
+    """
+    fields = _check(fmt, start_date, end_date, fields)
+    entries = user_history.iter_entries(start_date, end_date)
+    encode = {"jsonl": _jsonl, "csv": _csv, "parquet": _parquet}[fmt]
+    return encode(_chunks(entries, chunk_size), fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the rewrite history")
+    parser.add_argument("--output", "-o", help="file to write (default: stdout)")
+    parser.add_argument("--format", choices=sorted(FORMATS),
+                        help="default: from the output file's extension, else jsonl")
+    parser.add_argument("--start-date", help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--end-date", help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--fields", help=f"comma-separated subset of {','.join(FIELDS)}")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--storage", default=None, help="json, journal, sqlite or mapped")
+    parser.add_argument("--user", help="export this user's history instead of the shared one")
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        extension = os.path.splitext(args.output or "")[1]
+        fmt = next((name for name, (_, ext) in FORMATS.items() if ext == extension), "jsonl")
+    fields = args.fields.split(",") if args.fields else None
+
+    from user_data import UserHistory, user_dir
+    data_dir = user_dir(args.data_dir, args.user) if args.user else args.data_dir
+    user_history = UserHistory(data_dir, storage=args.storage)
+    try:
+        try:
+            chunks = iter_export(user_history, fmt, args.start_date, args.end_date, fields)
+        except (ValueError, RuntimeError) as e:
+            parser.error(str(e))
+        if args.output:
+            written = 0
+            with open(args.output, 'wb') as f:
+                for data in chunks:
+                    f.write(data)
+                    written += len(data)
+            print(f"Wrote {written:,} bytes to {args.output}", file=sys.stderr)
+        else:
+            for data in chunks:
+                sys.stdout.buffer.write(data)
+    finally:
+        user_history.close()
+
+
+if __name__ == "__main__":
+    main()
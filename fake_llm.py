@@ -0,0 +1,93 @@
+"""Offline stand-in for a Gemini model, for benchmarks and running without a key.
+
+Select it with ``LLM_BACKEND=fake``. ``FakeModel`` has the part of the
+``genai.GenerativeModel`` interface the app uses (``generate_content`` with
+and without ``stream=True``). Its output is deterministic: it echoes the
+text being rewritten. Timing and failures are simulated from a seeded
+random generator:
+
+- ``FAKE_LLM_LATENCY_MS`` (default 300): median time to first token
+- ``FAKE_LLM_LATENCY_SIGMA`` (default 0.5): spread of the log-normal latency
+- ``FAKE_LLM_TOKENS_PER_SEC`` (default 200): output speed after the first
+  token; 0 returns the whole text at once
+- ``FAKE_LLM_ERROR_RATE`` (default 0): share of calls that fail with a 429
+  or 503, as Gemini does under load
+- ``FAKE_LLM_SEED`` (default 0)
+"""
+import math
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+# Words sent per streamed chunk
+CHUNK_WORDS = 8
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text] if text else []
+
+
+class FakeModel:
+    """Deterministic text with simulated latency, token rate and transient errors"""
+
+    def __init__(self, model_name, generation_config=None, latency_ms=None, latency_sigma=None,
+                 tokens_per_second=None, error_rate=None, seed=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.latency_ms = float(latency_ms if latency_ms is not None
+                                else os.getenv("FAKE_LLM_LATENCY_MS", "300"))
+        self.latency_sigma = float(latency_sigma if latency_sigma is not None
+                                   else os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5"))
+        self.tokens_per_second = float(tokens_per_second if tokens_per_second is not None
+                                       else os.getenv("FAKE_LLM_TOKENS_PER_SEC", "200"))
+        self.error_rate = float(error_rate if error_rate is not None
+                                else os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+        seed = seed if seed is not None else os.getenv("FAKE_LLM_SEED", "0")
+        self._random = random.Random(f"{seed}:{model_name}")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def rewrite(prompt):
+        """The "rewrite": the text after the prompt's instructions, unchanged"""
+        # The instructions end at the first blank line; the text may have more of its own
+        return prompt.split("\n\n", 1)[-1].strip()
+
+    def _draw(self):
+        """Pick this call's time to first token (seconds) and whether it fails"""
+        with self._lock:
+            latency = self.latency_ms * math.exp(self.latency_sigma * self._random.gauss(0, 1))
+            failed = self._random.random() < self.error_rate
+            error = self._random.choice((google_exceptions.ResourceExhausted,
+                                         google_exceptions.ServiceUnavailable))
+        return latency / 1000, error if failed else None
+
+    def _words(self, text):
+        return text.split(" ")
+
+    def generate_content(self, prompt, stream=False):
+        latency, error = self._draw()
+        text = self.rewrite(prompt)
+        if stream:
+            return self._stream(text, latency, error)
+        time.sleep(latency)
+        if error is not None:
+            raise error(f"{self.model_name}: simulated failure")
+        if self.tokens_per_second > 0:
+            time.sleep(len(self._words(text)) / self.tokens_per_second)
+        return _Response(text)
+
+    def _stream(self, text, latency, error):
+        time.sleep(latency)
+        if error is not None:
+            raise error(f"{self.model_name}: simulated failure")
+        words = self._words(text)
+        for start in range(0, len(words), CHUNK_WORDS):
+            chunk = words[start:start + CHUNK_WORDS]
+            if start and self.tokens_per_second > 0:
+                time.sleep(len(chunk) / self.tokens_per_second)
+            yield _Response(" ".join(chunk) + (" " if start + CHUNK_WORDS < len(words) else ""))
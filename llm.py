@@ -0,0 +1,339 @@
+"""Process-wide Gemini model registry.
+
+``genai.configure`` throws away the SDK's cached API clients (and their gRPC
+channels), so it runs once per API key rather than on every Streamlit rerun.
+It is also deferred: ``configure`` only records the key, and the SDK (the
+slowest import in the app) is loaded and configured when the first model
+is built, so the login screen and pages that never call Gemini skip it. Models are cached
+by name and generation config, and prompts go through the one-shot
+``generate_content`` call instead of a throwaway chat session, so per-request
+setup and connection establishment stay off the hot path.
+
+Calls are made resilient here too. Rate limits, overload and timeouts are
+retried with jittered exponential backoff. Each model has a circuit
+breaker, so a model that keeps failing is skipped for a while instead of
+being hammered. Once a model's retries run out, the next model in
+``GEMINI_MODELS`` is tried. Slow calls can be hedged with a second request.
+Retries, fallbacks, hedges and circuit skips are reported through the
+``record(name, n)`` callback so they can be counted in the usage stats.
+
+Where model objects come from is pluggable: ``LLM_BACKEND`` picks a factory
+from ``BACKENDS`` ("gemini" by default, or "fake" for the offline model in
+``fake_llm.py``), and ``register_backend`` adds others.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import get_metrics
+
+MODEL_NAME = "gemini-2.0-flash-exp"
+
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+    "response_mime_type": "text/plain",
+}
+
+
+def _gemini_model(model_name, generation_config):
+    # Called with _lock held
+    global _configured_key
+    import google.generativeai as genai
+
+    if _api_key != _configured_key:
+        genai.configure(api_key=_api_key, transport=os.getenv("GEMINI_TRANSPORT", "grpc"))
+        _configured_key = _api_key
+    return genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+
+
+def _fake_model(model_name, generation_config):
+    from fake_llm import FakeModel
+    return FakeModel(model_name, generation_config)
+
+
+# name -> factory(model_name, generation_config) returning an object with
+# ``generate_content(prompt, stream=False)``
+BACKENDS = {"gemini": _gemini_model, "fake": _fake_model}
+# Set by set_backend; until then LLM_BACKEND is read on use, so .env loaded later still counts
+_backend = None
+
+_models = {}
+_lock = threading.Lock()
+# The key passed to configure, and the one the SDK was last configured with
+_api_key = None
+_configured_key = None
+_breakers = {}
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="gemini-hedge")
+
+
+def settings():
+    """Retry, fallback and hedging settings from the ``GEMINI_*`` environment variables
+
+    Read on use rather than at import, since this module is imported before
+    the pages and the service load ``.env``.
+    """
+    return {
+        # Ordered fallback list; the first model is the primary
+        "models": [name.strip() for name in
+                   os.getenv("GEMINI_MODELS", f"{MODEL_NAME},gemini-1.5-flash").split(",")
+                   if name.strip()],
+        "max_retries": int(os.getenv("GEMINI_MAX_RETRIES", "2")),
+        "backoff_base": float(os.getenv("GEMINI_BACKOFF_BASE", "0.5")),
+        "backoff_max": float(os.getenv("GEMINI_BACKOFF_MAX", "8")),
+        # Send a second, identical request if the first hasn't answered by then; 0 disables
+        "hedge_after_ms": float(os.getenv("GEMINI_HEDGE_AFTER_MS", "0")),
+        "breaker_threshold": int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5")),
+        "breaker_cooldown": float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30")),
+    }
+
+
+def error_classes():
+    """(retryable, fallback) exception tuples, imported on the first call
+
+    ``google.api_core`` pulls in grpc, so it stays off pages that never call a model.
+    """
+    from google.api_core import exceptions as google_exceptions
+
+    # Transient: rate limits, overload and timeouts are worth retrying
+    retryable = (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted,
+                 google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+                 google_exceptions.GatewayTimeout, google_exceptions.DeadlineExceeded)
+    # Errors that say this model is unavailable, so another model may still work
+    return retryable, retryable + (google_exceptions.NotFound,)
+
+
+def primary_model():
+    """The first model in ``GEMINI_MODELS``"""
+    return settings()["models"][0]
+
+
+class CircuitBreaker:
+    """Stops calls to a model after ``threshold`` failures in a row.
+
+    After ``cooldown`` seconds a single trial call is let through: success
+    closes the circuit again, failure keeps it open for another cooldown.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self._trial else "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+def get_breaker(model_name):
+    """Return the process-wide circuit breaker for a model"""
+    with _lock:
+        breaker = _breakers.get(model_name)
+        if breaker is None:
+            config = settings()
+            breaker = _breakers[model_name] = CircuitBreaker(
+                threshold=config["breaker_threshold"], cooldown=config["breaker_cooldown"])
+        return breaker
+
+
+def backoff_delay(attempt, config=None):
+    """Full-jitter exponential backoff: uniform between 0 and base * 2**attempt, capped"""
+    config = config or settings()
+    return random.uniform(0, min(config["backoff_max"], config["backoff_base"] * 2 ** attempt))
+
+
+def _ignore(name, n=1):
+    pass
+
+
+def register_backend(name, factory):
+    """Make ``factory(model_name, generation_config)`` selectable as ``name``"""
+    BACKENDS[name] = factory
+
+
+def set_backend(name):
+    """Switch every later model lookup to another backend"""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend {name!r}; choose from {', '.join(BACKENDS)}")
+    with _lock:
+        _backend = name
+        _models.clear()
+
+
+def get_backend():
+    """Name of the active backend"""
+    return _backend or os.getenv("LLM_BACKEND", "gemini")
+
+
+def needs_api_key():
+    """Whether the active backend calls Gemini and so needs GEMINI_API_KEY"""
+    return get_backend() == "gemini"
+
+
+def configure(api_key):
+    """Set the API key; the SDK is configured with it when the next model is built
+
+    Calling again with the same key is free. A new key drops the cached
+    models, and with them the pooled connections.
+    """
+    global _api_key
+    with _lock:
+        if api_key == _api_key:
+            return
+        _api_key = api_key
+        _models.clear()
+
+
+def get_model(model_name=MODEL_NAME, generation_config=None):
+    """Return the cached model for this name and config, creating it on first use"""
+    generation_config = generation_config or GENERATION_CONFIG
+    backend = get_backend()
+    key = (backend, model_name, tuple(sorted(generation_config.items())))
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            model = BACKENDS[backend](model_name, generation_config)
+            _models[key] = model
+        return model
+
+
+def _generate_once(prompt, model_name):
+    metrics = get_metrics()
+    with metrics.timer("model_call"):
+        response = get_model(model_name).generate_content(prompt)
+    with metrics.timer("response_parse"):
+        return response.text
+
+
+def _generate_hedged(prompt, model_name, record):
+    """Call the model, racing a second request against it if the first is slow"""
+    hedge_after_ms = settings()["hedge_after_ms"]
+    if hedge_after_ms <= 0:
+        return _generate_once(prompt, model_name)
+    first = _hedge_pool.submit(_generate_once, prompt, model_name)
+    done, _ = wait([first], timeout=hedge_after_ms / 1000)
+    if done:
+        return first.result()
+    record("model_hedges")
+    pending = {first, _hedge_pool.submit(_generate_once, prompt, model_name)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                # The slower request can't be cancelled; its answer is dropped
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+def _with_fallback(attempt_call, models, record):
+    """Run ``attempt_call(model_name)`` with retries per model, then down the fallback list"""
+    config = settings()
+    retryable_errors, fallback_errors = error_classes()
+    last_error = None
+    for position, model_name in enumerate(models or config["models"]):
+        breaker = get_breaker(model_name)
+        if not breaker.allow():
+            record("model_circuit_skips")
+            continue
+        for attempt in range(config["max_retries"] + 1):
+            if attempt:
+                record("model_retries")
+                time.sleep(backoff_delay(attempt - 1, config))
+            try:
+                result = attempt_call(model_name)
+            except fallback_errors as e:
+                breaker.failure()
+                last_error = e
+                if not isinstance(e, retryable_errors) or not breaker.allow():
+                    break
+                continue
+            except Exception:
+                # The model answered (e.g. refused the prompt), so it's healthy
+                breaker.success()
+                raise
+            breaker.success()
+            if position:
+                record("model_fallbacks")
+            return result
+    raise last_error or RuntimeError("Every model is unavailable (circuit breakers open)")
+
+
+def generate(prompt, models=None, record=None):
+    """Send a prompt to Gemini and return the response text.
+
+    Transient errors are retried with backoff and then handed to the next
+    model in ``models`` (default ``GEMINI_MODELS``). Other errors, e.g. a blocked
+    prompt, are raised straight away.
+    """
+    record = record or _ignore
+    return _with_fallback(lambda model_name: _generate_hedged(prompt, model_name, record),
+                          models, record)
+
+
+def generate_stream(prompt, models=None, record=None):
+    """Send a prompt to Gemini and yield the response text as it streams in.
+
+    Failures before the first chunk are retried and fall back like
+    ``generate``; once text has been yielded an error is raised as is.
+    """
+    record = record or _ignore
+
+    def open_stream(model_name):
+        try:
+            chunks = iter(get_model(model_name).generate_content(prompt, stream=True))
+            # Pull the first chunk here so errors before any text can still be retried
+            return next(chunks, None), chunks
+        except Exception as e:
+            get_metrics().record_error("model_call", e)
+            raise
+
+    # For streams the model call spans the whole response, first byte to last;
+    # errors are counted per attempt above
+    start = time.perf_counter()
+    try:
+        first, chunks = _with_fallback(open_stream, models, record)
+        try:
+            if first is not None and first.parts:
+                yield first.text
+            for chunk in chunks:
+                if chunk.parts:
+                    yield chunk.text
+        except Exception as e:
+            get_metrics().record_error("model_call", e)
+            raise
+    finally:
+        get_metrics().observe("model_call", (time.perf_counter() - start) * 1000)
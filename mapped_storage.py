@@ -0,0 +1,420 @@
+"""Memory-mapped storage backend for very large histories.
+
+History is kept in two append-only files:
+
+- ``user_history.log``: one JSON entry per line
+- ``user_history.idx``: a fixed-size record per entry holding its id,
+  timestamp (epoch seconds) and byte range in the log
+
+Both are opened with ``mmap``, so opening a history, counting its entries,
+reading the newest page or seeking to a date only touches the few pages of
+the index it needs and parses just the entries returned, however big the
+log is. Stats live in ``user_history.stats.json`` and are rewritten on each
+write, like the json store does.
+
+Run ``python mapped_storage.py migrate`` once to copy an existing json or
+journal history across, then start the app with ``HISTORY_STORAGE=mapped``.
+"""
+import argparse
+import bisect
+import calendar
+import json
+import mmap
+import os
+import sys
+import threading
+from array import array
+from datetime import datetime
+
+from compact_history import _parse_timestamp
+from search_index import SearchIndex
+from storage import FileLock, _file_signature, _read_json, _write_json, apply_entry, new_stats
+
+# id, epoch seconds, start offset, end offset, as native int64s
+RECORD_FIELDS = 4
+RECORD_SIZE = RECORD_FIELDS * 8
+
+
+class MappedHistory:
+    """Read-only sequence view of the entries in one mapping of the log and index.
+
+    Entries are parsed from the log only when indexed, sliced or iterated.
+    """
+
+    def __init__(self, log, records, count):
+        self._log = log
+        self._records = records
+        self._count = count
+        # Strided views, so bisect can search a column in place
+        self.ids = records[0::RECORD_FIELDS] if count else []
+        self.timestamps = records[1::RECORD_FIELDS] if count else []
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def entry(self, position):
+        start = self._records[position * RECORD_FIELDS + 2]
+        end = self._records[position * RECORD_FIELDS + 3]
+        return json.loads(self._log[start:end])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.entry(position) for position in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("history index out of range")
+        return self.entry(index)
+
+    def __iter__(self):
+        return self.iter_range(0, self._count)
+
+    def iter_range(self, start, stop):
+        for position in range(start, stop):
+            yield self.entry(position)
+
+    @property
+    def last_id(self):
+        return self.ids[-1] if self._count else 0
+
+    def offset(self, position):
+        """Byte offset in the log where the entry at ``position`` starts"""
+        return self._records[position * RECORD_FIELDS + 2]
+
+    @property
+    def end_offset(self):
+        """Byte offset in the log just past the last indexed entry"""
+        return self._records[-1] if self._count else 0
+
+    def position_of_id(self, entry_id):
+        """Index of the first entry whose id is >= ``entry_id``"""
+        return bisect.bisect_left(self.ids, entry_id)
+
+    def position_of_date(self, date):
+        """Index of the first entry on or after ``date`` (YYYY-MM-DD)"""
+        seconds = calendar.timegm(datetime.fromisoformat(date).timetuple())
+        return bisect.bisect_left(self.timestamps, seconds)
+
+
+def _map(path, length):
+    """Map the first ``length`` bytes of ``path`` read-only, or return None for an empty file"""
+    if not length:
+        return None
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ)
+
+
+class MappedBackend:
+    """Serves history straight from a memory-mapped log and offset index"""
+
+    def __init__(self, data_dir):
+        self.log_file = os.path.join(data_dir, "user_history.log")
+        self.index_file = os.path.join(data_dir, "user_history.idx")
+        self.stats_file = os.path.join(data_dir, "user_history.stats.json")
+        self.lock = FileLock.open(self.log_file + ".lock")
+        self._lock = threading.RLock()
+        self.generation = 0
+        self._index_signature = None
+        self._stats_signature = None
+        self._search_index = None
+        self.history = MappedHistory(None, None, 0)
+        self.stats = new_stats()
+        with self._lock, self.lock:
+            for path in (self.log_file, self.index_file):
+                open(path, 'ab').close()
+            self._repair_locked()
+            self.refresh()
+
+    def _repair_locked(self):
+        """Bring the index and stats up to date with the log after a crash mid-write"""
+        index_size = os.path.getsize(self.index_file)
+        if index_size % RECORD_SIZE:
+            # Drop a torn trailing record
+            with open(self.index_file, 'r+b') as f:
+                f.truncate(index_size - index_size % RECORD_SIZE)
+        history = self._mapped_history()
+        log_size = os.path.getsize(self.log_file)
+        if history.end_offset > log_size:
+            raise RuntimeError(f"{self.index_file} points past the end of {self.log_file}")
+
+        stats = _read_json(self.stats_file, None) or new_stats()
+        stats.setdefault("last_id", 0)
+        missing = [entry for entry in history.iter_range(history.position_of_id(stats["last_id"] + 1),
+                                                          len(history))]
+        if history.end_offset < log_size:
+            # Entries written to the log whose index records never made it
+            with open(self.log_file, 'rb') as f:
+                f.seek(history.end_offset)
+                tail = f.read()
+            complete = tail.rfind(b"\n") + 1
+            records = []
+            offset = history.end_offset
+            seconds = history.timestamps[-1] if history else 0
+            for line in tail[:complete].splitlines(keepends=True):
+                if line.strip():
+                    entry = json.loads(line)
+                    seconds = _parse_timestamp(entry['timestamp']) or seconds
+                    records.append((entry['id'], seconds, offset, offset + len(line)))
+                    if entry['id'] > stats["last_id"]:
+                        missing.append(entry)
+                offset += len(line)
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(history.end_offset + complete)
+            self._append_records(records)
+        if missing:
+            for entry in missing:
+                apply_entry(stats, entry)
+                stats["last_id"] = entry['id']
+            _write_json(self.stats_file, stats)
+
+    def _mapped_history(self):
+        records_size = os.path.getsize(self.index_file)
+        records_size -= records_size % RECORD_SIZE
+        index_map = _map(self.index_file, records_size)
+        if index_map is None:
+            return MappedHistory(None, None, 0)
+        records = memoryview(index_map).cast('q')
+        log_map = _map(self.log_file, records[-1])
+        return MappedHistory(log_map, records, records_size // RECORD_SIZE)
+
+    def _append_records(self, records):
+        data = array('q')
+        for record in records:
+            data.extend(record)
+        with open(self.index_file, 'ab') as f:
+            f.write(data.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def refresh(self):
+        """Remap the files if another process (or this one) changed them"""
+        with self._lock:
+            index_signature = _file_signature(self.index_file)
+            stats_signature = _file_signature(self.stats_file)
+            if (index_signature == self._index_signature and
+                    stats_signature == self._stats_signature):
+                return False
+            if index_signature != self._index_signature:
+                # Taken so we never map a log and an index from two different rewrites
+                with self.lock:
+                    index_signature = _file_signature(self.index_file)
+                    previous = self.history
+                    self.history = self._mapped_history()
+                if self._search_index is not None:
+                    if (index_signature and self._index_signature and
+                            index_signature[0] == self._index_signature[0]):
+                        for entry in self.history.iter_range(len(previous), len(self.history)):
+                            self._search_index.add(entry)
+                    else:
+                        # Rewritten by clear or archiving, not appended to
+                        self._search_index = None
+                self._index_signature = index_signature
+            if stats_signature != self._stats_signature:
+                self.stats = _read_json(self.stats_file, None) or new_stats()
+                self.stats.setdefault("last_id", 0)
+                self._stats_signature = stats_signature
+            self.generation += 1
+            return True
+
+    def add_entry(self, entry):
+        return self.add_entries([entry])[0]
+
+    def add_entries(self, entries):
+        with self._lock, self.lock:
+            self.refresh()
+            next_id = max(self.history.last_id, self.stats["last_id"]) + 1
+            for entry in entries:
+                entry['id'] = next_id
+                next_id += 1
+                apply_entry(self.stats, entry)
+                self.stats["last_id"] = entry['id']
+                self.stats["last_updated"] = entry['timestamp']
+            self._append_locked(entries)
+            _write_json(self.stats_file, self.stats)
+            self.refresh()
+            return entries
+
+    def _append_locked(self, entries):
+        """Write entries (ids already assigned, in order) to the log, then the index"""
+        offset = self.history.end_offset
+        seconds = self.history.timestamps[-1] if self.history else 0
+        lines = bytearray()
+        records = []
+        for entry in entries:
+            line = (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8')
+            seconds = _parse_timestamp(entry['timestamp']) or seconds
+            records.append((entry['id'], seconds, offset, offset + len(line)))
+            offset += len(line)
+            lines += line
+        # Log first: a crash before the index is written is repaired on the next open
+        with open(self.log_file, 'ab') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self._append_records(records)
+
+    def increment(self, name, n=1):
+        with self._lock, self.lock:
+            self.refresh()
+            self.stats[name] = self.stats.get(name, 0) + n
+            _write_json(self.stats_file, self.stats)
+            self.refresh()
+
+    def get_history(self, limit=None):
+        """Return the full history (a lazy ``MappedHistory``), or a list of the newest ``limit``"""
+        if limit is None:
+            return self.history
+        return self.history[-limit:] if limit else []
+
+    def get_page(self, limit, before_id=None):
+        """Return up to ``limit`` entries newest first, all with ids below ``before_id``"""
+        history = self.history
+        end = len(history) if before_id is None else history.position_of_id(before_id)
+        return history[max(0, end - limit):end][::-1]
+
+    def iter_entries(self, start_date=None, end_date=None, after_id=0):
+        """Yield entries oldest first with ids above ``after_id``, from ``start_date`` through ``end_date``"""
+        history = self.history
+        start = history.position_of_id(after_id + 1)
+        if start_date:
+            start = max(start, history.position_of_date(start_date))
+        for entry in history.iter_range(start, len(history)):
+            if end_date and entry['timestamp'][:10] > end_date:
+                return
+            yield entry
+
+    def search(self, query, limit=20, start_date=None, end_date=None):
+        """Return the best matching entries for ``query``, each with a ``score``"""
+        with self._lock:
+            history = self.history
+            if self._search_index is None:
+                # The one operation that reads the whole log, and only once
+                self._search_index = SearchIndex()
+                for entry in history:
+                    self._search_index.add(entry)
+            matches = self._search_index.search(query, limit, start_date, end_date)
+            return [{**history[history.position_of_id(entry_id)], 'score': score}
+                    for entry_id, score in matches]
+
+    def archive_before(self, cutoff_date, archive):
+        """Move entries from before ``cutoff_date`` into ``archive``; stats are kept"""
+        with self._lock, self.lock:
+            self.refresh()
+            history = self.history
+            split = history.position_of_date(cutoff_date)
+            if not split:
+                return 0
+            # Archive first: if we crash before the files are rewritten, the next
+            # run finds the same entries again and the archive skips their ids
+            archived = archive.append(history.iter_range(0, split))
+            start = history.offset(split) if split < len(history) else history.end_offset
+            self._rewrite_locked(history, split, start)
+            self.refresh()
+            return archived
+
+    def _rewrite_locked(self, history, split, start):
+        """Replace the log and index with the entries from ``split`` on"""
+        log_tmp = f"{self.log_file}.{os.getpid()}.tmp"
+        index_tmp = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(log_tmp, 'wb') as f:
+            if history:
+                f.write(history._log[start:history.end_offset])
+            f.flush()
+            os.fsync(f.fileno())
+        records = array('q', history._records[split * RECORD_FIELDS:] if history else b"")
+        # Shift the byte ranges to the start of the new log
+        for position in range(2, len(records), RECORD_FIELDS):
+            records[position] -= start
+            records[position + 1] -= start
+        with open(index_tmp, 'wb') as f:
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # Readers only remap under the lock we hold, so they never see one without the other
+        os.replace(log_tmp, self.log_file)
+        os.replace(index_tmp, self.index_file)
+
+    def get_stats(self):
+        return self.stats
+
+    def get_daily_usage(self, start_date, end_date):
+        return {date: count for date, count in self.stats["daily_usage"].items()
+                if start_date <= date <= end_date}
+
+    def clear(self):
+        with self._lock, self.lock:
+            self.refresh()
+            self._rewrite_locked(MappedHistory(None, None, 0), 0, 0)
+            self.stats = new_stats()
+            _write_json(self.stats_file, self.stats)
+            self.refresh()
+
+    def close(self):
+        with self._lock:
+            self.history = MappedHistory(None, None, 0)
+            self._index_signature = None
+            self._search_index = None
+
+
+def migrate_json_to_mapped(data_dir="data", force=False):
+    """Copy json/journal history into the mapped files once; returns the number of entries copied
+
+    Raises RuntimeError if the mapped log already has entries, unless
+    ``force`` is set, in which case they are deleted and replaced.
+    """
+    from sqlite_storage import load_json_history
+
+    backend = MappedBackend(data_dir)
+    try:
+        if backend.history and not force:
+            raise RuntimeError(f"{backend.log_file} already has {len(backend.history)} entries")
+        history, stats = load_json_history(data_dir)
+        with backend._lock, backend.lock:
+            # Ids are kept so the archive, which skips ids it has seen, stays in step
+            backend._rewrite_locked(MappedHistory(None, None, 0), 0, 0)
+            backend.refresh()
+            for start in range(0, len(history), 10000):
+                backend._append_locked(history[start:start + 10000])
+                backend.refresh()
+            stats["last_id"] = max(stats.get("last_id", 0), backend.history.last_id)
+            _write_json(backend.stats_file, stats)
+        return len(history)
+    finally:
+        backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UserHistory memory-mapped storage tools")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--force", action="store_true",
+                        help="replace a mapped history that already has entries; they are deleted")
+    parser.add_argument("--yes", action="store_true",
+                        help="with --force, don't ask before deleting the existing entries")
+    args = parser.parse_args()
+
+    log_file = os.path.join(args.data_dir, 'user_history.log')
+    if args.force and not args.yes:
+        backend = MappedBackend(args.data_dir)
+        existing = len(backend.history)
+        backend.close()
+        if existing:
+            if not sys.stdin.isatty():
+                parser.error(f"{log_file} already has {existing} entries; pass --yes with --force "
+                             "to delete them")
+            answer = input(f"Delete the {existing} entries in {log_file} and replace them? [y/N] ")
+            if answer.strip().lower() not in ("y", "yes"):
+                print("Nothing changed")
+                return
+    try:
+        copied = migrate_json_to_mapped(args.data_dir, args.force)
+    except RuntimeError as e:
+        parser.error(f"{e}; pass --force to replace them")
+    print(f"Migrated {copied} entries into {log_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""In-process latency and error metrics for the rewrite pipeline.
+
+Each stage keeps its most recent durations in a bounded ring buffer (so
+percentiles reflect recent traffic and memory stays flat) plus running
+counts and sums. Errors are counted by stage and exception type. Snapshots
+can be exported as JSON or in the Prometheus text exposition format.
+"""
+import json
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+STAGES = ("auth_check", "history_load", "similar_lookup", "prompt_build", "queue_wait",
+          "model_call", "response_parse", "history_persist")
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of an unsorted sequence"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Metrics:
+    def __init__(self, window=2048):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts = defaultdict(int)
+        self._sums = defaultdict(float)
+        self._errors = defaultdict(int)
+
+    def observe(self, stage, duration_ms):
+        with self._lock:
+            self._samples[stage].append(duration_ms)
+            self._counts[stage] += 1
+            self._sums[stage] += duration_ms
+
+    def record_error(self, stage, exc):
+        with self._lock:
+            self._errors[(stage, type(exc).__name__)] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a block as ``stage``, counting any exception it raises by type"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record_error(stage, e)
+            raise
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000)
+
+    def snapshot(self):
+        """Return per-stage percentiles and counts plus error counters"""
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+            counts = dict(self._counts)
+            sums = dict(self._sums)
+            errors = dict(self._errors)
+        stages = {}
+        for stage, values in samples.items():
+            stages[stage] = {
+                "count": counts[stage],
+                "sum_ms": round(sums[stage], 3),
+                "window": len(values),
+                **{f"p{int(q * 100)}_ms": round(percentile(values, q), 3) for q in QUANTILES}
+            }
+        return {
+            "stages": stages,
+            "errors": [{"stage": stage, "type": error_type, "count": count}
+                       for (stage, error_type), count in sorted(errors.items())]
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Render the snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP rewriter_stage_duration_ms Rewrite pipeline stage durations in milliseconds.",
+            "# TYPE rewriter_stage_duration_ms summary",
+        ]
+        for stage, values in sorted(snapshot["stages"].items()):
+            for q in QUANTILES:
+                lines.append(f'rewriter_stage_duration_ms{{stage="{stage}",quantile="{q}"}} '
+                             f'{values[f"p{int(q * 100)}_ms"]}')
+            lines.append(f'rewriter_stage_duration_ms_sum{{stage="{stage}"}} {values["sum_ms"]}')
+            lines.append(f'rewriter_stage_duration_ms_count{{stage="{stage}"}} {values["count"]}')
+        lines += [
+            "# HELP rewriter_errors_total Rewrite pipeline errors by stage and exception type.",
+            "# TYPE rewriter_errors_total counter",
+        ]
+        for error in snapshot["errors"]:
+            lines.append(f'rewriter_errors_total{{stage="{error["stage"]}",type="{error["type"]}"}} '
+                         f'{error["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._sums.clear()
+            self._errors.clear()
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """Return the process-wide metrics registry"""
+    return _metrics
@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+import os
+import streamlit as st
+from auth import check_password, current_user
+from bootstrap import load_env
+from batch import BatchJob, detect_format
+from user_data import UserHistory
+import llm
+
+# Load environment variables (once per process, not on every rerun)
+load_env()
+
+# Set page configuration
+st.set_page_config(
+    page_title="Batch Rewrite - Text Rewriter",
+    page_icon="📦",
+    layout="wide"
+)
+
+# Check authentication before showing anything
+if check_password():
+    # Configure Gemini API (not needed with LLM_BACKEND=fake)
+    if llm.needs_api_key():
+        if 'GEMINI_API_KEY' in st.secrets:
+            llm.configure(st.secrets['GEMINI_API_KEY'])
+        else:
+            st.error('Error: GEMINI_API_KEY not found in Streamlit secrets')
+            st.stop()
+
+    st.title("📦 Batch Rewrite")
+    st.markdown("Upload a CSV, JSONL or TXT file and rewrite every row. "
+                "Uploading the same file again resumes an interrupted job.")
+
+    uploaded = st.file_uploader("Input file", type=["csv", "jsonl", "txt"])
+    if uploaded is not None:
+        data = uploaded.getvalue()
+        fmt = detect_format(uploaded.name)
+
+        # Let the user pick which column/field holds the text
+        text_field = "text"
+        if fmt == "csv":
+            header = next(csv.reader(io.StringIO(data.decode('utf-8').split("\n", 1)[0])), [])
+            text_field = st.selectbox("Text column", header,
+                                      index=header.index("text") if "text" in header else 0)
+        elif fmt == "jsonl":
+            first_line = data.decode('utf-8').split("\n", 1)[0]
+            fields = list(json.loads(first_line)) if first_line.strip() else ["text"]
+            text_field = st.selectbox("Text field", fields,
+                                      index=fields.index("text") if "text" in fields else 0)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            workers = st.slider("Concurrent requests", 1, 16, 4)
+        with col2:
+            rate = st.number_input("Max requests per second", min_value=0.1, value=5.0, step=0.5)
+
+        # Jobs and their rewrites live in the user's shard, so the same file uploaded
+        # by two people is two separate jobs
+        user_history = UserHistory.shared(user=current_user())
+        job = BatchJob.from_upload(data, uploaded.name, batch_dir=os.path.join(user_history.data_dir, "batch"),
+                                   text_field=text_field, workers=workers, rate=rate,
+                                   user_history=user_history)
+        total = job.total_rows()
+        checkpoint = job.load_checkpoint()
+        if 0 < checkpoint["rows_done"] < total:
+            st.info(f"Resuming: {checkpoint['rows_done']:,} of {total:,} rows already done.")
+
+        if checkpoint["rows_done"] < total and st.button("🚀 Start Batch", type="primary"):
+            progress_bar = st.progress(checkpoint["rows_done"] / total)
+
+            def on_progress(rows_done, failed):
+                progress_bar.progress(rows_done / total,
+                                      text=f"{rows_done:,} of {total:,} rows ({failed:,} failed)")
+
+            checkpoint = job.run(on_progress=on_progress)
+
+        if checkpoint["rows_done"] >= total and os.path.exists(job.output_path):
+            st.success(f"Done: {total:,} rows, {checkpoint['failed']:,} failed.")
+            with open(job.output_path, 'rb') as f:
+                st.download_button("⬇️ Download Results", f,
+                                   file_name=f"rewritten_{uploaded.name}")
@@ -1,7 +1,15 @@
+import os
+import tempfile
+import time
 import streamlit as st
 from datetime import datetime
-from auth import check_password
+from auth import check_password, current_user
+from bootstrap import load_env
 from user_data import UserHistory
+import export
+
+# Load environment variables (once per process, not on every rerun)
+load_env()
 
 # Set page configuration
 st.set_page_config(
@@ -122,42 +130,135 @@ if check_password():
     st.markdown('<p class="subtitle">View your previous text rewrites</p>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
-    # Initialize user history
-    user_history = UserHistory()
+    # Only this user's shard is loaded
+    user_history = UserHistory.shared(user=current_user())
+
+    def show_entry(entry):
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown(f"### 🕒 {entry['timestamp']}")
+        
+        # Original text
+        st.markdown("**Original Text:**")
+        st.text_area(
+            "",
+            value=entry['original'],
+            height=80,
+            key=f"hist_orig_{entry['id']}",
+            disabled=True
+        )
+        
+        # Rewritten text
+        st.markdown("**Rewritten Text:**")
+        st.text_area(
+            "",
+            value=entry['rewritten'],
+            height=80,
+            key=f"hist_rew_{entry['id']}",
+            disabled=True
+        )
+        st.markdown('</div>', unsafe_allow_html=True)
 
-    # Display history
-    history_entries = user_history.get_history()
+    # Export, written to a file a chunk at a time rather than built up in memory
+    with st.expander("⬇️ Export history"):
+        fmt_col, fields_col, range_col = st.columns([1, 3, 2])
+        with fmt_col:
+            export_format = st.selectbox("Format", list(export.FORMATS))
+        with fields_col:
+            export_fields = st.multiselect("Fields", export.FIELDS, default=list(export.FIELDS))
+        with range_col:
+            export_range = st.date_input("Dates", value=(), format="YYYY-MM-DD", key="export_range")
+        if st.button("Prepare export", disabled=not export_fields):
+            exports_dir = os.path.join(user_history.data_dir, "exports")
+            os.makedirs(exports_dir, exist_ok=True)
+            # Replace this session's last export and drop any that old sessions left behind
+            previous = st.session_state.pop("export_file", None)
+            for name in os.listdir(exports_dir):
+                path = os.path.join(exports_dir, name)
+                try:
+                    if (previous and os.path.samefile(path, previous[0])
+                            or time.time() - os.path.getmtime(path) > 3600):
+                        os.remove(path)
+                except OSError:
+                    # Another session removed it first
+                    pass
+            try:
+                chunks = export.iter_export(
+                    user_history, export_format,
+                    export_range[0].strftime("%Y-%m-%d") if export_range else None,
+                    export_range[-1].strftime("%Y-%m-%d") if export_range else None,
+                    export_fields)
+                handle, path = tempfile.mkstemp(suffix=export.FORMATS[export_format][1], dir=exports_dir)
+                with os.fdopen(handle, 'wb') as f:
+                    for data in chunks:
+                        f.write(data)
+                st.session_state.export_file = (path, export_format)
+            except Exception as e:
+                st.error(f"Export failed: {e}")
+        export_file = st.session_state.get("export_file")
+        if export_file and os.path.exists(export_file[0]):
+            path, fmt = export_file
+            with open(path, 'rb') as f:
+                st.download_button(f"Download {fmt.upper()} ({os.path.getsize(path) / 2**20:,.1f} MB)", f,
+                                   file_name=f"history{export.FORMATS[fmt][1]}",
+                                   mime=export.FORMATS[fmt][0])
+
+    # Search box with an optional date range
+    search_col, date_col = st.columns([3, 2])
+    with search_col:
+        query = st.text_input("Search", placeholder="Search original or rewritten text...",
+                              label_visibility="collapsed")
+    with date_col:
+        date_range = st.date_input("Date range", value=(), label_visibility="collapsed",
+                                   format="YYYY-MM-DD")
+    if query:
+        start_date = date_range[0].strftime("%Y-%m-%d") if date_range else None
+        end_date = date_range[-1].strftime("%Y-%m-%d") if date_range else None
+        results = user_history.search(query, limit=50, start_date=start_date, end_date=end_date)
+        col1, col2, col3 = st.columns([1, 6, 1])
+        with col2:
+            st.caption(f"{len(results)} rewrites matching “{query}”, best match first" if results
+                       else f"No rewrites match “{query}”")
+            for entry in results:
+                show_entry(entry)
+        st.stop()
+
+    # Display one page of history; the cursor stack holds the before_id of each page visited
+    cursors = st.session_state.setdefault("history_cursors", [None])
+    page_size = st.session_state.get("history_page_size", 20)
+
+    def reset_pages():
+        cursors[:] = [None]
+
+    history_entries = user_history.get_page(page_size, before_id=cursors[-1])
+    if not history_entries and len(cursors) > 1:
+        # The page we were on was cleared or archived; start again from the newest
+        cursors[:] = [None]
+        history_entries = user_history.get_page(page_size)
     if history_entries:
         col1, col2, col3 = st.columns([1, 6, 1])
         with col2:
-            for entry in reversed(history_entries):
-                st.markdown('<div class="card">', unsafe_allow_html=True)
-                st.markdown(f"### 🕒 {entry['timestamp']}")
-                
-                # Original text
-                st.markdown("**Original Text:**")
-                st.text_area(
-                    "",
-                    value=entry['original'],
-                    height=80,
-                    key=f"hist_orig_{entry['timestamp']}",
-                    disabled=True
-                )
-                
-                # Rewritten text
-                st.markdown("**Rewritten Text:**")
-                st.text_area(
-                    "",
-                    value=entry['rewritten'],
-                    height=80,
-                    key=f"hist_rew_{entry['timestamp']}",
-                    disabled=True
-                )
-                st.markdown('</div>', unsafe_allow_html=True)
+            for entry in history_entries:
+                show_entry(entry)
+
+            # Page navigation
+            total = user_history.stats["total_rewrites"]
+            nav1, nav2, nav3, nav4 = st.columns([1, 2, 1, 1])
+            with nav1:
+                st.button("← Newer", disabled=len(cursors) == 1, on_click=cursors.pop)
+            with nav2:
+                st.caption(f"Page {len(cursors)} · {total:,} rewrites in total")
+            with nav3:
+                st.selectbox("Per page", [10, 20, 50, 100], key="history_page_size",
+                             index=1, label_visibility="collapsed",
+                             on_change=reset_pages)
+            with nav4:
+                st.button("Older →", disabled=len(history_entries) < page_size,
+                          on_click=cursors.append, args=(history_entries[-1]['id'],))
                 
             # Clear history button
             if st.button("🗑️ Clear All History", type="primary"):
                 user_history.clear_history()
+                reset_pages()
                 st.rerun()
     else:
         st.info("No history available yet. Your rewritten texts will appear here once you start using the Text Rewriter.") 
\ No newline at end of file
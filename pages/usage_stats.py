@@ -1,10 +1,11 @@
 import streamlit as st
-import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
-from datetime import datetime, timedelta
-from auth import check_password
-from user_data import UserHistory
+from auth import check_password, current_user
+from bootstrap import load_env
+from user_data import HistoryRollup, UserHistory
+from metrics import get_metrics, STAGES
+
+# Load environment variables (once per process, not on every rerun)
+load_env()
 
 # Set page configuration
 st.set_page_config(
@@ -15,6 +16,11 @@ st.set_page_config(
 
 # Check authentication before showing anything
 if check_password():
+    # Plotting libraries are only loaded once someone is signed in
+    import plotly.express as px
+    import plotly.graph_objects as go
+    import pandas as pd
+
     # Add custom CSS
     st.markdown("""
         <style>
@@ -42,12 +48,17 @@ if check_password():
     # Title
     st.title("📊 Usage Statistics")
     
-    # Initialize user history
-    user_history = UserHistory()
-    stats = user_history.get_usage_stats()
+    # This user's own shard, or the rollup summed over every shard's stats
+    user_history = UserHistory.shared(user=current_user())
+    scope = st.radio("Usage of", ["You", "All users"], horizontal=True)
+    usage = user_history if scope == "You" else HistoryRollup.shared()
+    if usage is not user_history:
+        st.caption(f"Summed over every user's history ({usage.users:,} in all) "
+                   "and the shared one used by the API and CLI")
+    stats = usage.get_usage_stats()
     
     # Display key metrics
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.markdown("""
@@ -72,10 +83,25 @@ if check_password():
                 <div class="stat-number">{:,.0f}</div>
             </div>
         """.format(stats["avg_text_length"]), unsafe_allow_html=True)
+
+    with col4:
+        st.markdown("""
+            <div class="stat-card">
+                <div class="stat-label">Cache Hits</div>
+                <div class="stat-number">{:,}</div>
+            </div>
+        """.format(stats.get("cache_hits", 0)), unsafe_allow_html=True)
     
+    # Latency: time to first token is what users perceive, total is the full response
+    summary = usage.get_stats_summary()
+    if summary["avg_latency_ms"] is not None:
+        col1, col2 = st.columns(2)
+        col1.metric("Avg Time to First Token", f"{summary['avg_ttft_ms']:,.0f} ms")
+        col2.metric("Avg Total Latency", f"{summary['avg_latency_ms']:,.0f} ms")
+
     # Daily usage chart
     st.subheader("Daily Usage")
-    daily_usage = user_history.get_daily_usage()
+    daily_usage = usage.get_daily_usage()
     
     df = pd.DataFrame(list(daily_usage.items()), columns=['Date', 'Rewrites'])
     df['Date'] = pd.to_datetime(df['Date'])
@@ -90,20 +116,85 @@ if check_password():
         hovermode='x unified'
     )
     st.plotly_chart(fig, use_container_width=True)
-    
+
+    # Pipeline latency percentiles, from this server process's recent requests
+    st.subheader("Pipeline Latency")
+    metrics = get_metrics()
+    snapshot = metrics.snapshot()
+    if snapshot["stages"]:
+        latency_rows = []
+        for stage in STAGES:
+            if stage in snapshot["stages"]:
+                values = snapshot["stages"][stage]
+                for label in ("p50", "p95", "p99"):
+                    latency_rows.append({"Stage": stage, "Percentile": label,
+                                         "Milliseconds": values[f"{label}_ms"]})
+        fig = px.bar(pd.DataFrame(latency_rows), x='Stage', y='Milliseconds',
+                     color='Percentile', barmode='group',
+                     title='Stage Latency (p50 / p95 / p99)')
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.info("No requests timed yet in this server process.")
+
+    # The rewrite chain (and the model client behind it) is only loaded past the login screen
+    from engine import get_engine
+    import rewriter
+
+    engine_stats = get_engine().stats()
+    st.caption(f"Rewrite engine: {engine_stats['queued']} queued · "
+               f"{engine_stats['in_flight']} of {engine_stats['max_in_flight']} in flight · "
+               f"{engine_stats['coalesced']} shared calls · {engine_stats['rejected']} turned away · "
+               f"{engine_stats['expired']} timed out")
+    st.caption(f"Model calls: {stats.get('model_retries', 0):,} retries · "
+               f"{stats.get('model_fallbacks', 0):,} served by a fallback model · "
+               f"{stats.get('model_hedges', 0):,} hedged · "
+               f"{stats.get('model_circuit_skips', 0):,} skipped with the circuit open")
+    similar_cache = rewriter.get_similar_cache(user_history)
+    if similar_cache is not None:
+        similar = similar_cache.stats()
+        hit_rate = f"{similar['hit_rate']:.0%}" if similar['hit_rate'] is not None else "n/a"
+        st.caption(f"Similar-text cache: {user_history.stats.get('similar_hits', 0):,} of your rewrites reused · "
+                   f"{hit_rate} hit rate over {similar['lookups']:,} lookups in this process · "
+                   f"{similar['entries']:,} texts indexed")
+
+    if snapshot["errors"]:
+        st.markdown("**Errors by type**")
+        st.dataframe(pd.DataFrame(snapshot["errors"]), use_container_width=True, hide_index=True)
+
+    with st.expander("Export metrics"):
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Prometheus text", metrics.to_prometheus(),
+                               file_name="rewriter_metrics.prom", mime="text/plain")
+        with col2:
+            st.download_button("JSON", metrics.to_json(),
+                               file_name="rewriter_metrics.json", mime="application/json")
+
+    # Monthly usage, from the pre-aggregated monthly rollup
+    monthly_usage = usage.get_monthly_usage()
+    if monthly_usage:
+        st.subheader("Monthly Usage")
+        fig = px.bar(x=list(monthly_usage), y=list(monthly_usage.values()),
+                     labels={'x': "Month", 'y': "Number of Rewrites"},
+                     title='Rewrites per Month')
+        st.plotly_chart(fig, use_container_width=True)
+
+    # Latency distribution of all timed rewrites
+    latency_histogram = usage.get_latency_histogram()
+    if any(count for _, count in latency_histogram):
+        st.subheader("Latency Distribution")
+        fig = px.bar(x=[label for label, _ in latency_histogram],
+                     y=[count for _, count in latency_histogram],
+                     labels={'x': "Total latency", 'y': "Number of Rewrites"},
+                     title='Rewrites by Total Latency')
+        st.plotly_chart(fig, use_container_width=True)
+
     # Usage heatmap
     st.subheader("Usage Heatmap")
-    history = user_history.get_history()
-    
-    # Convert timestamps to hour of day
-    hours = [datetime.strptime(entry['timestamp'], "%Y-%m-%d %H:%M:%S").hour 
-            for entry in history]
-    
-    # Create hour distribution
-    hour_dist = pd.Series(hours).value_counts().sort_index()
+    hourly_usage = usage.get_hourly_usage()
     
     # Create heatmap data
-    heatmap_data = [[hour_dist.get(hour, 0)] for hour in range(24)]
+    heatmap_data = [[count] for count in hourly_usage]
     
     fig = go.Figure(data=go.Heatmap(
         z=heatmap_data,
@@ -117,4 +208,4 @@ if check_password():
         height=600
     )
     
-    st.plotly_chart(fig, use_container_width=True) 
\ No newline at end of file
+    st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Normalize text so trivially different pastes share a cache key"""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").strip()
+    return "\n".join(re.sub(r"[ \t]+", " ", line).strip() for line in text.split("\n"))
+
+
+def cache_key(text, prompt_template, generation_config, model_name):
+    """Content address for a rewrite: input text, prompt and model settings"""
+    payload = json.dumps({
+        "text": normalize_text(text),
+        "prompt": prompt_template,
+        "config": generation_config,
+        "model": model_name
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RewriteCache:
+    """In-memory LRU of rewrites with TTL expiry, optionally backed by SQLite on disk"""
+
+    def __init__(self, max_entries=512, ttl=3600, disk_path=None, disk_ttl=7 * 24 * 3600,
+                 max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        self._disk_writes = 0
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False,
+                                         isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("CREATE TABLE IF NOT EXISTS rewrites "
+                               "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            self._disk.execute("CREATE INDEX IF NOT EXISTS rewrites_created ON rewrites (created)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                value, created = item
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+
+            if self._disk is None:
+                return None
+            row = self._disk.execute("SELECT value, created FROM rewrites WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if now - created > self.disk_ttl:
+                self._disk.execute("DELETE FROM rewrites WHERE key = ?", (key,))
+                return None
+            # Promote to the memory tier
+            self._remember(key, value, now)
+            return value
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._disk is not None:
+                self._disk.execute("INSERT OR REPLACE INTO rewrites (key, value, created) "
+                                   "VALUES (?, ?, ?)", (key, value, now))
+                self._disk_writes += 1
+                if self._disk_writes % 1000 == 0:
+                    self._prune_disk(now)
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _prune_disk(self, now):
+        self._disk.execute("DELETE FROM rewrites WHERE created < ?", (now - self.disk_ttl,))
+        self._disk.execute("DELETE FROM rewrites WHERE key IN (SELECT key FROM rewrites "
+                           "ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.max_disk_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM rewrites")
+
+    def __len__(self):
+        return len(self._memory)
@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from chunking import split_text, join_chunks
+from engine import get_engine
+from metrics import get_metrics
+from llm import GENERATION_CONFIG, generate, generate_stream, primary_model
+from rewrite_cache import RewriteCache, cache_key
+from similar_cache import SimilarityCache
+from user_data import UserHistory
+
+PROMPT_TEMPLATE = '''make this in very natural language that normal man speck in active voice in hindi just provide the output text:
+
+                {input_text}'''
+
+_cache = None
+_cache_lock = threading.Lock()
+# One near-duplicate index per UserHistory, dropped along with it
+_similar_caches = weakref.WeakKeyDictionary()
+
+
+def get_cache():
+    """Return the process-wide rewrite cache, configured from the environment"""
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            return _cache
+        disk_path = None
+        if os.getenv("REWRITE_CACHE_DISK", "1") == "1":
+            os.makedirs("data", exist_ok=True)
+            disk_path = os.path.join("data", "rewrite_cache.db")
+        _cache = RewriteCache(
+            max_entries=int(os.getenv("REWRITE_CACHE_SIZE", "512")),
+            ttl=float(os.getenv("REWRITE_CACHE_TTL", "3600")),
+            disk_path=disk_path
+        )
+        return _cache
+
+
+def get_similar_cache(user_history):
+    """Return the near-duplicate cache over ``user_history``, or None when it is turned off
+
+    ``REWRITE_SIMILAR_THRESHOLD`` (0 to 1, default 0 = off) is the estimated
+    similarity an earlier input needs for its rewrite to be reused.
+    """
+    threshold = float(os.getenv("REWRITE_SIMILAR_THRESHOLD", "0"))
+    if threshold <= 0:
+        return None
+    with _cache_lock:
+        similar_cache = _similar_caches.get(user_history)
+        if similar_cache is None:
+            # A proxy, so the cache doesn't keep its own dictionary key alive
+            similar_cache = _similar_caches[user_history] = SimilarityCache(
+                weakref.proxy(user_history), threshold,
+                max_entries=int(os.getenv("REWRITE_SIMILAR_MAX_ENTRIES", "20000")))
+        return similar_cache
+
+
+def find_similar(input_text, user_history=None):
+    """Return (earlier entry, similarity) for a near-identical earlier input, or None"""
+    similar_cache = get_similar_cache(user_history or UserHistory.shared())
+    return similar_cache.lookup(input_text) if similar_cache is not None else None
+
+
+def build_prompt(input_text):
+    return PROMPT_TEMPLATE.format(input_text=input_text)
+
+
+class _Events:
+    """Reports pipeline stages with the milliseconds since the request started"""
+
+    def __init__(self, on_event):
+        self.on_event = on_event
+        self.start = time.perf_counter()
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def emit(self, stage):
+        elapsed_ms = self.elapsed_ms()
+        if self.on_event:
+            self.on_event(stage, elapsed_ms)
+        return elapsed_ms
+
+
+def rewrite_text(input_text, user_history=None, on_event=None, allow_similar=True):
+    """Rewrite text with Gemini, serving repeated inputs from the rewrite cache.
+
+    ``on_event(stage, elapsed_ms)`` is called as the request reaches each of
+    "queued", "cache_hit", "similar_hit", "request_sent", "response_received"
+    and "done". With ``allow_similar`` a near-identical earlier input's
+    rewrite is reused when the similarity cache is on.
+    """
+    events = _Events(on_event)
+    events.emit("queued")
+    user_history = user_history or UserHistory.shared()
+    cache = get_cache()
+    key = cache_key(input_text, PROMPT_TEMPLATE, GENERATION_CONFIG, primary_model())
+
+    cached = cache.get(key)
+    if cached is not None:
+        events.emit("cache_hit")
+        user_history.increment("cache_hits")
+        events.emit("done")
+        return cached
+
+    similar = find_similar(input_text, user_history) if allow_similar else None
+    if similar is not None:
+        events.emit("similar_hit")
+        user_history.increment("similar_hits")
+        events.emit("done")
+        return similar[0]['rewritten']
+
+    metrics = get_metrics()
+    with metrics.timer("prompt_build"):
+        prompt = build_prompt(input_text)
+    sent_ms = events.emit("request_sent")
+    # Identical inputs rewritten at the same moment share one upstream call
+    text = get_engine().run(key, lambda: generate(prompt, record=user_history.increment))
+    latency_ms = events.emit("response_received") - sent_ms
+
+    # Add to history when successful
+    if text:
+        cache.put(key, text)
+        with metrics.timer("history_persist"):
+            user_history.add_entry(input_text, text, latency_ms=latency_ms)
+    events.emit("done")
+    return text
+
+
+def stream_rewrite(input_text, user_history=None, on_event=None, allow_similar=True):
+    """Yield the rewrite chunk by chunk; history is recorded once the stream finishes.
+
+    Stages reported to ``on_event`` are "queued", "cache_hit", "similar_hit",
+    "request_sent", "first_token" and "done".
+    """
+    events = _Events(on_event)
+    events.emit("queued")
+    user_history = user_history or UserHistory.shared()
+    cache = get_cache()
+    key = cache_key(input_text, PROMPT_TEMPLATE, GENERATION_CONFIG, primary_model())
+
+    cached = cache.get(key)
+    if cached is not None:
+        events.emit("cache_hit")
+        user_history.increment("cache_hits")
+        yield cached
+        events.emit("done")
+        return
+
+    similar = find_similar(input_text, user_history) if allow_similar else None
+    if similar is not None:
+        events.emit("similar_hit")
+        user_history.increment("similar_hits")
+        yield similar[0]['rewritten']
+        events.emit("done")
+        return
+
+    metrics = get_metrics()
+    with metrics.timer("prompt_build"):
+        prompt = build_prompt(input_text)
+    sent_ms = events.emit("request_sent")
+    ttft_ms = None
+    parts = []
+    chunks = get_engine().stream(key, lambda: generate_stream(prompt, record=user_history.increment))
+    for chunk in chunks:
+        if ttft_ms is None:
+            ttft_ms = events.emit("first_token") - sent_ms
+        parts.append(chunk)
+        yield chunk
+    latency_ms = events.elapsed_ms() - sent_ms
+
+    text = "".join(parts)
+    if text:
+        cache.put(key, text)
+        with metrics.timer("history_persist"):
+            user_history.add_entry(input_text, text, ttft_ms=ttft_ms, latency_ms=latency_ms)
+    events.emit("done")
+
+
+def rewrite_one(text, cache=None, user_history=None):
+    """Rewrite one piece of text without recording history, returning (text, served_from_cache)
+
+    Retries and model fallbacks still count towards ``user_history``'s stats.
+    """
+    cache = cache or get_cache()
+    user_history = user_history or UserHistory.shared()
+    key = cache_key(text, PROMPT_TEMPLATE, GENERATION_CONFIG, primary_model())
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, True
+    prompt = build_prompt(text)
+    rewritten = get_engine().run(key, lambda: generate(prompt, record=user_history.increment))
+    if not rewritten:
+        raise ValueError("Empty response from Gemini")
+    cache.put(key, rewritten)
+    return rewritten, False
+
+
+def rewrite_document(input_text, user_history=None, max_chars=None, workers=None,
+                     retries=2, on_progress=None):
+    """Rewrite long text as size-bounded chunks in parallel and reassemble them in order.
+
+    ``on_progress(index, total, status)`` is called from the calling thread with
+    status "queued", "done", "cached", "retrying" or "failed", so it may update
+    Streamlit elements. A chunk that still fails after ``retries`` extra
+    attempts aborts the document and re-raises its error.
+    """
+    user_history = user_history or UserHistory.shared()
+    max_chars = max_chars or int(os.getenv("REWRITE_CHUNK_CHARS", "3000"))
+    workers = workers or int(os.getenv("REWRITE_CHUNK_WORKERS", "4"))
+    cache = get_cache()
+    chunks = split_text(input_text, max_chars)
+
+    def report(index, status):
+        if on_progress:
+            on_progress(index, len(chunks), status)
+
+    start = time.perf_counter()
+    results = [None] * len(chunks)
+    attempts = [0] * len(chunks)
+    cache_hits = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for index, (text, _) in enumerate(chunks):
+            pending[pool.submit(rewrite_one, text, cache, user_history)] = index
+            report(index, "queued")
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    results[index], cached = future.result()
+                except Exception:
+                    attempts[index] += 1
+                    if attempts[index] > retries:
+                        report(index, "failed")
+                        for other in pending:
+                            other.cancel()
+                        raise
+                    # Retry just this chunk
+                    report(index, "retrying")
+                    pending[pool.submit(rewrite_one, chunks[index][0], cache, user_history)] = index
+                    continue
+                cache_hits += cached
+                report(index, "cached" if cached else "done")
+    latency_ms = (time.perf_counter() - start) * 1000
+
+    text = join_chunks(chunks, results)
+    if cache_hits:
+        user_history.increment("cache_hits", cache_hits)
+    if text:
+        user_history.add_entry(input_text, text, latency_ms=latency_ms)
+    return text
@@ -0,0 +1,109 @@
+"""Incremental full-text index over rewrite history.
+
+Python's ``\\w`` (and SQLite's default unicode61 tokenizer) treat Indic
+vowel signs, virama and anusvara as separators, which breaks Hindi words
+like "नमस्ते" into single letters. The tokenizer here keeps those combining
+marks inside words, splits on the danda, casefolds, and strips Latin accents
+so "café" matches "cafe".
+
+Postings are compact arrays of document positions and term frequencies that
+are appended to as entries arrive; queries are scored with BM25 in numpy.
+"""
+import math
+import re
+import unicodedata
+from array import array
+from collections import Counter
+
+INDIC_MARKS = "".join(chr(code) for code in range(0x0900, 0x0E00)
+                      if unicodedata.category(chr(code)).startswith("M"))
+TOKEN_RE = re.compile(f"[\\w{INDIC_MARKS}]+")
+LATIN_ACCENTED = re.compile("[\u00c0-\u024f\u1e00-\u1eff]")
+LATIN_ACCENTS = re.compile("[\u0300-\u036f]")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """Split text into casefolded search terms, keeping Indic words whole"""
+    text = text.casefold()
+    if not text.isascii():
+        # Zero-width joiners only change how a conjunct is drawn, not the word
+        text = text.replace("\u200c", "").replace("\u200d", "")
+        if LATIN_ACCENTED.search(text):
+            text = LATIN_ACCENTS.sub("", unicodedata.normalize("NFKD", text))
+        text = unicodedata.normalize("NFC", text)
+    return TOKEN_RE.findall(text)
+
+
+def _day(timestamp):
+    # "2024-01-31 12:00:00" -> 20240131, comparable as an integer
+    return int(timestamp[:10].replace("-", ""))
+
+
+class SearchIndex:
+    """Inverted index over the original and rewritten text of each entry"""
+
+    def __init__(self):
+        self.ids = array("q")
+        self.days = array("i")
+        self.lengths = array("I")
+        self.total_length = 0
+        # term -> (document positions, term frequencies), both in insertion order
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, entry):
+        position = len(self.ids)
+        terms = Counter(tokenize(entry['original']) + tokenize(entry['rewritten']))
+        postings_by_term = self.postings
+        for term, count in terms.items():
+            postings = postings_by_term.get(term)
+            if postings is None:
+                postings = postings_by_term[term] = (array("I"), array("H"))
+            postings[0].append(position)
+            postings[1].append(count if count < 0xFFFF else 0xFFFF)
+        length = sum(terms.values())
+        self.ids.append(entry['id'])
+        self.days.append(_day(entry['timestamp']))
+        self.lengths.append(length)
+        self.total_length += length
+
+    def search(self, query, limit=20, start_date=None, end_date=None):
+        """Return up to ``limit`` (entry id, score) pairs, best match first"""
+        import numpy as np
+
+        postings_by_term = [self.postings[term] for term in set(tokenize(query))
+                            if term in self.postings]
+        if not postings_by_term:
+            return []
+        count = len(self.ids)
+        # Length normalisation is per document, so work it out once for all terms
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+        norm = (K1 * (1 - B)) + (K1 * B / (self.total_length / count)) * lengths.astype(np.float32)
+        scores = np.zeros(count, dtype=np.float32)
+        for postings in postings_by_term:
+            positions = np.frombuffer(postings[0], dtype=np.uint32)
+            frequency = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+            idf = math.log(1 + (count - len(positions) + 0.5) / (len(positions) + 0.5))
+            scores[positions] += (idf * (K1 + 1)) * frequency / (frequency + norm[positions])
+
+        if start_date or end_date:
+            days = np.frombuffer(self.days, dtype=np.int32)
+            if start_date:
+                scores[days < _day(start_date)] = 0
+            if end_date:
+                scores[days > _day(end_date)] = 0
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > limit:
+            # Keep everything tied with the limit-th best score, so ties are broken below, not here
+            cutoff = np.partition(scores[matches], len(matches) - limit)[len(matches) - limit]
+            matches = matches[scores[matches] >= cutoff]
+        # Best score first; newer entries win ties
+        order = matches[np.lexsort((-matches, -scores[matches]))][:limit]
+        return [(self.ids[position], float(scores[position])) for position in order.tolist()]
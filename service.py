@@ -0,0 +1,117 @@
+"""Headless rewrite service: the rewriter and history without Streamlit.
+
+``api.py`` (HTTP) and ``cli.py`` (stdin to stdout) are built on this, and
+other code can import it directly. Calls still go through the shared
+engine, rewrite cache and history, the same as in the app. What's skipped
+is the Streamlit script rerun, so nothing is re-rendered, re-checked or
+re-loaded per request.
+
+Outside Streamlit the API key comes from ``GEMINI_API_KEY`` in the
+environment (or ``.env``), falling back to ``.streamlit/secrets.toml``
+(see ``bootstrap.configure``).
+"""
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rewriter
+from bootstrap import configure
+from engine import get_engine
+from export import iter_export
+from user_data import UserHistory
+
+COUNTERS = ("cache_hits", "similar_hits", "model_retries", "model_fallbacks", "model_hedges",
+            "model_circuit_skips")
+
+
+def describe_error(e):
+    return f"{type(e).__name__}: {e}"
+
+
+class RewriteService:
+    """Rewrites and history for one data directory, callable from any thread"""
+
+    def __init__(self, data_dir="data", storage=None, workers=None, user=None):
+        configure()
+        # The shared history, or ``user``'s shard
+        self.user_history = UserHistory.shared(data_dir=data_dir, storage=storage, user=user)
+        # Threads only wait on the engine, which caps the upstream calls
+        self.workers = workers or int(os.getenv("REWRITE_SERVICE_WORKERS", "32"))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rewrite-service")
+
+    def rewrite(self, text):
+        """Rewrite one text, recording it in the history like the app does"""
+        return rewriter.rewrite_text(text, user_history=self.user_history)
+
+    def stream(self, text):
+        """Yield the rewrite of one text chunk by chunk"""
+        return rewriter.stream_rewrite(text, user_history=self.user_history)
+
+    def submit(self, text):
+        """Start rewriting ``text`` on the service's threads and return a Future"""
+        return self.executor.submit(self.rewrite, text)
+
+    def _rewrite_item(self, text):
+        """Rewrite one item of a batch; returns (rewritten, error) instead of raising"""
+        if not text.strip():
+            return "", None
+        try:
+            return self.rewrite(text), None
+        except Exception as e:
+            return "", describe_error(e)
+
+    def rewrite_many(self, texts, window=None):
+        """Yield (text, rewritten, error) for each text in input order
+
+        Each result is yielded as soon as it and every text before it are
+        done. ``texts`` is read on its own thread, so it can be a slow or
+        endless stream such as stdin; at most ``window`` texts are in flight.
+        """
+        window = window or self.workers
+        slots = threading.Semaphore(window)
+        pending = queue.Queue()
+        end = object()
+
+        def read():
+            try:
+                for text in texts:
+                    slots.acquire()
+                    pending.put((text, self.executor.submit(self._rewrite_item, text)))
+            except Exception as e:
+                pending.put((end, e))
+                return
+            pending.put((end, None))
+
+        threading.Thread(target=read, name="rewrite-service-reader", daemon=True).start()
+        while True:
+            text, future = pending.get()
+            if text is end:
+                if future is not None:
+                    raise future
+                return
+            result = future.result()
+            slots.release()
+            yield (text,) + result
+
+    def history(self, limit=20, before_id=None):
+        return self.user_history.get_page(limit, before_id)
+
+    def search(self, query, limit=20, start_date=None, end_date=None):
+        return self.user_history.search(query, limit, start_date, end_date)
+
+    def export(self, fmt="jsonl", start_date=None, end_date=None, fields=None):
+        """Return the history export as an iterator of byte chunks (see ``export.iter_export``)"""
+        return iter_export(self.user_history, fmt, start_date, end_date, fields)
+
+    def stats(self):
+        """Usage summary, named counters and the engine's queue state"""
+        stats = self.user_history.get_usage_stats()
+        return {
+            "summary": self.user_history.get_stats_summary(),
+            "counters": {name: stats.get(name, 0) for name in COUNTERS},
+            "engine": get_engine().stats(),
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,240 @@
+"""Near-duplicate lookup over past rewrites (MinHash signatures in an LSH index).
+
+The exact rewrite cache only hits when the normalized text is identical.
+This catches resubmissions that differ by whitespace, punctuation or a word
+or two. Each ``original`` in the history is reduced to its set of character
+5-grams (after the search tokenizer casefolds it and drops punctuation), and
+that set to a 128-value MinHash signature. The share of equal values between
+two signatures estimates the Jaccard similarity of the two sets.
+
+Signatures are split into 16 bands of 8 values, and each band is hashed into
+a bucket. Only entries that share a bucket with the query in at least one
+band are compared, so a lookup doesn't scan the whole history. With these
+settings a pair at 0.8 similarity shares a band about 94% of the time, and a
+pair at 0.5 about 6% of the time.
+
+The index follows ``UserHistory`` incrementally. It reads only entries newer
+than the last one it saw, and only the newest ``max_entries`` are kept.
+"""
+import itertools
+import threading
+import zlib
+from collections import deque
+
+from metrics import get_metrics
+from search_index import tokenize
+
+SHINGLE = 5
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Entries read from the history per page while catching up
+PAGE = 500
+# Texts hashed together; bounds the (shingles x NUM_PERM) scratch array
+HASH_BATCH = 64
+
+
+def shingles(text):
+    """Hashed character 5-grams of the casefolded words in ``text``"""
+    normalized = " ".join(tokenize(text))
+    if len(normalized) <= SHINGLE:
+        return {zlib.crc32(normalized.encode("utf-8"))}
+    return {zlib.crc32(normalized[i:i + SHINGLE].encode("utf-8"))
+            for i in range(len(normalized) - SHINGLE + 1)}
+
+
+def _checksum(text):
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class MinHashIndex:
+    """LSH buckets of MinHash signatures, each stored under a caller's key"""
+
+    def __init__(self, max_entries=20000, seed=1):
+        import numpy as np
+
+        self.max_entries = max_entries
+        rng = np.random.default_rng(seed)
+        # Multiply-add-shift hashes of the 32-bit shingles: ((a * x + b) mod 2**64) >> 32, a odd
+        self._a = rng.integers(0, 2**64, NUM_PERM, dtype=np.uint64, endpoint=False) | np.uint64(1)
+        self._b = rng.integers(0, 2**64, NUM_PERM, dtype=np.uint64, endpoint=False)
+        # One row per slot, reused round-robin once max_entries is reached
+        self._signatures = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self._slots = deque()
+        self._keys = {}
+        # slot -> insertion number, to prefer the newest of equally close entries
+        self._order = {}
+        self._added = 0
+        # band -> {bucket: slot, or a set of slots once the bucket is shared}
+        self._buckets = [{} for _ in range(BANDS)]
+
+    def __len__(self):
+        return len(self._slots)
+
+    def signatures(self, texts):
+        """MinHash signatures of ``texts``, one row each"""
+        import numpy as np
+
+        sets = [shingles(text) for text in texts]
+        lengths = [len(shingle_set) for shingle_set in sets]
+        values = np.fromiter(itertools.chain.from_iterable(sets), dtype=np.uint64, count=sum(lengths))
+        hashed = np.multiply.outer(values, self._a)
+        hashed += self._b
+        hashed >>= np.uint64(32)
+        # Every text has at least one shingle, so each segment is non-empty
+        starts = np.cumsum([0] + lengths[:-1])
+        return np.minimum.reduceat(hashed, starts, axis=0).astype(np.uint32)
+
+    @staticmethod
+    def _band_keys(signature):
+        return [hash(signature[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+    def add(self, key, text):
+        self.add_many([key], [text])
+
+    def add_many(self, keys, texts):
+        for start in range(0, len(texts), HASH_BATCH):
+            signatures = self.signatures(texts[start:start + HASH_BATCH])
+            for key, signature in zip(keys[start:start + HASH_BATCH], signatures):
+                self._add(key, signature)
+
+    def _add(self, key, signature):
+        import numpy as np
+
+        if len(self._slots) >= self.max_entries:
+            slot = self._evict()
+        else:
+            slot = len(self._slots)
+            if slot == len(self._signatures):
+                grown = np.empty((min(self.max_entries, max(64, slot * 2)), NUM_PERM), dtype=np.uint32)
+                grown[:slot] = self._signatures
+                self._signatures = grown
+        self._signatures[slot] = signature
+        self._slots.append(slot)
+        self._keys[slot] = key
+        self._order[slot] = self._added
+        self._added += 1
+        for buckets, bucket in zip(self._buckets, self._band_keys(signature)):
+            held = buckets.get(bucket)
+            if held is None:
+                buckets[bucket] = slot
+            elif isinstance(held, set):
+                held.add(slot)
+            else:
+                buckets[bucket] = {held, slot}
+
+    def _evict(self):
+        """Drop the oldest entry and return its slot for reuse"""
+        slot = self._slots.popleft()
+        for buckets, bucket in zip(self._buckets, self._band_keys(self._signatures[slot])):
+            held = buckets.get(bucket)
+            if isinstance(held, set):
+                held.discard(slot)
+                if len(held) == 1:
+                    buckets[bucket] = held.pop()
+            elif held == slot:
+                del buckets[bucket]
+        del self._keys[slot]
+        del self._order[slot]
+        return slot
+
+    def query(self, text, threshold):
+        """Return (key, estimated similarity) of the closest entry at or above ``threshold``
+
+        Ties go to the entry added last.
+        """
+        signature = self.signatures([text])[0]
+        candidates = set()
+        for buckets, bucket in zip(self._buckets, self._band_keys(signature)):
+            held = buckets.get(bucket)
+            if isinstance(held, set):
+                candidates |= held
+            elif held is not None:
+                candidates.add(held)
+        if not candidates:
+            return None
+        slots = list(candidates)
+        similarities = (self._signatures[slots] == signature).mean(axis=1)
+        best = max(range(len(slots)), key=lambda i: (similarities[i], self._order[slots[i]]))
+        if similarities[best] < threshold:
+            return None
+        return self._keys[slots[best]], float(similarities[best])
+
+
+class SimilarityCache:
+    """Serves the stored rewrite of a near-identical earlier input from ``UserHistory``"""
+
+    def __init__(self, user_history, threshold=0.9, max_entries=20000):
+        self.user_history = user_history
+        self.threshold = threshold
+        self.index = MinHashIndex(max_entries)
+        self._lock = threading.Lock()
+        self._generation = None
+        self._last_id = 0
+        self.lookups = 0
+        self.hits = 0
+
+    def _catch_up(self):
+        """Index entries added since the last lookup, newest ``max_entries`` at most"""
+        generation = self.user_history.generation
+        if generation == self._generation:
+            return
+        newest = self.user_history.get_page(1)
+        if (newest[0]['id'] if newest else 0) < self._last_id:
+            # History was cleared or replaced; start over
+            self._reset()
+        pending = []
+        before_id = None
+        while len(pending) < self.index.max_entries:
+            page = self.user_history.get_page(PAGE, before_id)
+            page = [entry for entry in page if entry['id'] > self._last_id]
+            pending += page
+            if len(page) < PAGE:
+                break
+            before_id = page[-1]['id']
+        entries = [entry for entry in reversed(pending[:self.index.max_entries])
+                   if entry.get('original') and entry.get('rewritten')]
+        self.index.add_many([(entry['id'], _checksum(entry['original'])) for entry in entries],
+                            [entry['original'] for entry in entries])
+        if pending:
+            self._last_id = pending[0]['id']
+        self._generation = generation
+
+    def _reset(self):
+        self.index = MinHashIndex(self.index.max_entries)
+        self._last_id = 0
+        self._generation = None
+
+    def _entry(self, key):
+        """Fetch an indexed entry, or None if its id now holds different text"""
+        entry_id, checksum = key
+        page = self.user_history.get_page(1, entry_id + 1)
+        if page and page[0]['id'] == entry_id and _checksum(page[0]['original']) == checksum:
+            return page[0]
+        # Cleared and refilled past the old ids since the last lookup
+        self._reset()
+        return None
+
+    def lookup(self, text):
+        """Return (earlier entry, similarity) for the closest match above the threshold, or None
+
+        Timed as the ``similar_lookup`` metrics stage.
+        """
+        with get_metrics().timer("similar_lookup"), self._lock:
+            self._catch_up()
+            match = self.index.query(text, self.threshold)
+            entry = self._entry(match[0]) if match else None
+            self.lookups += 1
+            if entry is not None:
+                self.hits += 1
+        return (entry, match[1]) if entry is not None else None
+
+    def stats(self):
+        """Entries indexed, lookups, hits and hit rate in this process"""
+        with self._lock:
+            return {
+                "entries": len(self.index),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else None,
+            }
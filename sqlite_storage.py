@@ -0,0 +1,401 @@
+"""SQLite storage backend for UserHistory.
+
+Run ``python sqlite_storage.py migrate`` once to copy an existing
+``data/user_history.json`` / ``usage_stats.json`` (plus any journal) into
+``data/user_history.db``, then start the app with ``HISTORY_STORAGE=sqlite``.
+"""
+import argparse
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from search_index import INDIC_MARKS, tokenize
+from storage import (JournalStore, _read_json, apply_record, assign_ids, entry_rollups, is_entry,
+                     new_stats)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    original TEXT NOT NULL,
+    rewritten TEXT NOT NULL,
+    char_count INTEGER NOT NULL,
+    ttft_ms REAL,
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp);
+CREATE TABLE IF NOT EXISTS stats (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+# External-content FTS5 index over history, kept in sync by triggers. unicode61
+# splits words at Indic vowel signs and viramas, so those marks are declared
+# as token characters to keep Hindi words whole.
+FTS_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    original, rewritten, content='history', content_rowid='id',
+    tokenize="unicode61 tokenchars '{INDIC_MARKS}'"
+);
+CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, original, rewritten) VALUES (new.id, new.original, new.rewritten);
+END;
+CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts (history_fts, rowid, original, rewritten)
+    VALUES ('delete', old.id, old.original, old.rewritten);
+END;
+"""
+
+# Kept as constants so sqlite3's statement cache reuses the prepared statements
+INSERT_ENTRY = ("INSERT INTO history (timestamp, original, rewritten, char_count, ttft_ms, latency_ms) "
+                "VALUES (?, ?, ?, ?, ?, ?)")
+INSERT_ENTRY_WITH_ID = ("INSERT OR IGNORE INTO history "
+                        "(id, timestamp, original, rewritten, char_count, ttft_ms, latency_ms) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)")
+INCREMENT_STAT = ("INSERT INTO stats (key, value) VALUES (?, ?) "
+                  "ON CONFLICT (key) DO UPDATE SET value = value + excluded.value")
+SET_STAT = ("INSERT INTO stats (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value")
+SELECT_STATS = "SELECT key, value FROM stats"
+INCREMENT_ROLLUP = ("INSERT INTO rollups (name, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name, key) DO UPDATE SET value = value + excluded.value")
+SELECT_ROLLUPS = "SELECT name, key, value FROM rollups"
+SELECT_ROLLUP_RANGE = "SELECT key, value FROM rollups WHERE name = ? AND key >= ? AND key <= ?"
+ENTRY_COLUMNS = "id, timestamp, original, rewritten, char_count, ttft_ms, latency_ms"
+SELECT_ALL = f"SELECT {ENTRY_COLUMNS} FROM history ORDER BY id"
+SELECT_NEWEST = f"SELECT {ENTRY_COLUMNS} FROM history ORDER BY id DESC LIMIT ?"
+SELECT_PAGE = f"SELECT {ENTRY_COLUMNS} FROM history WHERE id < ? ORDER BY id DESC LIMIT ?"
+SELECT_RANGE = f"SELECT {ENTRY_COLUMNS} FROM history WHERE id > ? AND id <= ? ORDER BY id LIMIT ?"
+SELECT_BEFORE = f"SELECT {ENTRY_COLUMNS} FROM history WHERE timestamp < ? ORDER BY id"
+DELETE_ARCHIVED = "DELETE FROM history WHERE timestamp < ? AND id <= ?"
+# FTS5 ranks and limits inside the index first, so only the top rows are joined
+SEARCH = (f"SELECT {', '.join('history.' + column for column in ENTRY_COLUMNS.split(', '))}, "
+          "matches.rank FROM (SELECT rowid, rank FROM history_fts "
+          "WHERE history_fts MATCH ? AND rowid BETWEEN ? AND ? ORDER BY rank, rowid DESC LIMIT ?) AS matches "
+          "JOIN history ON history.id = matches.rowid ORDER BY matches.rank, history.id DESC")
+SELECT_FIRST_ID = "SELECT id FROM history WHERE timestamp >= ? ORDER BY timestamp LIMIT 1"
+SELECT_LAST_ID = "SELECT id FROM history WHERE timestamp < ? ORDER BY timestamp DESC LIMIT 1"
+
+# Stats the migrator recomputes from the copied entries instead of copying
+DERIVED_STATS = {"total_rewrites", "total_characters", "avg_text_length", "last_id",
+                 "timed_rewrites", "total_latency_ms", "total_ttft_ms"}
+
+
+def _row_to_entry(row):
+    entry = {
+        'id': row[0],
+        'timestamp': row[1],
+        'original': row[2],
+        'rewritten': row[3],
+        'char_count': row[4]
+    }
+    if row[6] is not None:
+        entry['ttft_ms'] = row[5]
+        entry['latency_ms'] = row[6]
+    return entry
+
+
+def _entry_params(entry):
+    return (entry['timestamp'], entry['original'], entry['rewritten'],
+            entry.get('char_count', len(entry['original'])),
+            entry.get('ttft_ms'), entry.get('latency_ms'))
+
+
+class SqliteBackend:
+    """Stores history in SQLite (WAL mode) and answers queries with indexed SQL"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        # PRAGMA data_version is per connection, so one connection shared by every
+        # thread does the change checks; it never writes, so it sees every commit
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+        self._data_version = None
+        self.generation = 0
+        with self._connection() as conn:
+            has_rollups = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rollups'").fetchone()
+            conn.executescript(SCHEMA)
+            # Databases created before timings were recorded lack these columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(history)")}
+            for column in ("ttft_ms", "latency_ms"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE history ADD COLUMN {column} REAL")
+            has_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'history_fts'").fetchone()
+            conn.executescript(FTS_SCHEMA)
+            if not has_index:
+                # Index whatever an older database already holds
+                conn.execute("INSERT INTO history_fts (history_fts) VALUES ('rebuild')")
+            if not has_rollups:
+                self._backfill_rollups(conn)
+        # Baseline, so a commit before the first refresh() still counts as a change
+        self.refresh()
+
+    def _backfill_rollups(self, conn):
+        """Aggregate the rollups of a database created before they existed, once"""
+        conn.execute("BEGIN IMMEDIATE")
+        for row in conn.execute(SELECT_ALL).fetchall():
+            entry = _row_to_entry(row)
+            conn.execute(INCREMENT_ROLLUP, ("daily_usage", entry['timestamp'][:10], 1))
+            for rollup in entry_rollups(entry):
+                conn.execute(INCREMENT_ROLLUP, rollup)
+
+    def _connection(self):
+        """Return this thread's connection; SQLite connections can't be shared across threads"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                   cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    def refresh(self):
+        """Report whether anything was committed since the last call, from any thread or process"""
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                                     check_same_thread=False)
+            data_version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+            changed = self._data_version is not None and data_version != self._data_version
+            self._data_version = data_version
+        if changed:
+            self.generation += 1
+        return changed
+
+    def add_entry(self, entry):
+        return self.add_entries([entry])[0]
+
+    def add_entries(self, entries):
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for entry in entries:
+                cursor = conn.execute(INSERT_ENTRY, _entry_params(entry))
+                entry['id'] = cursor.lastrowid
+                self._record_stats(conn, entry)
+        self.generation += 1
+        return entries
+
+    def _record_stats(self, conn, entry):
+        conn.execute(INCREMENT_STAT, ("total_rewrites", 1))
+        conn.execute(INCREMENT_STAT, ("total_characters", entry['char_count']))
+        conn.execute(SET_STAT, ("last_updated", entry['timestamp']))
+        conn.execute(INCREMENT_ROLLUP, ("daily_usage", entry['timestamp'][:10], 1))
+        for rollup in entry_rollups(entry):
+            conn.execute(INCREMENT_ROLLUP, rollup)
+        if entry.get('latency_ms') is not None:
+            conn.execute(INCREMENT_STAT, ("timed_rewrites", 1))
+            conn.execute(INCREMENT_STAT, ("total_latency_ms", entry['latency_ms']))
+            conn.execute(INCREMENT_STAT, ("total_ttft_ms", entry['ttft_ms']))
+
+    def increment(self, name, n=1):
+        with self._connection() as conn:
+            conn.execute(INCREMENT_STAT, (name, n))
+        self.generation += 1
+
+    def get_history(self, limit=None):
+        with self._connection() as conn:
+            if limit is None:
+                rows = conn.execute(SELECT_ALL).fetchall()
+            else:
+                rows = conn.execute(SELECT_NEWEST, (limit,)).fetchall()[::-1]
+        return [_row_to_entry(row) for row in rows]
+
+    def get_page(self, limit, before_id=None):
+        # Walks the primary key backwards, so a page costs the same at any depth
+        with self._connection() as conn:
+            if before_id is None:
+                rows = conn.execute(SELECT_NEWEST, (limit,)).fetchall()
+            else:
+                rows = conn.execute(SELECT_PAGE, (before_id, limit)).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+    def iter_entries(self, start_date=None, end_date=None, after_id=0, chunk_size=1000):
+        """Yield entries oldest first with ids above ``after_id``, from ``start_date`` through ``end_date``"""
+        last_id = 2 ** 63 - 1
+        with self._connection() as conn:
+            if start_date or end_date:
+                # Ids grow with timestamps, so a date range is an id range the index can use
+                first = conn.execute(SELECT_FIRST_ID, (start_date or "",)).fetchone()
+                last = conn.execute(SELECT_LAST_ID, (end_date + "~" if end_date else "~",)).fetchone()
+                if first is None or last is None:
+                    return
+                after_id, last_id = max(after_id, first[0] - 1), last[0]
+        while True:
+            # One short read per chunk, so no transaction stays open while the caller consumes it
+            with self._connection() as conn:
+                rows = conn.execute(SELECT_RANGE, (after_id, last_id, chunk_size)).fetchall()
+            for row in rows:
+                yield _row_to_entry(row)
+            if len(rows) < chunk_size:
+                return
+            after_id = rows[-1][0]
+
+    def search(self, query, limit=20, start_date=None, end_date=None):
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        # Quote each term so user input can't be read as FTS5 query syntax
+        match = " OR ".join(f'"{term}"' for term in terms)
+        first_id, last_id = 0, 2 ** 63 - 1
+        with self._connection() as conn:
+            if start_date or end_date:
+                # Ids grow with timestamps, so a date range is an id range the index can use
+                first = conn.execute(SELECT_FIRST_ID, (start_date or "",)).fetchone()
+                last = conn.execute(SELECT_LAST_ID, (end_date + "~" if end_date else "~",)).fetchone()
+                if first is None or last is None:
+                    return []
+                first_id, last_id = first[0], last[0]
+            rows = conn.execute(SEARCH, (match, first_id, last_id, limit)).fetchall()
+        # bm25() is lower-is-better; flip it so scores read like the in-memory index
+        return [{**_row_to_entry(row), 'score': -row[-1]} for row in rows]
+
+    def archive_before(self, cutoff_date, archive):
+        """Move entries from before ``cutoff_date`` into ``archive``; stats and rollups are kept"""
+        last_id = 0
+
+        def rows(cursor):
+            nonlocal last_id
+            while True:
+                batch = cursor.fetchmany(1000)
+                if not batch:
+                    return
+                for row in batch:
+                    last_id = row[0]
+                    yield _row_to_entry(row)
+
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            archived = archive.append(rows(conn.execute(SELECT_BEFORE, (cutoff_date,))))
+            if last_id:
+                conn.execute(DELETE_ARCHIVED, (cutoff_date, last_id))
+        if last_id:
+            self.generation += 1
+        return archived
+
+    def get_stats(self):
+        with self._connection() as conn:
+            values = dict(conn.execute(SELECT_STATS).fetchall())
+            rollups = conn.execute(SELECT_ROLLUPS).fetchall()
+        stats = new_stats()
+        stats.pop("last_id")
+        stats.update(values)
+        for name, key, value in rollups:
+            stats[name][key] = value
+        if stats["total_rewrites"]:
+            stats["avg_text_length"] = stats["total_characters"] / stats["total_rewrites"]
+        return stats
+
+    def get_daily_usage(self, start_date, end_date):
+        with self._connection() as conn:
+            rows = conn.execute(SELECT_ROLLUP_RANGE, ("daily_usage", start_date, end_date)).fetchall()
+        return dict(rows)
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM history")
+            conn.execute("DELETE FROM stats")
+            conn.execute("DELETE FROM rollups")
+        self.generation += 1
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+
+
+class _Transaction:
+    """Commit on success and roll back on error, leaving the connection open"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.conn.in_transaction:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def load_json_history(data_dir):
+    """Read the json/journal files the same way the journal store replays them"""
+    history_file = os.path.join(data_dir, "user_history.json")
+    stats_file = os.path.join(data_dir, "usage_stats.json")
+    journal_file = history_file + "l"
+
+    history = assign_ids(_read_json(history_file, []))
+    stats = _read_json(stats_file, None) or new_stats()
+    stats.setdefault("last_id", 0)
+    last_id = history[-1]['id'] if history else 0
+    for path in (journal_file + ".compacting", journal_file):
+        for record in JournalStore._read_journal(path):
+            if is_entry(record) and record['id'] > last_id:
+                history.append(record)
+                last_id = record['id']
+            if record['id'] > stats["last_id"]:
+                apply_record(stats, record)
+    return history, stats
+
+
+def migrate_json_to_sqlite(data_dir="data", db_path=None, force=False):
+    """Copy json/journal history into SQLite once; returns the number of entries copied"""
+    db_path = db_path or os.path.join(data_dir, "user_history.db")
+    backend = SqliteBackend(db_path)
+    try:
+        with backend._connection() as conn:
+            existing = conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+        if existing and not force:
+            raise RuntimeError(f"{db_path} already has {existing} entries; pass force=True to merge")
+
+        history, stats = load_json_history(data_dir)
+        with backend._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            copied = 0
+            for entry in history:
+                cursor = conn.execute(INSERT_ENTRY_WITH_ID, (entry['id'],) + _entry_params(entry))
+                if cursor.rowcount:
+                    backend._record_stats(conn, entry)
+                    copied += 1
+            # Counters that aren't derived from entries, e.g. cache_hits
+            for name, value in stats.items():
+                if name not in DERIVED_STATS and isinstance(value, int):
+                    conn.execute(INCREMENT_STAT, (name, value))
+            conn.execute(SET_STAT, ("last_updated", stats.get(
+                "last_updated", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))))
+        return copied
+    finally:
+        backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UserHistory SQLite tools")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--db", default=None, help="defaults to <data-dir>/user_history.db")
+    parser.add_argument("--force", action="store_true",
+                        help="merge into a database that already has entries")
+    args = parser.parse_args()
+
+    copied = migrate_json_to_sqlite(args.data_dir, args.db, args.force)
+    print(f"Migrated {copied} entries into {args.db or os.path.join(args.data_dir, 'user_history.db')}")
+
+
+if __name__ == "__main__":
+    main()
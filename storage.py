@@ -0,0 +1,866 @@
+import json
+import os
+import threading
+import time
+import atexit
+import bisect
+import functools
+import shutil
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only coordinate threads within this process
+    fcntl = None
+
+from compact_history import CompactHistory
+from search_index import SearchIndex
+
+# Pre-aggregated counters kept alongside daily_usage so the dashboard never scans history
+ROLLUPS = ("hourly_usage", "weekly_usage", "monthly_usage", "daily_characters", "latency_histogram")
+# Upper bounds (ms) of the latency histogram buckets; anything slower counts as "inf"
+LATENCY_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def new_stats():
+    """Return an empty stats dict"""
+    return {
+        "total_rewrites": 0,
+        "daily_usage": {},
+        **{name: {} for name in ROLLUPS},
+        "avg_text_length": 0,
+        "total_characters": 0,
+        "last_id": 0,
+        "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+@functools.lru_cache(maxsize=1024)
+def _iso_week(date):
+    year, week, _ = datetime.strptime(date, "%Y-%m-%d").isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def latency_bucket(latency_ms):
+    """Return the histogram bucket label for a latency"""
+    index = bisect.bisect_left(LATENCY_BUCKETS, latency_ms)
+    return str(LATENCY_BUCKETS[index]) if index < len(LATENCY_BUCKETS) else "inf"
+
+
+def entry_rollups(entry):
+    """Return the (rollup, key, amount) increments one entry contributes"""
+    timestamp = entry['timestamp']
+    date = timestamp[:10]
+    rollups = [
+        ("hourly_usage", timestamp[11:13], 1),
+        ("weekly_usage", _iso_week(date), 1),
+        ("monthly_usage", date[:7], 1),
+        ("daily_characters", date, entry['char_count']),
+    ]
+    if entry.get('latency_ms') is not None:
+        rollups.append(("latency_histogram", latency_bucket(entry['latency_ms']), 1))
+    return rollups
+
+
+def backfill_rollups(stats, history):
+    """Rebuild the rollups of stats saved before they existed from the full history"""
+    for name in ROLLUPS:
+        stats[name] = {}
+    for entry in history:
+        for name, key, amount in entry_rollups(entry):
+            stats[name][key] = stats[name].get(key, 0) + amount
+
+
+def apply_entry(stats, entry):
+    """Fold a single history entry into the stats dict"""
+    date = entry['timestamp'].split()[0]
+    stats["total_rewrites"] += 1
+    stats["daily_usage"][date] = stats["daily_usage"].get(date, 0) + 1
+    # Stats from before rollups existed get them from backfill_rollups instead
+    if "hourly_usage" in stats:
+        for name, key, amount in entry_rollups(entry):
+            stats[name][key] = stats[name].get(key, 0) + amount
+    stats["total_characters"] += entry['char_count']
+    stats["avg_text_length"] = stats["total_characters"] / stats["total_rewrites"]
+    if entry.get('latency_ms') is not None:
+        stats["timed_rewrites"] = stats.get("timed_rewrites", 0) + 1
+        stats["total_latency_ms"] = stats.get("total_latency_ms", 0) + entry['latency_ms']
+        stats["total_ttft_ms"] = stats.get("total_ttft_ms", 0) + entry['ttft_ms']
+    stats["last_id"] = max(stats.get("last_id", 0), entry.get('id', 0))
+
+
+def apply_record(stats, record):
+    """Fold a journal record (an entry or a counter increment) into the stats dict"""
+    if record.get('op') == "incr":
+        stats[record['name']] = stats.get(record['name'], 0) + record['n']
+        stats["last_id"] = max(stats.get("last_id", 0), record['id'])
+    else:
+        apply_entry(stats, record)
+
+
+def merge_stats(all_stats):
+    """Add several histories' stats together, e.g. every user's shard into one rollup"""
+    merged = new_stats()
+    merged.pop("last_id")
+    merged["last_updated"] = ""
+    for stats in all_stats:
+        for key, value in stats.items():
+            if key in ("last_id", "avg_text_length"):
+                continue
+            if key == "last_updated":
+                # An empty history's stats are stamped with when they were created
+                if stats.get("total_rewrites"):
+                    merged[key] = max(merged[key], value)
+            elif isinstance(value, dict):
+                totals = merged.setdefault(key, {})
+                for name, amount in value.items():
+                    totals[name] = totals.get(name, 0) + amount
+            else:
+                merged[key] = merged.get(key, 0) + value
+    if merged["total_rewrites"]:
+        merged["avg_text_length"] = merged["total_characters"] / merged["total_rewrites"]
+    merged["last_updated"] = merged["last_updated"] or "Never"
+    return merged
+
+
+def is_entry(record):
+    """Journal records without an ``op`` are history entries"""
+    return 'op' not in record
+
+
+def assign_ids(history):
+    """Give entries written before ids existed a stable positional id"""
+    for i, entry in enumerate(history):
+        if 'id' not in entry:
+            entry['id'] = i + 1
+    return history
+
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            # Keep the damaged file for recovery rather than quietly starting from scratch
+            backup = f"{path}.corrupt-{int(time.time())}"
+            shutil.copyfile(path, backup)
+            print(f"Error reading {path}; kept a copy at {backup}")
+            raise
+
+
+def _file_signature(path):
+    """Identify a file version by inode, mtime and size"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _write_json(path, data, indent=None):
+    """Write data to a temp file and atomically move it into place"""
+    # Unique per writer so concurrent writers never share a temp file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        if isinstance(data, (dict, list)):
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        else:
+            _dump_json_array(data, f, indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _dump_json_array(items, f, indent=None):
+    """Write an iterable as a JSON array one item at a time, laid out like json.dump"""
+    pad = " " * indent if indent else ""
+    f.write("[")
+    separator = "\n" + pad if indent else ""
+    for item in items:
+        f.write(separator + json.dumps(item, ensure_ascii=False, indent=indent).replace("\n", "\n" + pad))
+        separator = ",\n" + pad if indent else ", "
+    if indent and separator.startswith(","):
+        f.write("\n")
+    f.write("]")
+
+
+class FileLock:
+    """Advisory exclusive lock shared by threads and processes.
+
+    Re-entrant within a process, so a locked section can call code that locks
+    again. Use ``FileLock.open`` to get the one lock object per path; flock
+    locks taken through two descriptors would block each other.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    @classmethod
+    def open(cls, path):
+        key = os.path.realpath(path)
+        with cls._instances_lock:
+            lock = cls._instances.get(key)
+            if lock is None:
+                lock = cls._instances[key] = cls(path)
+            return lock
+
+    def acquire(self, blocking=True):
+        if not self._lock.acquire(blocking):
+            return False
+        if self._depth == 0 and fcntl is not None:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock.release()
+                return False
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class JsonStore:
+    """Rewrites the full history and stats files on every change"""
+
+    journaled = False
+
+    def __init__(self, history_file, stats_file):
+        self.history_file = history_file
+        self.stats_file = stats_file
+        # Held by MemoryBackend around catch-up, id assignment and the rewrite
+        self.lock = FileLock.open(history_file + ".lock")
+        # Taken before ``lock`` by anything that rewrites the whole history
+        self.maintenance_lock = self.lock
+        self._next_id = 1
+
+    def load_history(self):
+        history = assign_ids(_read_json(self.history_file, []))
+        self._next_id = history[-1]['id'] + 1 if history else 1
+        return history
+
+    def load_stats(self):
+        return _read_json(self.stats_file, None)
+
+    def save_history(self, history):
+        _write_json(self.history_file, history, indent=2)
+
+    def save_stats(self, stats):
+        _write_json(self.stats_file, stats, indent=2)
+
+    def next_id(self):
+        entry_id = self._next_id
+        self._next_id += 1
+        return entry_id
+
+    def signature(self):
+        return (_file_signature(self.history_file), _file_signature(self.stats_file))
+
+    def journal_offset(self):
+        return 0
+
+    def read_journal(self, offset):
+        return [], offset
+
+    def append(self, record, history, stats):
+        self.append_many([record], history, stats)
+
+    def append_many(self, records, history, stats):
+        with self.lock:
+            if any(is_entry(record) for record in records):
+                self.save_history(history)
+            self.save_stats(stats)
+
+    def replace_history(self, history, stats):
+        with self.lock:
+            self.save_history(history)
+            self.save_stats(stats)
+
+    def clear(self, stats):
+        self.replace_history([], stats)
+
+    def close(self):
+        pass
+
+
+class JournalStore:
+    """Append-only JSON Lines journal on top of periodically compacted snapshots.
+
+    New entries are appended to ``<history_file>l`` and fsynced in batches.
+    A background thread folds the journal into the JSON snapshots once it
+    grows past ``compact_threshold`` entries. Every entry carries an
+    increasing ``id`` so replaying a journal that was already partly
+    compacted (e.g. after a crash) never duplicates entries or stats.
+
+    Several processes can share the files: appends happen under an advisory
+    file lock after catching up on the other processes' records, so ids stay
+    unique and increasing, and only one process compacts at a time.
+    """
+
+    journaled = True
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, history_file, stats_file, fsync_every=32,
+                 fsync_interval=1.0, compact_threshold=10000):
+        self.history_file = history_file
+        self.stats_file = stats_file
+        self.journal_file = history_file + "l"
+        self.compacting_file = self.journal_file + ".compacting"
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        # Cross-process locks: one around appends, one so a single process compacts
+        self.lock = FileLock.open(self.journal_file + ".lock")
+        self.maintenance_lock = FileLock.open(self.journal_file + ".compact.lock")
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._journal_entries = self._count_lines(self.journal_file)
+        self._pending_sync = 0
+        self._last_sync = time.monotonic()
+        self._next_id = None
+        # Signature before each of this process's compaction steps -> (signature
+        # after, size of the journal rotated out or None); see follow_compaction
+        self._compactions = {}
+
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._worker = threading.Thread(target=self._maintenance_loop,
+                                        name="journal-maintenance", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def open(cls, history_file, stats_file, **kwargs):
+        """Return the process-wide store for these files, creating it once"""
+        key = os.path.realpath(history_file)
+        with cls._instances_lock:
+            store = cls._instances.get(key)
+            if store is None or store._closed:
+                store = cls(history_file, stats_file, **kwargs)
+                cls._instances[key] = store
+            return store
+
+    @staticmethod
+    def _count_lines(path):
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            return sum(1 for _ in f)
+
+    @staticmethod
+    def _read_journal(path):
+        """Yield journal records, skipping a torn final line"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipping corrupt journal line in {path}")
+
+    def _journal_records(self):
+        yield from self._read_journal(self.compacting_file)
+        yield from self._read_journal(self.journal_file)
+
+    def load_history(self):
+        history = assign_ids(_read_json(self.history_file, []))
+        last_id = history[-1]['id'] if history else 0
+        for record in self._journal_records():
+            if is_entry(record) and record['id'] > last_id:
+                history.append(record)
+                last_id = record['id']
+        self._seed_next_id(last_id)
+        return history
+
+    def load_stats(self):
+        stats = _read_json(self.stats_file, None)
+        if stats is None:
+            stats = new_stats()
+        stats.setdefault("last_id", 0)
+        for record in self._journal_records():
+            if record['id'] > stats["last_id"]:
+                apply_record(stats, record)
+        self._seed_next_id(stats["last_id"])
+        return stats
+
+    def _seed_next_id(self, last_id):
+        with self._lock:
+            if self._next_id is None or self._next_id <= last_id:
+                self._next_id = last_id + 1
+
+    def next_id(self):
+        with self._lock:
+            if self._next_id is None:
+                self._next_id = 1
+            entry_id = self._next_id
+            self._next_id += 1
+            return entry_id
+
+    def signature(self):
+        """Change marker for everything except appends to the live journal"""
+        journal = _file_signature(self.journal_file)
+        return (_file_signature(self.history_file), _file_signature(self.stats_file),
+                _file_signature(self.compacting_file), journal and journal[0])
+
+    def journal_offset(self):
+        journal = _file_signature(self.journal_file)
+        return journal[2] if journal else 0
+
+    def read_journal(self, offset):
+        """Return complete records appended to the live journal after ``offset``"""
+        return self._read_from(self.journal_file, offset)
+
+    def _read_from(self, path, offset, seed=True):
+        # seed=False for callers already holding self._lock, which _seed_next_id takes
+        if not os.path.exists(path):
+            return [], 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].splitlines():
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"Skipping corrupt journal line in {path}")
+        if records and seed:
+            # Ids other processes used are taken
+            self._seed_next_id(max(record['id'] for record in records))
+        return records, offset + end
+
+    def follow_compaction(self, signature, offset):
+        """Carry a reader at ``signature`` and journal ``offset`` across our own compactions
+
+        Returns ``(records, signature, offset)``: the records the reader had
+        not seen yet from the journal that was rotated out, and where it now
+        stands. Returns None if the files changed in some other way (another
+        process compacted, archived or cleared), and the reader must reload.
+        """
+        with self._lock:
+            current = self.signature()
+            records = []
+            while signature != current:
+                step = self._compactions.get(signature)
+                if step is None:
+                    return None
+                signature, rotated_size = step
+                if rotated_size is None:
+                    continue
+                if offset < rotated_size:
+                    # The unread tail is only still readable mid-compaction
+                    if signature != current:
+                        return None
+                    more, _ = self._read_from(self.compacting_file, offset, seed=False)
+                    records.extend(more)
+                offset = 0
+        if records:
+            self._seed_next_id(max(record['id'] for record in records))
+        return records, signature, offset
+
+    def _record_compaction_locked(self, before, rotated_size=None):
+        self._compactions[before] = (self.signature(), rotated_size)
+        while len(self._compactions) > 8:
+            del self._compactions[next(iter(self._compactions))]
+
+    def save_history(self, history):
+        _write_json(self.history_file, history)
+
+    def save_stats(self, stats):
+        _write_json(self.stats_file, stats)
+
+    def append(self, record, history, stats):
+        self.append_many([record], history, stats)
+
+    def append_many(self, records, history, stats):
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self.lock, self._lock:
+            self._reopen_if_rotated_locked()
+            self._journal.write(data)
+            self._journal.flush()
+            self._journal_entries += len(records)
+            self._pending_sync += len(records)
+            if (self._pending_sync >= self.fsync_every or
+                    time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync_locked()
+            needs_compaction = self._journal_entries >= self.compact_threshold
+        if needs_compaction:
+            self._wakeup.set()
+
+    def _reopen_if_rotated_locked(self):
+        """Follow the journal if another process rotated it out from under our handle"""
+        try:
+            current = os.stat(self.journal_file).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self._journal.fileno()).st_ino:
+            self._journal.close()
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            self._journal_entries = 0
+            self._pending_sync = 0
+
+    def _sync_locked(self):
+        os.fsync(self._journal.fileno())
+        self._pending_sync = 0
+        self._last_sync = time.monotonic()
+
+    def replace_history(self, history, stats):
+        """Write a snapshot of the full (caught-up) history and stats and empty the journal"""
+        with self.maintenance_lock, self._compact_lock, self.lock, self._lock:
+            self.save_history(history)
+            self.save_stats(stats)
+            self._journal.close()
+            if os.path.exists(self.compacting_file):
+                os.remove(self.compacting_file)
+            self._journal = open(self.journal_file, 'w', encoding='utf-8')
+            self._journal_entries = 0
+            self._pending_sync = 0
+
+    def clear(self, stats):
+        self.replace_history([], stats)
+
+    def compact(self):
+        """Fold the journal into the JSON snapshots, unless another process already is"""
+        if not self.maintenance_lock.acquire(blocking=False):
+            return False
+        try:
+            with self._compact_lock:
+                self._compact_locked()
+            return True
+        finally:
+            self.maintenance_lock.release()
+
+    def _compact_locked(self):
+        with self.lock, self._lock:
+            # Rotate the live journal so appends continue while we compact
+            if not os.path.exists(self.compacting_file):
+                self._reopen_if_rotated_locked()
+                self._sync_locked()
+                before = self.signature()
+                rotated_size = os.fstat(self._journal.fileno()).st_size
+                self._journal.close()
+                os.replace(self.journal_file, self.compacting_file)
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+                self._journal_entries = 0
+                self._record_compaction_locked(before, rotated_size)
+
+        history = assign_ids(_read_json(self.history_file, []))
+        stats = _read_json(self.stats_file, None) or new_stats()
+        stats.setdefault("last_id", 0)
+        last_id = history[-1]['id'] if history else 0
+        for record in self._read_journal(self.compacting_file):
+            if is_entry(record) and record['id'] > last_id:
+                history.append(record)
+                last_id = record['id']
+            if record['id'] > stats["last_id"]:
+                apply_record(stats, record)
+        if "hourly_usage" not in stats:
+            backfill_rollups(stats, history)
+
+        stats["last_updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock, self._lock:
+            before = self.signature()
+            _write_json(self.history_file, history)
+            _write_json(self.stats_file, stats)
+            os.remove(self.compacting_file)
+            # Same entries and stats as before, only laid out differently on disk
+            self._record_compaction_locked(before)
+
+    def _maintenance_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.fsync_interval)
+            self._wakeup.clear()
+            if self._closed:
+                break
+            try:
+                with self._lock:
+                    if self._pending_sync:
+                        self._sync_locked()
+                    needs_compaction = self._journal_entries >= self.compact_threshold
+                if needs_compaction:
+                    self.compact()
+            except Exception as e:
+                print(f"Error maintaining journal: {e}")
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        with self._lock:
+            if not self._journal.closed:
+                self._sync_locked()
+                self._journal.close()
+
+
+class MemoryBackend:
+    """Keeps history and stats in memory on top of a json or journal file store"""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.RLock()
+        # Bumped whenever the in-memory history or stats change
+        self.generation = 0
+        # Full-text index, built on the first search and kept up to date after that
+        self._index = None
+        self._reload()
+
+    def _reload(self):
+        with self._lock:
+            # Remember the journal position first; lines read twice are skipped by id
+            self._signature = self.store.signature()
+            self._journal_offset = self.store.journal_offset()
+            # Set when a file can't be read; writes are refused until it is repaired,
+            # so the damaged file is never overwritten with an empty history
+            self._load_error = None
+            try:
+                self.history = CompactHistory(self.store.load_history())
+            except Exception as e:
+                print(f"Error loading history: {e}")
+                self.history = CompactHistory()
+                self._load_error = e
+            try:
+                self.stats = self.store.load_stats() or new_stats()
+            except Exception as e:
+                print(f"Error loading stats: {e}")
+                self.stats = new_stats()
+                self._load_error = self._load_error or e
+            if "hourly_usage" not in self.stats:
+                backfill_rollups(self.stats, self.history)
+            self._index = None
+            self.generation += 1
+
+    def refresh(self):
+        """Pick up changes made by other processes without re-parsing unchanged files"""
+        with self._lock:
+            carried = []
+            if self.store.signature() != self._signature:
+                # Our own compactions leave the content alone; only follow the files
+                followed = (self.store.follow_compaction(self._signature, self._journal_offset)
+                            if self.store.journaled else None)
+                if followed is None:
+                    self._reload()
+                    return True
+                carried, self._signature, self._journal_offset = followed
+            records, self._journal_offset = self.store.read_journal(self._journal_offset)
+            last_id = self.history.last_id
+            changed = False
+            for record in carried + records:
+                if is_entry(record) and record['id'] > last_id:
+                    self.history.append(record)
+                    if self._index is not None:
+                        self._index.add(record)
+                    last_id = record['id']
+                    changed = True
+                if record['id'] > self.stats.get("last_id", 0):
+                    apply_record(self.stats, record)
+                    changed = True
+            if changed:
+                self.generation += 1
+            return changed
+
+    def _check_writable(self):
+        if self._load_error is not None:
+            raise RuntimeError(f"Not saved: the stored history could not be read ({self._load_error}); "
+                               "repair or restore the file first")
+
+    def _skip_own_write(self):
+        # We caught up under the file lock, so everything on disk is already in memory
+        if self.store.journaled:
+            self._journal_offset = self.store.journal_offset()
+        else:
+            self._signature = self.store.signature()
+
+    def add_entry(self, entry):
+        return self.add_entries([entry])[0]
+
+    def add_entries(self, entries):
+        with self._lock, self.store.lock:
+            # Under the file lock nobody else can write; pick up what they wrote
+            # first so ids stay unique and the json store doesn't drop their entries
+            self.refresh()
+            self._check_writable()
+            for entry in entries:
+                entry['id'] = self.store.next_id()
+                self.history.append(entry)
+                apply_entry(self.stats, entry)
+                if self._index is not None:
+                    self._index.add(entry)
+                self.stats["last_updated"] = entry['timestamp']
+            # One journal write, or one full rewrite for the json store
+            self.store.append_many(entries, self.history, self.stats)
+            self._skip_own_write()
+            self.generation += 1
+            return entries
+
+    def increment(self, name, n=1):
+        with self._lock, self.store.lock:
+            self.refresh()
+            self._check_writable()
+            record = {'id': self.store.next_id(), 'op': "incr", 'name': name, 'n': n}
+            apply_record(self.stats, record)
+            self.store.append(record, self.history, self.stats)
+            self._skip_own_write()
+            self.generation += 1
+
+    def archive_before(self, cutoff_date, archive):
+        """Move entries from before ``cutoff_date`` into ``archive``; stats are kept"""
+        with self.store.maintenance_lock, self._lock, self.store.lock:
+            self.refresh()
+            self._check_writable()
+            split = self.history.position_of_date(cutoff_date)
+            if not split:
+                return 0
+            # Archive first: if we crash before the snapshot is replaced, the next
+            # run finds the same entries again and the archive skips their ids
+            archived = archive.append(self.history.iter_range(0, split))
+            self.history.drop_before(split)
+            self.store.replace_history(self.history, self.stats)
+            self._signature = self.store.signature()
+            self._journal_offset = self.store.journal_offset()
+            self._index = None
+            self.generation += 1
+            return archived
+
+    def get_history(self, limit=None):
+        """Return the full history (a ``CompactHistory``), or a list of the newest ``limit``"""
+        if limit is None:
+            return self.history
+        return self.history[-limit:] if limit else []
+
+    def get_page(self, limit, before_id=None):
+        """Return up to ``limit`` entries newest first, all with ids below ``before_id``"""
+        history = self.history
+        # History is kept in id order, so the cursor is a binary search away
+        end = len(history) if before_id is None else history.position_of_id(before_id)
+        return history[max(0, end - limit):end][::-1]
+
+    def iter_entries(self, start_date=None, end_date=None, after_id=0):
+        """Yield entries oldest first with ids above ``after_id``, from ``start_date`` through ``end_date``"""
+        history = self.history
+        start = history.position_of_id(after_id + 1)
+        if start_date:
+            start = max(start, history.position_of_date(start_date))
+        for entry in history.iter_range(start, len(history)):
+            if end_date and entry['timestamp'][:10] > end_date:
+                return
+            yield entry
+
+    def search(self, query, limit=20, start_date=None, end_date=None):
+        """Return the best matching entries for ``query``, each with a ``score``"""
+        with self._lock:
+            if self._index is None:
+                self._index = SearchIndex()
+                for entry in self.history:
+                    self._index.add(entry)
+            matches = self._index.search(query, limit, start_date, end_date)
+            results = []
+            for entry_id, score in matches:
+                position = self.history.position_of_id(entry_id)
+                results.append({**self.history[position], 'score': score})
+            return results
+
+    def get_stats(self):
+        return self.stats
+
+    def get_daily_usage(self, start_date, end_date):
+        return {date: count for date, count in self.stats["daily_usage"].items()
+                if start_date <= date <= end_date}
+
+    def clear(self):
+        with self.store.maintenance_lock, self._lock:
+            self.refresh()
+            self._check_writable()
+            self.history = CompactHistory()
+            self.stats = new_stats()
+            self._index = None
+            self.store.clear(self.stats)
+            self._signature = self.store.signature()
+            self._journal_offset = self.store.journal_offset()
+            self.generation += 1
+
+    def close(self):
+        self.store.close()
+
+
+def open_backend(kind, data_dir):
+    """Return the storage backend named by ``kind`` for ``data_dir``"""
+    history_file = os.path.join(data_dir, "user_history.json")
+    stats_file = os.path.join(data_dir, "usage_stats.json")
+    if kind == "json":
+        return MemoryBackend(JsonStore(history_file, stats_file))
+    if kind == "journal":
+        return MemoryBackend(JournalStore.open(history_file, stats_file))
+    if kind == "sqlite":
+        from sqlite_storage import SqliteBackend
+        return SqliteBackend(os.path.join(data_dir, "user_history.db"))
+    if kind == "mapped":
+        from mapped_storage import MappedBackend
+        return MappedBackend(data_dir)
+    raise ValueError(f"Unknown history storage: {kind}")
+
+
+def stats_files(kind, data_dir):
+    """Files whose changes can change the stats of the ``kind`` history in ``data_dir``"""
+    if kind in ("json", "journal"):
+        journal_file = os.path.join(data_dir, "user_history.jsonl")
+        return [os.path.join(data_dir, "usage_stats.json"), journal_file, journal_file + ".compacting"]
+    if kind == "sqlite":
+        db_path = os.path.join(data_dir, "user_history.db")
+        return [db_path, db_path + "-wal"]
+    if kind == "mapped":
+        return [os.path.join(data_dir, "user_history.stats.json")]
+    raise ValueError(f"Unknown history storage: {kind}")
+
+
+def read_stats(kind, data_dir):
+    """Read the stats of the ``kind`` history in ``data_dir`` without loading its entries"""
+    if kind == "sqlite":
+        from sqlite_storage import SqliteBackend
+        if not os.path.exists(stats_files(kind, data_dir)[0]):
+            return new_stats()
+        backend = SqliteBackend(os.path.join(data_dir, "user_history.db"))
+        try:
+            return backend.get_stats()
+        finally:
+            backend.close()
+    stats_file = stats_files(kind, data_dir)[0]
+    stats = _read_json(stats_file, None) or new_stats()
+    if kind in ("json", "journal"):
+        # Records not yet folded into the snapshot, as JournalStore.load_stats replays them
+        stats.setdefault("last_id", 0)
+        journal_file = os.path.join(data_dir, "user_history.jsonl")
+        for path in (journal_file + ".compacting", journal_file):
+            for record in JournalStore._read_journal(path):
+                if record['id'] > stats["last_id"]:
+                    apply_record(stats, record)
+    return stats
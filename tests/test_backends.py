@@ -0,0 +1,149 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import ROOT
+from export import iter_export
+from user_data import UserHistory
+
+STORAGES = ("json", "journal", "sqlite", "mapped")
+
+WRITER = """
+import sys
+from user_data import UserHistory
+
+data_dir, storage, count = sys.argv[1], sys.argv[2], int(sys.argv[3])
+user_history = UserHistory(data_dir, storage=storage)
+for n in range(count):
+    assert user_history.add_entry(f"{storage} writer text {n}", "rewritten")
+user_history.close()
+"""
+
+
+def seed(user_history, count=60):
+    """``count`` entries a day apart from 2024-01-01; every third mentions apples"""
+    start = datetime(2024, 1, 1, 9, 30)
+    entries = []
+    for n in range(count):
+        text = f"note {n} about apples" if n % 3 == 0 else f"note {n} about pears"
+        entries.append({'timestamp': (start + timedelta(days=n)).strftime("%Y-%m-%d %H:%M:%S"),
+                        'original': text, 'rewritten': text.title(), 'char_count': len(text)})
+    user_history.backend.add_entries(entries)
+
+
+@pytest.fixture(params=STORAGES)
+def user_history(request, tmp_path):
+    user_history = UserHistory(str(tmp_path), storage=request.param)
+    seed(user_history)
+    yield user_history
+    user_history.close()
+
+
+def all_pages(user_history, size):
+    ids, cursor = [], None
+    while True:
+        page = user_history.get_page(size, before_id=cursor)
+        if not page:
+            return ids
+        ids += [entry['id'] for entry in page]
+        cursor = page[-1]['id']
+
+
+def exported_ids(user_history, **kwargs):
+    data = b"".join(iter_export(user_history, "jsonl", **kwargs))
+    return [json.loads(line)['id'] for line in data.splitlines()]
+
+
+def test_pages(user_history):
+    assert all_pages(user_history, 7) == list(range(60, 0, -1))
+    assert [entry['id'] for entry in user_history.get_page(3, before_id=10)] == [9, 8, 7]
+
+
+def test_pages_continue_into_archive(user_history):
+    assert user_history.backend.archive_before("2024-01-21", user_history.archive) == 20
+    assert user_history.stats["total_rewrites"] == 60
+    assert all_pages(user_history, 7) == list(range(60, 0, -1))
+
+
+def test_search(user_history):
+    results = user_history.search("apples", limit=100)
+    assert sorted(entry['id'] for entry in results) == list(range(1, 61, 3))
+    in_range = user_history.search("apples", limit=100, start_date="2024-01-10", end_date="2024-01-20")
+    assert sorted(entry['id'] for entry in in_range) == [10, 13, 16, 19]
+    assert user_history.search("bananas") == []
+
+
+def test_search_ties_go_to_newest(user_history):
+    user_history.backend.add_entries([{'timestamp': "2024-03-01 10:00:00", 'original': "same words",
+                                       'rewritten': "same words", 'char_count': 10}
+                                      for _ in range(30)])
+    assert [entry['id'] for entry in user_history.search("same", limit=3)] == [90, 89, 88]
+
+
+def test_export(user_history):
+    assert exported_ids(user_history) == list(range(1, 61))
+    user_history.backend.archive_before("2024-01-21", user_history.archive)
+    assert exported_ids(user_history) == list(range(1, 61))
+    assert exported_ids(user_history, start_date="2024-01-15", end_date="2024-02-03") == list(range(15, 35))
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_two_processes_writing(tmp_path, storage):
+    writers = [subprocess.Popen([sys.executable, "-c", WRITER, str(tmp_path), storage, "100"],
+                                cwd=ROOT, env={**os.environ, "PYTHONPATH": ROOT})
+               for _ in range(2)]
+    assert [writer.wait(timeout=120) for writer in writers] == [0, 0]
+
+    user_history = UserHistory(str(tmp_path), storage=storage)
+    try:
+        # No write lost and no id handed out twice
+        assert [entry['id'] for entry in user_history.get_history()] == list(range(1, 201))
+        assert user_history.stats["total_rewrites"] == 200
+    finally:
+        user_history.close()
+
+
+def test_sqlite_refresh_sees_other_processes_from_any_thread(tmp_path):
+    user_history = UserHistory(str(tmp_path), storage="sqlite")
+    try:
+        user_history.add_entry("mine", "rewritten")
+        user_history.refresh()
+        generation = user_history.generation
+        subprocess.run([sys.executable, "-c", WRITER, str(tmp_path), "sqlite", "1"],
+                       cwd=ROOT, env={**os.environ, "PYTHONPATH": ROOT}, check=True)
+
+        # A thread that never touched the database before still notices the commit
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(user_history.refresh()))
+        thread.start()
+        thread.join()
+        assert seen == [True]
+        assert user_history.generation > generation
+        assert user_history.refresh() is False
+    finally:
+        user_history.close()
+
+
+@pytest.mark.parametrize("storage", ("json", "journal"))
+def test_corrupt_history_is_not_overwritten(tmp_path, storage):
+    history_file = tmp_path / "user_history.json"
+    history_file.write_text('[{"id": 1, "timestamp": "2024-01-01 10:00:00", "orig', encoding='utf-8')
+    user_history = UserHistory(str(tmp_path), storage=storage)
+    try:
+        assert not user_history.add_entry("new text", "rewritten")
+        assert not user_history.clear_history()
+        assert history_file.read_text(encoding='utf-8').endswith('"orig')
+        assert list(tmp_path.glob("user_history.json.corrupt-*"))
+
+        # Once the file is repaired, writes go through again
+        history_file.write_text('[{"id": 1, "timestamp": "2024-01-01 10:00:00", "original": "old", '
+                                '"rewritten": "OLD", "char_count": 3}]', encoding='utf-8')
+        assert user_history.add_entry("new text", "rewritten")
+        assert [entry['original'] for entry in user_history.get_history()] == ["old", "new text"]
+    finally:
+        user_history.close()
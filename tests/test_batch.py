@@ -0,0 +1,113 @@
+import csv
+import json
+
+import pytest
+
+import rewriter
+from batch import BatchJob
+from user_data import UserHistory
+
+ROWS = 23
+
+
+class Crash(BaseException):
+    """Stands in for the process dying: not caught by the per-row retries"""
+
+
+def upload(fmt):
+    texts = [f"row {n} text" for n in range(ROWS)]
+    if fmt == "csv":
+        data = "id,text\n" + "".join(f"{n},{text}\n" for n, text in enumerate(texts))
+    elif fmt == "jsonl":
+        data = "".join(json.dumps({"id": n, "text": text}) + "\n" for n, text in enumerate(texts))
+    else:
+        data = "".join(text + "\n" for text in texts)
+    return data.encode('utf-8'), f"upload.{fmt}"
+
+
+def read_output(job):
+    with open(job.output_path, 'r', encoding='utf-8', newline='') as f:
+        if job.fmt == "csv":
+            return [row["rewritten"] for row in csv.DictReader(f)]
+        if job.fmt == "jsonl":
+            return [json.loads(line)["rewritten"] for line in f]
+        return [line.rstrip("\n") for line in f]
+
+
+def output_size(job):
+    with open(job.output_path, 'rb') as f:
+        return len(f.read())
+
+
+@pytest.fixture
+def user_history(tmp_path):
+    user_history = UserHistory(str(tmp_path / "history"), storage="json")
+    yield user_history
+    user_history.close()
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Rewrites upper-case the text; ``calls["crash_at"]`` makes that row's call crash"""
+    calls = {"texts": [], "crash_at": None}
+
+    def rewrite_one(text, cache=None, user_history=None):
+        if text == calls["crash_at"]:
+            raise Crash()
+        calls["texts"].append(text)
+        return text.upper(), False
+
+    monkeypatch.setattr(rewriter, "rewrite_one", rewrite_one)
+    return calls
+
+
+def new_job(tmp_path, fmt, user_history):
+    data, filename = upload(fmt)
+    return BatchJob.from_upload(data, filename, batch_dir=str(tmp_path / "batch"), workers=1,
+                                rate=1000, flush_every=5, user_history=user_history)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl", "txt"])
+def test_resume_from_checkpoint(tmp_path, fmt, user_history, calls):
+    expected = [f"ROW {n} TEXT" for n in range(ROWS)]
+    calls["crash_at"] = "row 12 text"
+    job = new_job(tmp_path, fmt, user_history)
+    with pytest.raises(Crash):
+        job.run()
+    checkpoint = job.load_checkpoint()
+    assert checkpoint["rows_done"] == 10
+    # Rows 10 and 11 reached the file but not the checkpoint; so did half a row
+    with open(job.output_path, 'a', encoding='utf-8') as f:
+        f.write("half a ro")
+    assert len(user_history.get_history()) == 10
+
+    calls["crash_at"], calls["texts"] = None, []
+    job = new_job(tmp_path, fmt, user_history)
+    assert job.run() == {"rows_done": ROWS, "output_bytes": output_size(job), "failed": 0}
+    # Only rows after the checkpoint are rewritten again, and none is written twice
+    assert calls["texts"] == [f"row {n} text" for n in range(10, ROWS)]
+    assert read_output(job) == expected
+    assert [entry['rewritten'] for entry in user_history.get_history()] == expected
+
+    # A finished job has nothing left to do
+    calls["texts"] = []
+    assert new_job(tmp_path, fmt, user_history).run()["rows_done"] == ROWS
+    assert calls["texts"] == []
+
+
+def test_failed_rows_are_kept_in_order(tmp_path, user_history, monkeypatch):
+    def rewrite_one(text, cache=None, user_history=None):
+        if text == "row 3 text":
+            raise ValueError("blocked")
+        return text.upper(), False
+
+    monkeypatch.setattr(rewriter, "rewrite_one", rewrite_one)
+    data, filename = upload("jsonl")
+    job = BatchJob.from_upload(data, filename, batch_dir=str(tmp_path / "batch"), workers=4,
+                               rate=1000, user_history=user_history)
+    assert job.run()["failed"] == 1
+    with open(job.output_path, 'r', encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["id"] for row in rows] == list(range(ROWS))
+    assert rows[3]["rewritten"] == "" and rows[3]["error"] == "ValueError: blocked"
+    assert len(user_history.get_history()) == ROWS - 1
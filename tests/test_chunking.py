@@ -0,0 +1,92 @@
+import pytest
+
+import rewriter
+from chunking import join_chunks, split_text
+from user_data import UserHistory
+
+PARAGRAPHS = [
+    "The first paragraph has two sentences. It is short.",
+    "यह दूसरा अनुच्छेद है। इसमें हिंदी के वाक्य हैं। तीसरा वाक्य भी है।",
+    "The third paragraph! Does it end with a question?",
+]
+DOCUMENT = "\n\n".join(PARAGRAPHS)
+
+
+def rejoin(chunks):
+    return "".join(chunk + separator for chunk, separator in chunks)
+
+
+@pytest.mark.parametrize("max_chars", [10, 25, 60, 100, 3000])
+def test_split_reproduces_the_text(max_chars):
+    chunks = split_text(DOCUMENT, max_chars)
+    assert rejoin(chunks) == DOCUMENT
+    assert all(0 < len(chunk) <= max_chars for chunk, _ in chunks)
+    assert chunks[-1][1] == ""
+
+
+def test_split_prefers_paragraphs_then_sentences():
+    assert [chunk for chunk, _ in split_text(DOCUMENT, 80)] == PARAGRAPHS
+    # A paragraph too long for one chunk is split after a full stop or danda
+    assert [chunk for chunk, _ in split_text(PARAGRAPHS[1], 50)] == [
+        "यह दूसरा अनुच्छेद है। इसमें हिंदी के वाक्य हैं।", "तीसरा वाक्य भी है।"]
+
+
+def test_split_cuts_a_word_longer_than_a_chunk():
+    chunks = split_text("short " + "x" * 25 + " tail", 10)
+    assert rejoin(chunks) == "short " + "x" * 25 + " tail"
+    # The cut pieces are packed like any other word
+    assert [chunk for chunk, _ in chunks] == ["short", "xxxxxxxxxx", "xxxxxxxxxx", "xxxxx tail"]
+
+
+def test_split_short_and_empty_text():
+    assert split_text("  one line  ") == [("one line", "")]
+    assert split_text(" \n\n ") == []
+
+
+def test_join_keeps_order_and_separators():
+    chunks = split_text(DOCUMENT, 80)
+    rewritten = [f"  REWRITTEN {n}\n" for n in range(len(chunks))]
+    assert join_chunks(chunks, rewritten) == "REWRITTEN 0\n\nREWRITTEN 1\n\nREWRITTEN 2"
+
+
+@pytest.fixture
+def user_history(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("FAKE_LLM_LATENCY_MS", "1")
+    monkeypatch.setenv("REWRITE_CACHE_DISK", "0")
+    monkeypatch.setattr(rewriter, "_cache", None)
+    user_history = UserHistory(str(tmp_path), storage="json")
+    yield user_history
+    user_history.close()
+
+
+def test_rewrite_document_reassembles_in_order(user_history):
+    progress = []
+    text = rewriter.rewrite_document(DOCUMENT, user_history, max_chars=60, workers=3,
+                                     on_progress=lambda index, total, status: progress.append(status))
+    # The fake model echoes each chunk, so the document comes back whole
+    assert text == DOCUMENT
+    assert progress.count("queued") == progress.count("done") == len(split_text(DOCUMENT, 60))
+    assert [entry['original'] for entry in user_history.get_history()] == [DOCUMENT]
+
+
+def test_rewrite_document_retries_a_failing_chunk(user_history, monkeypatch):
+    rewrite_one = rewriter.rewrite_one
+    failures = {PARAGRAPHS[1]: 2}
+
+    def flaky(text, cache, user_history):
+        if failures.get(text):
+            failures[text] -= 1
+            raise ConnectionError("dropped")
+        return rewrite_one(text, cache, user_history)
+
+    monkeypatch.setattr(rewriter, "rewrite_one", flaky)
+    progress = []
+    text = rewriter.rewrite_document(DOCUMENT, user_history, max_chars=80, retries=2,
+                                     on_progress=lambda index, total, status: progress.append((index, status)))
+    assert text == DOCUMENT
+    assert [status for index, status in progress if index == 1] == ["queued", "retrying", "retrying", "done"]
+
+    failures[PARAGRAPHS[1]] = 3
+    with pytest.raises(ConnectionError):
+        rewriter.rewrite_document(DOCUMENT.upper(), user_history, max_chars=80, retries=2)
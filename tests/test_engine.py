@@ -0,0 +1,148 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import fake_llm
+import llm
+from engine import QueueFull, RewriteEngine
+
+
+@pytest.fixture
+def engine():
+    engine = RewriteEngine(max_queue=2, max_in_flight=1, timeout=10)
+    yield engine
+    engine.close()
+
+
+def blocker(release, started=None):
+    """A call that holds its slot until ``release`` is set"""
+    def call():
+        if started is not None:
+            started.set()
+        release.wait(10)
+        return "done"
+    return call
+
+
+def test_queue_full(engine):
+    release, started = threading.Event(), threading.Event()
+    running = engine.submit(None, blocker(release, started))
+    started.wait(5)
+    queued = [engine.submit(None, blocker(release)) for _ in range(2)]
+    # One in flight and max_queue waiting: the next caller is turned away
+    with pytest.raises(QueueFull):
+        engine.submit(None, blocker(release))
+    assert engine.stats()["rejected"] == 1
+    assert engine.stats()["queued"] == 2
+
+    release.set()
+    assert [future.result(5) for future in [running] + queued] == ["done"] * 3
+    # Room again once the backlog drains
+    assert engine.submit(None, lambda: "again").result(5) == "again"
+
+
+def test_duplicate_submits_share_one_call(engine):
+    release, started = threading.Event(), threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait(10)
+        return "shared"
+
+    first = engine.submit("same text", call)
+    started.wait(5)
+    second = engine.submit("same text", call)
+    assert second is first
+    other = engine.submit("other text", lambda: "other")
+    release.set()
+    assert first.result(5) == "shared" and other.result(5) == "other"
+    assert calls == [1]
+    assert engine.stats()["coalesced"] == 1
+    # Finished calls aren't shared: the same key later calls upstream again
+    assert engine.submit("same text", call).result(5) == "shared"
+    assert calls == [1, 1]
+
+
+def test_duplicate_streams_share_chunks(engine):
+    release = threading.Event()
+    calls = []
+
+    def chunks():
+        calls.append(1)
+        yield "a"
+        release.wait(10)
+        yield "b"
+
+    first = engine.stream("text", chunks)
+    assert next(first) == "a"
+    second = engine.stream("text", chunks)
+    release.set()
+    # A caller joining late still gets the stream from its first chunk
+    assert list(second) == ["a", "b"]
+    assert list(first) == ["b"]
+    assert calls == [1]
+
+
+def test_queued_request_expires_without_calling_upstream(engine):
+    release, started = threading.Event(), threading.Event()
+    engine.submit(None, blocker(release, started))
+    started.wait(5)
+    called = []
+    late = engine.submit(None, lambda: called.append(1), timeout=0.05)
+    time.sleep(0.1)
+    release.set()
+    with pytest.raises(TimeoutError):
+        late.result(5)
+    assert called == []
+    assert engine.stats()["expired"] == 1
+
+
+def test_run_stops_waiting_at_the_deadline(engine):
+    release = threading.Event()
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        engine.run(None, blocker(release), timeout=0.1)
+    assert time.monotonic() - start < 2
+    release.set()
+
+
+def test_expired_stream_stops_reading_upstream(engine):
+    produced = []
+
+    def chunks():
+        for n in range(100):
+            produced.append(n)
+            time.sleep(0.02)
+            yield str(n)
+
+    with pytest.raises(TimeoutError):
+        for _ in engine.stream("slow", chunks, timeout=0.2):
+            pass
+    time.sleep(0.2)
+    # Nobody is listening any more, so the upstream stream is abandoned early
+    assert len(produced) < 30
+
+
+def test_fake_model_calls_coalesce(engine, monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("FAKE_LLM_LATENCY_MS", "200")
+    monkeypatch.setenv("FAKE_LLM_LATENCY_SIGMA", "0")
+    calls = []
+    generate_content = fake_llm.FakeModel.generate_content
+
+    def counting(self, prompt, stream=False):
+        calls.append(prompt)
+        return generate_content(self, prompt, stream)
+
+    monkeypatch.setattr(fake_llm.FakeModel, "generate_content", counting)
+    # Models are cached per process; build this test's with its latency
+    monkeypatch.setattr(llm, "_models", {})
+    prompt = "Rewrite this:\n\nThe same paragraph, pasted twice."
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: engine.run(prompt, lambda: llm.generate(prompt)), range(4)))
+    assert results == ["The same paragraph, pasted twice."] * 4
+    assert len(calls) == 1
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+
+import pytest
+
+import storage
+from storage import JournalStore, MemoryBackend
+
+
+def open_backend(data_dir, **kwargs):
+    # A fresh store each time, as a restarted process would get, not the cached one
+    store = JournalStore(os.path.join(data_dir, "user_history.json"),
+                         os.path.join(data_dir, "usage_stats.json"), **kwargs)
+    return MemoryBackend(store)
+
+
+def add(backend, *texts):
+    return backend.add_entries([{'timestamp': "2024-05-01 12:00:00", 'original': text,
+                                 'rewritten': text.upper(), 'char_count': len(text)}
+                                for text in texts])
+
+
+def ids(backend):
+    return [entry['id'] for entry in backend.get_history()]
+
+
+def test_append_and_reopen(tmp_path):
+    backend = open_backend(tmp_path)
+    add(backend, "one", "two")
+    add(backend, "three")
+    backend.increment("cache_hits", 2)
+    assert ids(backend) == [1, 2, 3]
+    backend.close()
+
+    # Nothing compacted yet: everything comes back from the journal
+    assert not os.path.exists(tmp_path / "user_history.json")
+    backend = open_backend(tmp_path)
+    assert ids(backend) == [1, 2, 3]
+    assert [entry['original'] for entry in backend.get_history()] == ["one", "two", "three"]
+    assert backend.stats["total_rewrites"] == 3
+    assert backend.stats["cache_hits"] == 2
+    # Ids carry on after the last one on disk
+    assert add(backend, "four")[0]['id'] == 5
+    backend.close()
+
+
+def test_compact_folds_journal_into_snapshot(tmp_path):
+    backend = open_backend(tmp_path)
+    add(backend, "one", "two", "three")
+    assert backend.store.compact()
+    assert os.path.getsize(tmp_path / "user_history.jsonl") == 0
+    add(backend, "four")
+    backend.close()
+
+    with open(tmp_path / "user_history.json", encoding='utf-8') as f:
+        assert [entry['id'] for entry in json.load(f)] == [1, 2, 3]
+    backend = open_backend(tmp_path)
+    assert ids(backend) == [1, 2, 3, 4]
+    assert backend.stats["total_rewrites"] == 4
+    backend.close()
+
+
+def test_replay_after_crash_before_snapshot(tmp_path):
+    backend = open_backend(tmp_path)
+    add(backend, "one", "two")
+    backend.store.compact()
+    add(backend, "three", "four")
+    backend.close()
+
+    # Crash right after the journal was rotated out, before the snapshot was written
+    os.replace(tmp_path / "user_history.jsonl", tmp_path / "user_history.jsonl.compacting")
+    with open(tmp_path / "user_history.jsonl", 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'id': 5, 'timestamp': "2024-05-01 12:00:00", 'original': "five",
+                            'rewritten': "FIVE", 'char_count': 4}) + "\n")
+        # Torn final line from the crash
+        f.write('{"id": 6, "timestamp": "2024-05-0')
+
+    backend = open_backend(tmp_path)
+    assert ids(backend) == [1, 2, 3, 4, 5]
+    assert backend.stats["total_rewrites"] == 5
+
+    # The next compaction finishes the interrupted one
+    assert backend.store.compact()
+    assert not os.path.exists(tmp_path / "user_history.jsonl.compacting")
+    backend.close()
+    backend = open_backend(tmp_path)
+    assert ids(backend) == [1, 2, 3, 4, 5]
+    assert backend.stats["total_rewrites"] == 5
+    backend.close()
+
+
+def test_replay_after_crash_after_snapshot(tmp_path, monkeypatch):
+    backend = open_backend(tmp_path)
+    add(backend, "one", "two", "three")
+
+    # Crash after the snapshot was written but before the .compacting file was removed
+    real_remove = os.remove
+
+    def crash(path):
+        if str(path).endswith(".compacting"):
+            raise OSError("simulated crash")
+        real_remove(path)
+
+    monkeypatch.setattr(storage.os, "remove", crash)
+    with pytest.raises(OSError):
+        backend.store.compact()
+    monkeypatch.setattr(storage.os, "remove", real_remove)
+    add(backend, "four")
+    backend.close()
+    assert os.path.exists(tmp_path / "user_history.jsonl.compacting")
+
+    # Records in both the snapshot and the .compacting file are replayed once
+    backend = open_backend(tmp_path)
+    assert ids(backend) == [1, 2, 3, 4]
+    assert backend.stats["total_rewrites"] == 4
+    assert backend.stats["total_characters"] == len("onetwothreefour")
+    backend.close()
+
+
+def test_own_compaction_does_not_reload(tmp_path):
+    backend = open_backend(tmp_path, compact_threshold=10)
+    reloads = []
+    reload = backend._reload
+    backend._reload = lambda: (reloads.append(1), reload())
+    for n in range(35):
+        add(backend, f"entry {n}")
+        if n % 10 == 9:
+            backend.store.compact()
+            backend.refresh()
+    assert reloads == []
+    assert ids(backend) == list(range(1, 36))
+    assert backend.stats["total_rewrites"] == 35
+    backend.close()
+
+
+def test_refresh_during_own_compaction(tmp_path, monkeypatch):
+    backend = open_backend(tmp_path)
+    # A second reader in the same process, so on the same store
+    reader = MemoryBackend(backend.store)
+    add(backend, "one", "two")
+    reader.refresh()
+    # Written after the reader last looked, then rotated out by the compaction
+    add(backend, "three", "four")
+
+    # Stop the compaction after the rotation, before the snapshot is written
+    def stop(*args):
+        raise RuntimeError("stopped mid-compaction")
+
+    monkeypatch.setattr(storage, "assign_ids", stop)
+    with pytest.raises(RuntimeError):
+        backend.store.compact()
+    monkeypatch.undo()
+    assert os.path.exists(tmp_path / "user_history.jsonl.compacting")
+
+    reloads = []
+    reload = reader._reload
+    reader._reload = lambda: (reloads.append(1), reload())
+    done = threading.Event()
+    worker = threading.Thread(target=lambda: (reader.refresh(), done.set()), daemon=True)
+    worker.start()
+    assert done.wait(5), "refresh() hung while a compaction was in progress"
+    assert reloads == []
+    assert ids(reader) == [1, 2, 3, 4]
+    assert add(reader, "five")[0]['id'] == 5
+    backend.close()
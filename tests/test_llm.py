@@ -0,0 +1,163 @@
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import llm
+from llm import CircuitBreaker
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class ScriptedModel:
+    """Plays back ``outcomes`` one call at a time: an exception to raise, or (seconds, text)"""
+
+    def __init__(self, name, outcomes):
+        self.name = name
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self._lock:
+            self.calls += 1
+            outcome = self.outcomes.pop(0) if self.outcomes else (0, f"{self.name} answer")
+        if isinstance(outcome, Exception):
+            raise outcome
+        delay, text = outcome
+        time.sleep(delay)
+        return Response(text)
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """Install scripted models ``primary`` and ``fallback``; returns a setter for their scripts"""
+    scripted = {}
+    monkeypatch.setitem(llm.BACKENDS, "scripted", lambda name, config: scripted[name])
+    monkeypatch.setattr(llm, "_models", {})
+    monkeypatch.setattr(llm, "_breakers", {})
+    monkeypatch.setenv("LLM_BACKEND", "scripted")
+    monkeypatch.setenv("GEMINI_MODELS", "primary,fallback")
+    monkeypatch.setenv("GEMINI_MAX_RETRIES", "2")
+    monkeypatch.setenv("GEMINI_BACKOFF_BASE", "0")
+    monkeypatch.setenv("GEMINI_HEDGE_AFTER_MS", "0")
+    monkeypatch.setenv("GEMINI_BREAKER_THRESHOLD", "5")
+
+    def script(primary=(), fallback=()):
+        scripted["primary"] = ScriptedModel("primary", primary)
+        scripted["fallback"] = ScriptedModel("fallback", fallback)
+        return scripted["primary"], scripted["fallback"]
+    return script
+
+
+def recorder():
+    counts = {}
+
+    def record(name, n=1):
+        counts[name] = counts.get(name, 0) + n
+    return counts, record
+
+
+def busy():
+    return google_exceptions.ServiceUnavailable("overloaded")
+
+
+def test_circuit_breaker_opens_half_opens_and_closes():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.1)
+    breaker.failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.12)
+    # One trial call after the cooldown, nobody else meanwhile
+    assert breaker.allow()
+    assert breaker.state == "half-open" and not breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.12)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_retryable_errors_are_retried_on_the_same_model(models):
+    primary, fallback = models(primary=[busy(), busy()])
+    counts, record = recorder()
+    assert llm.generate("prompt", record=record) == "primary answer"
+    assert (primary.calls, fallback.calls) == (3, 0)
+    assert counts == {"model_retries": 2}
+
+
+def test_fallback_once_retries_run_out(models):
+    primary, fallback = models(primary=[busy(), busy(), busy()])
+    counts, record = recorder()
+    assert llm.generate("prompt", record=record) == "fallback answer"
+    assert (primary.calls, fallback.calls) == (3, 1)
+    assert counts == {"model_retries": 2, "model_fallbacks": 1}
+
+
+def test_unavailable_model_falls_back_without_retrying(models):
+    primary, fallback = models(primary=[google_exceptions.NotFound("no such model")])
+    counts, record = recorder()
+    assert llm.generate("prompt", record=record) == "fallback answer"
+    assert (primary.calls, fallback.calls) == (1, 1)
+    assert counts == {"model_fallbacks": 1}
+
+
+def test_other_errors_are_raised_straight_away(models):
+    primary, fallback = models(primary=[ValueError("prompt blocked")])
+    counts, record = recorder()
+    with pytest.raises(ValueError):
+        llm.generate("prompt", record=record)
+    assert (primary.calls, fallback.calls) == (1, 0)
+    assert counts == {}
+    # The model answered, so it counts as healthy
+    assert llm.get_breaker("primary").state == "closed"
+
+
+def test_open_circuit_skips_the_model(models, monkeypatch):
+    monkeypatch.setenv("GEMINI_BREAKER_THRESHOLD", "2")
+    monkeypatch.setenv("GEMINI_MAX_RETRIES", "0")
+    primary, fallback = models(primary=[busy(), busy()])
+    counts, record = recorder()
+    for _ in range(2):
+        assert llm.generate("prompt", record=record) == "fallback answer"
+    assert llm.get_breaker("primary").state == "open"
+
+    assert llm.generate("prompt", record=record) == "fallback answer"
+    assert primary.calls == 2
+    # Served by the second model each time, whether primary failed or was skipped
+    assert counts == {"model_fallbacks": 3, "model_circuit_skips": 1}
+
+
+def test_every_model_failing_raises_the_last_error(models, monkeypatch):
+    monkeypatch.setenv("GEMINI_MAX_RETRIES", "0")
+    models(primary=[busy()], fallback=[google_exceptions.ResourceExhausted("quota")])
+    with pytest.raises(google_exceptions.ResourceExhausted):
+        llm.generate("prompt")
+
+
+def test_hedge_wins_when_the_first_call_is_slow(models, monkeypatch):
+    monkeypatch.setenv("GEMINI_HEDGE_AFTER_MS", "50")
+    primary, _ = models(primary=[(1.0, "slow answer"), (0, "hedged answer")])
+    counts, record = recorder()
+    start = time.monotonic()
+    assert llm.generate("prompt", record=record) == "hedged answer"
+    assert time.monotonic() - start < 0.5
+    assert primary.calls == 2
+    assert counts == {"model_hedges": 1}
+
+
+def test_no_hedge_when_the_first_call_is_quick(models, monkeypatch):
+    monkeypatch.setenv("GEMINI_HEDGE_AFTER_MS", "500")
+    primary, _ = models(primary=[(0.01, "quick answer")])
+    counts, record = recorder()
+    assert llm.generate("prompt", record=record) == "quick answer"
+    assert primary.calls == 1
+    assert counts == {}
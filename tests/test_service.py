@@ -0,0 +1,45 @@
+import queue
+import threading
+
+import pytest
+
+from service import RewriteService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("FAKE_LLM_LATENCY_MS", "1")
+    monkeypatch.setenv("REWRITE_CACHE_DISK", "0")
+    service = RewriteService(data_dir=str(tmp_path), storage="json", workers=4)
+    yield service
+    service.close()
+
+
+def test_rewrite_many_yields_before_the_window_fills(service):
+    lines = queue.Queue()
+
+    def slow_input():
+        while True:
+            line = lines.get()
+            if line is None:
+                return
+            yield line
+
+    results = queue.Queue()
+    worker = threading.Thread(target=lambda: [results.put(result) for result in
+                                              service.rewrite_many(slow_input(), window=8)],
+                              daemon=True)
+    worker.start()
+    lines.put("first line")
+    # Only one line so far, far short of the window, and stdin is still open
+    assert results.get(timeout=10) == ("first line", "first line", None)
+    lines.put("")
+    lines.put(None)
+    assert results.get(timeout=10) == ("", "", None)
+    worker.join(10)
+
+
+def test_rewrite_many_keeps_input_order(service):
+    texts = [f"line {n}" for n in range(20)]
+    assert [text for text, _, _ in service.rewrite_many(iter(texts), window=3)] == texts
@@ -0,0 +1,80 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from similar_cache import MinHashIndex, SimilarityCache
+from user_data import UserHistory
+
+TEXT = ("The meeting has been moved to Thursday afternoon because the projector "
+        "in the main hall is still broken and nobody has fixed it yet.")
+RESPACED = ("the meeting has been moved to   Thursday afternoon, because the projector\n"
+            "in the main hall is still broken - and nobody has fixed it yet!")
+ONE_WORD = TEXT.replace("Thursday", "Friday")
+UNRELATED = "Please send the quarterly sales figures to the finance team before noon."
+
+
+def test_respaced_and_repunctuated_text_matches():
+    index = MinHashIndex()
+    index.add("meeting", TEXT)
+    index.add("sales", UNRELATED)
+    assert index.query(RESPACED, 0.9) == ("meeting", 1.0)
+
+
+def test_one_word_edit_matches_at_a_lower_threshold():
+    index = MinHashIndex()
+    index.add("meeting", TEXT)
+    key, similarity = index.query(ONE_WORD, 0.7)
+    assert key == "meeting" and 0.7 <= similarity < 1
+    assert index.query(ONE_WORD, 0.95) is None
+
+
+def test_unrelated_text_does_not_match():
+    index = MinHashIndex()
+    index.add("meeting", TEXT)
+    assert index.query(UNRELATED, 0.5) is None
+    assert MinHashIndex().query(TEXT, 0.5) is None
+
+
+def test_ties_go_to_newest_and_oldest_is_evicted():
+    index = MinHashIndex(max_entries=3)
+    index.add("first", TEXT)
+    index.add("second", RESPACED)
+    assert index.query(TEXT, 0.9)[0] == "second"
+    index.add_many(["sales", "other"], [UNRELATED, "An entirely different short note."])
+    assert len(index) == 3
+    # "first" made room for the new entries; "second" still matches
+    assert index.query(TEXT, 0.9)[0] == "second"
+    index.add("more", "Yet another text that is not like the others at all.")
+    assert index.query(TEXT, 0.9) is None
+
+
+@pytest.fixture
+def user_history(tmp_path):
+    user_history = UserHistory(str(tmp_path), storage="json")
+    yield user_history
+    user_history.close()
+
+
+def test_cache_follows_the_history(user_history):
+    cache = SimilarityCache(user_history, threshold=0.9)
+    assert cache.lookup(RESPACED) is None
+    user_history.add_entry(UNRELATED, "Sales rewrite")
+    user_history.add_entry(TEXT, "Meeting rewrite")
+
+    entry, similarity = cache.lookup(RESPACED)
+    assert (entry['id'], entry['rewritten'], similarity) == (2, "Meeting rewrite", 1.0)
+    assert cache.lookup(UNRELATED.upper())[0]['rewritten'] == "Sales rewrite"
+    assert cache.stats() == {"entries": 2, "lookups": 3, "hits": 2, "hit_rate": 2 / 3}
+
+
+def test_cache_starts_over_after_the_history_is_cleared(user_history):
+    cache = SimilarityCache(user_history, threshold=0.9)
+    user_history.add_entry(TEXT, "Meeting rewrite")
+    assert cache.lookup(RESPACED) is not None
+
+    user_history.clear_history()
+    assert cache.lookup(RESPACED) is None
+    user_history.add_entry(UNRELATED, "Sales rewrite")
+    # Id 1 now holds different text; the old signature must not serve it
+    assert cache.lookup(RESPACED) is None
+    assert cache.lookup(UNRELATED)[0]['rewritten'] == "Sales rewrite"
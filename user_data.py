@@ -1,133 +1,350 @@
-import json
+import argparse
+import hashlib
 import os
+import re
+import threading
 from datetime import datetime, timedelta
 from collections import defaultdict
+from archive import HistoryArchive
+from metrics import get_metrics
+from storage import (LATENCY_BUCKETS, _file_signature, merge_stats, open_backend, read_stats,
+                     stats_files)
 
-class UserHistory:
-    def __init__(self):
-        self.history_file = "user_history.json"
-        self.stats_file = "usage_stats.json"
-        self._ensure_data_directory()
-        self.load_history()
-        self.load_stats()
+# Each signed-in user's history is a shard of its own under data/users/<name>/;
+# the data directory itself holds the shared history (API, CLI, older data)
+USERS_DIR = "users"
 
-    def _ensure_data_directory(self):
+
+def user_dir(data_dir, user):
+    """Directory holding ``user``'s history shard"""
+    name = user.lower()
+    if not re.fullmatch(r"[a-z0-9_-]{1,64}", name):
+        # Keep unusual names out of the path, still one directory per user
+        name = "u-" + hashlib.sha256(name.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(data_dir, USERS_DIR, name)
+
+
+def shard_dirs(data_dir):
+    """The shared history's directory followed by every user's shard"""
+    users = os.path.join(data_dir, USERS_DIR)
+    names = sorted(os.listdir(users)) if os.path.isdir(users) else []
+    return [data_dir] + [os.path.join(users, name) for name in names
+                         if os.path.isdir(os.path.join(users, name))]
+
+
+class UsageReports:
+    """Usage charts and summaries computed from ``stats``, for one history or the rollup"""
+
+    def _daily_counts(self, start_date, end_date):
+        return {date: count for date, count in self.stats["daily_usage"].items()
+                if start_date <= date <= end_date}
+
+    def get_usage_stats(self):
+        return self.stats
+
+    def get_daily_usage(self, days=7):
+        daily_usage = defaultdict(int)
+        end_date = datetime.now()
+        start = (end_date - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        counts = self._daily_counts(start, end_date.strftime("%Y-%m-%d"))
+
+        # Ensure we have entries for all days
+        for i in range(days):
+            date = (end_date - timedelta(days=i)).strftime("%Y-%m-%d")
+            daily_usage[date] = counts.get(date, 0)
+
+        # Sort by date
+        return dict(sorted(daily_usage.items()))
+
+    def get_hourly_usage(self):
+        """Return rewrite counts for each hour of the day, 0 through 23"""
+        hourly_usage = self.stats.get("hourly_usage", {})
+        return [hourly_usage.get(f"{hour:02d}", 0) for hour in range(24)]
+
+    def get_monthly_usage(self):
+        """Return rewrite counts per month, oldest first"""
+        return dict(sorted(self.stats.get("monthly_usage", {}).items()))
+
+    def get_latency_histogram(self):
+        """Return (bucket label, count) pairs for total rewrite latency"""
+        histogram = self.stats.get("latency_histogram", {})
+        buckets = [str(bound) for bound in LATENCY_BUCKETS] + ["inf"]
+        labels = [f"≤ {bound:,} ms" for bound in LATENCY_BUCKETS] + [f"> {LATENCY_BUCKETS[-1]:,} ms"]
+        return [(label, histogram.get(bucket, 0)) for label, bucket in zip(labels, buckets)]
+
+    def get_stats_summary(self):
+        """Get a summary of usage statistics"""
+        stats = self.stats
+        timed = stats.get("timed_rewrites", 0)
+        return {
+            "total_rewrites": stats["total_rewrites"],
+            "total_characters": stats["total_characters"],
+            "avg_text_length": round(stats["avg_text_length"], 2),
+            "avg_ttft_ms": round(stats.get("total_ttft_ms", 0) / timed, 1) if timed else None,
+            "avg_latency_ms": round(stats.get("total_latency_ms", 0) / timed, 1) if timed else None,
+            "last_updated": stats.get("last_updated", "Never")
+        }
+
+
+class UserHistory(UsageReports):
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, data_dir="data", storage=None):
+        # "journal" appends to a JSON Lines log, "json" rewrites the full files,
+        # "sqlite" keeps everything in data/user_history.db, "mapped" reads a
+        # memory-mapped log through an offset index
+        self.storage = storage or os.getenv("HISTORY_STORAGE", "journal")
+        self._ensure_data_directory(data_dir)
+        self.backend = open_backend(self.storage, self.data_dir)
+        # Entries past the retention window, compressed by month
+        self.archive = HistoryArchive(os.path.join(self.data_dir, "archive"))
+
+    @classmethod
+    def shared(cls, data_dir="data", storage=None, user=None):
+        """Return the process-wide instance for ``data_dir``, refreshed from disk if it changed
+
+        With a ``user`` it is that user's shard, so reads and writes never
+        touch anyone else's history.
+        """
+        if user:
+            data_dir = user_dir(data_dir, user)
+        key = (os.path.abspath(data_dir), storage)
+        with get_metrics().timer("history_load"):
+            with cls._shared_lock:
+                user_history = cls._shared.get(key)
+                if user_history is None:
+                    user_history = cls(data_dir=data_dir, storage=storage)
+                    if os.getenv("HISTORY_RETENTION_DAYS"):
+                        user_history.apply_retention()
+                    cls._shared[key] = user_history
+                    return user_history
+            user_history.refresh()
+            return user_history
+
+    def _ensure_data_directory(self, data_dir):
         """Ensure the data directory exists"""
-        data_dir = "data"
         if not os.path.exists(data_dir):
             os.makedirs(data_dir)
-        self.history_file = os.path.join(data_dir, self.history_file)
-        self.stats_file = os.path.join(data_dir, self.stats_file)
-
-    def load_history(self):
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    self.history = json.load(f)
-            except Exception as e:
-                print(f"Error loading history: {e}")
-                self.history = []
-        else:
-            self.history = []
-
-    def load_stats(self):
-        if os.path.exists(self.stats_file):
-            try:
-                with open(self.stats_file, 'r', encoding='utf-8') as f:
-                    self.stats = json.load(f)
-            except Exception as e:
-                print(f"Error loading stats: {e}")
-                self.stats = self._initialize_stats()
-        else:
-            self.stats = self._initialize_stats()
-
-    def _initialize_stats(self):
-        return {
-            "total_rewrites": 0,
-            "daily_usage": {},
-            "avg_text_length": 0,
-            "total_characters": 0,
-            "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.data_dir = data_dir
+
+    @property
+    def history(self):
+        return self.backend.get_history()
+
+    @property
+    def stats(self):
+        return self.backend.get_stats()
+
+    @property
+    def generation(self):
+        """Changes whenever the stored history or stats change"""
+        return self.backend.generation
+
+    def refresh(self):
+        try:
+            return self.backend.refresh()
+        except Exception as e:
+            print(f"Error refreshing history: {e}")
+            return False
+
+    def _new_entry(self, original_text, rewritten_text, ttft_ms=None, latency_ms=None):
+        entry = {
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'original': original_text,
+            'rewritten': rewritten_text,
+            'char_count': len(original_text)
         }
+        if latency_ms is not None:
+            # Time to first token is what the user perceives; latency is the full response
+            entry['ttft_ms'] = round(ttft_ms if ttft_ms is not None else latency_ms, 1)
+            entry['latency_ms'] = round(latency_ms, 1)
+        return entry
 
-    def save_history(self):
+    def add_entry(self, original_text, rewritten_text, ttft_ms=None, latency_ms=None):
         try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
+            self.backend.add_entry(self._new_entry(original_text, rewritten_text,
+                                                   ttft_ms, latency_ms))
+            return True
         except Exception as e:
-            print(f"Error saving history: {e}")
+            print(f"Error adding entry: {e}")
+            return False
 
-    def save_stats(self):
+    def add_entries(self, pairs):
+        """Add many (original_text, rewritten_text) pairs with a single write"""
         try:
-            self.stats["last_updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open(self.stats_file, 'w', encoding='utf-8') as f:
-                json.dump(self.stats, f, ensure_ascii=False, indent=2)
+            entries = [self._new_entry(original, rewritten) for original, rewritten in pairs]
+            if entries:
+                self.backend.add_entries(entries)
+            return True
         except Exception as e:
-            print(f"Error saving stats: {e}")
+            print(f"Error adding entries: {e}")
+            return False
 
-    def add_entry(self, original_text, rewritten_text):
+    def increment(self, name, n=1):
+        """Bump a named counter in the usage stats, e.g. ``cache_hits``"""
         try:
-            # Add to history
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            date = timestamp.split()[0]
-            
-            entry = {
-                'timestamp': timestamp,
-                'original': original_text,
-                'rewritten': rewritten_text,
-                'char_count': len(original_text)
-            }
-            self.history.append(entry)
-            
-            # Update stats
-            self.stats["total_rewrites"] += 1
-            self.stats["daily_usage"][date] = self.stats["daily_usage"].get(date, 0) + 1
-            self.stats["total_characters"] += len(original_text)
-            self.stats["avg_text_length"] = self.stats["total_characters"] / self.stats["total_rewrites"]
-            
-            # Save both history and stats
-            self.save_history()
-            self.save_stats()
-            
+            self.backend.increment(name, n)
             return True
         except Exception as e:
-            print(f"Error adding entry: {e}")
+            print(f"Error updating {name}: {e}")
             return False
 
-    def get_usage_stats(self):
-        return self.stats
+    def _daily_counts(self, start_date, end_date):
+        return self.backend.get_daily_usage(start_date, end_date)
 
-    def get_daily_usage(self, days=7):
-        daily_usage = defaultdict(int)
-        end_date = datetime.now()
-        
-        # Ensure we have entries for all days
-        for i in range(days):
-            date = (end_date - timedelta(days=i)).strftime("%Y-%m-%d")
-            daily_usage[date] = self.stats["daily_usage"].get(date, 0)
-        
-        # Sort by date
-        return dict(sorted(daily_usage.items()))
+    def apply_retention(self, days=None):
+        """Archive entries older than ``days`` (default ``HISTORY_RETENTION_DAYS``); returns the count"""
+        days = days if days is not None else int(os.getenv("HISTORY_RETENTION_DAYS", "0"))
+        if days <= 0:
+            return 0
+        cutoff = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        try:
+            return self.backend.archive_before(cutoff, self.archive)
+        except Exception as e:
+            print(f"Error archiving history: {e}")
+            return 0
 
     def clear_history(self):
         try:
-            self.history = []
-            self.stats = self._initialize_stats()
-            self.save_history()
-            self.save_stats()
+            self.backend.clear()
+            self.archive.clear()
             return True
         except Exception as e:
             print(f"Error clearing history: {e}")
             return False
 
-    def get_history(self):
-        return self.history
+    def get_history(self, limit=None):
+        """Return entries oldest first, or only the newest ``limit`` of them"""
+        return self.backend.get_history(limit)
 
-    def get_stats_summary(self):
-        """Get a summary of usage statistics"""
-        return {
-            "total_rewrites": self.stats["total_rewrites"],
-            "total_characters": self.stats["total_characters"],
-            "avg_text_length": round(self.stats["avg_text_length"], 2),
-            "last_updated": self.stats.get("last_updated", "Never")
-        } 
\ No newline at end of file
+    def get_page(self, limit=20, before_id=None):
+        """Return one page of entries newest first, older than the ``before_id`` cursor
+
+        Once the hot history runs out the page continues into the archive, which
+        only decompresses the months it needs.
+        """
+        page = self.backend.get_page(limit, before_id)
+        if len(page) < limit:
+            cursor = page[-1]['id'] if page else before_id
+            page += self.archive.get_page(limit - len(page), cursor)
+        return page
+
+    def iter_entries(self, start_date=None, end_date=None):
+        """Yield entries oldest first, archived ones included, a chunk or a month at a time
+
+        ``start_date`` and ``end_date`` are inclusive ``YYYY-MM-DD`` strings.
+        """
+        last_id = 0
+        for entry in self.archive.iter_entries(start_date, end_date):
+            last_id = entry['id']
+            yield entry
+        # Entries archived while we read the archive were yielded from it already
+        yield from self.backend.iter_entries(start_date, end_date, after_id=last_id)
+
+    def search(self, query, limit=20, start_date=None, end_date=None):
+        """Full-text search over original and rewritten text, best match first
+
+        ``start_date`` and ``end_date`` are inclusive ``YYYY-MM-DD`` strings.
+        """
+        return self.backend.search(query, limit, start_date, end_date)
+
+    def close(self):
+        self.backend.close()
+
+
+class HistoryRollup(UsageReports):
+    """Usage summed over the shared history and every user's shard
+
+    Only each shard's stats are read, never its entries, and a shard is
+    read again only when its files change. Writes never touch the rollup,
+    so it adds no contention between users.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, data_dir="data", storage=None):
+        self.data_dir = data_dir
+        self.storage = storage or os.getenv("HISTORY_STORAGE", "journal")
+        self._lock = threading.Lock()
+        # Shard directory -> (file signatures, stats)
+        self._shards = {}
+        self._merged = (None, None)
+
+    @classmethod
+    def shared(cls, data_dir="data", storage=None):
+        """Return the process-wide rollup for ``data_dir``, so unchanged shards aren't re-read"""
+        key = (os.path.abspath(data_dir), storage)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(data_dir=data_dir, storage=storage)
+            return cls._shared[key]
+
+    @property
+    def users(self):
+        """Number of users with a shard"""
+        return len(shard_dirs(self.data_dir)) - 1
+
+    @property
+    def stats(self):
+        with self._lock:
+            shards = {}
+            for shard in shard_dirs(self.data_dir):
+                # Taken before reading, so a write during the read is picked up next time
+                signature = tuple(_file_signature(path) for path in stats_files(self.storage, shard))
+                cached = self._shards.get(shard)
+                if cached is None or cached[0] != signature:
+                    try:
+                        cached = (signature, read_stats(self.storage, shard))
+                    except Exception as e:
+                        print(f"Error reading stats for {shard}: {e}")
+                        continue
+                shards[shard] = cached
+            self._shards = shards
+            key = tuple((shard, signature) for shard, (signature, _) in shards.items())
+            if self._merged[0] != key:
+                self._merged = (key, merge_stats(stats for _, stats in shards.values()))
+            return self._merged[1]
+
+
+def assign_shared_history(data_dir, user):
+    """Move the shared history and its archive into ``user``'s shard; returns the names moved
+
+    Run it with the app stopped. Refuses if the user already has a history.
+    """
+    target = user_dir(data_dir, user)
+    if os.path.isdir(target) and os.listdir(target):
+        raise RuntimeError(f"{target} already holds a history")
+    names = [name for name in sorted(os.listdir(data_dir))
+             if name.startswith(("user_history", "usage_stats")) or name == "archive"]
+    os.makedirs(target, exist_ok=True)
+    for name in names:
+        os.replace(os.path.join(data_dir, name), os.path.join(target, name))
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-user history shards")
+    parser.add_argument("command", choices=["assign", "rollup"],
+                        help="assign: move the shared history into --user's shard; "
+                             "rollup: print usage summed over every shard")
+    parser.add_argument("--user", help="user to assign the shared history to")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--storage", default=None, help="json, journal, sqlite or mapped")
+    args = parser.parse_args()
+
+    if args.command == "assign":
+        if not args.user:
+            parser.error("assign needs --user")
+        moved = assign_shared_history(args.data_dir, args.user)
+        print(f"Moved {', '.join(moved) or 'nothing'} into {user_dir(args.data_dir, args.user)}")
+    else:
+        rollup = HistoryRollup(args.data_dir, storage=args.storage)
+        summary = rollup.get_stats_summary()
+        print(f"{summary['total_rewrites']:,} rewrites and {summary['total_characters']:,} characters "
+              f"across {rollup.users:,} user shards and the shared history, "
+              f"last updated {summary['last_updated']}")
+
+
+if __name__ == "__main__":
+    main()